@@ -10,6 +10,7 @@ case $1 in
 		;;
 	migrate)
 		python manage.py migrate
+		python manage.py ensure_storage_indexes
 		exit 0
 		;;
 	load-fixtures)
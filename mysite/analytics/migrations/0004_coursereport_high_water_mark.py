@@ -0,0 +1,28 @@
+# Generated by Django 2.2.13 on 2026-10-19 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_auto_20180512_1527'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursereport',
+            name='last_response_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursereport',
+            name='last_response_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursereport',
+            name='since_response_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
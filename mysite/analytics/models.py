@@ -32,9 +32,42 @@ class UploadTo(object):
 class CourseReport(models.Model):
     """
     Handles Course reports.
+
+    `last_response_id` is the high-water mark of the report: the next
+    incremental report only extracts responses past it. Delta reports
+    keep the mark they start from in `since_response_id`, full and merged
+    reports cover the whole course history.
+
+    Response ids are taken from a sequence and are not committed in id order.
+    Marks of incremental reports only cover responses older than
+    settings.REPORT_HIGH_WATER_MARK_LAG, so a response committed later than that
+    after its `atime` with an id below the mark is missing from them. Full
+    reports include the latest responses and are marked by the latest id, so
+    an incremental report continuing a full one may also miss a response
+    committing while the full report is made. A new full report includes both.
     """
+    FULL = 'full'
+    DELTA = 'delta'
+    MERGE = 'merge'
+    MODES = (FULL, DELTA, MERGE)
+
+    # report formats are written by analytics.reports, kept here to check them without loading pandas
+    FORMATS = ('json', 'jsonl', 'csv', 'xlsx', 'parquet')
+    MERGE_FORMATS = ('json', 'jsonl', 'csv', 'parquet')
+
     addedBy = models.ForeignKey(User, blank=True, null=True, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     response_report = models.FileField(upload_to=UploadTo('reports/responses'), blank=True, null=True)
     error_report = models.FileField(upload_to=UploadTo('reports/errors/'), blank=True, null=True)
+    last_response_id = models.IntegerField(blank=True, null=True)
+    last_response_time = models.DateTimeField(blank=True, null=True)
+    since_response_id = models.IntegerField(blank=True, null=True)
+
+    @property
+    def report_format(self):
+        return os.path.splitext(self.response_report.name)[1][1:] if self.response_report else None
+
+    @property
+    def is_delta(self):
+        return self.since_response_id is not None
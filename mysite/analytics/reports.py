@@ -0,0 +1,278 @@
+"""
+Course response reports.
+
+One extraction engine serves the `report` task and the `get_report` command:
+report rows are read with `values_list()` in chunks of settings.REPORT_CHUNK_SIZE,
+turned into pandas DataFrames column-wise and written chunk by chunk, so
+memory does not grow with the course size.
+
+Supported formats are the keys of REPORT_FORMATS, the same as
+CourseReport.FORMATS, format names are used as file extensions.
+
+Incremental reports extract only responses with ids past the high-water mark
+of a previous report. They are written either as a delta or appended to the
+previous report file (CourseReport.MERGE_FORMATS only).
+
+The module loads pandas and pyarrow, import it from Celery tasks and
+management commands only, never from views.
+"""
+import io
+import json
+import logging
+import textwrap
+from datetime import timedelta
+from itertools import islice
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+from pytz.exceptions import UnknownTimeZoneError
+from django.conf import settings
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from ct.models import Lesson, Response
+from lti.models import LTIUser
+
+
+log = logging.getLogger(__name__)
+
+SUBMITTED_TIME_FORMAT = "%d-%m-%Y-%H:%M:%SZ%z"
+
+QUERY_FIELDS = (
+    'id', 'author_id', 'author__username', 'author__first_name', 'author__last_name',
+    'author__profile__timezone', 'lti_identity', 'text', 'sub_kind', 'lesson__text',
+    'confidence', 'selfeval', 'status', 'unitLesson_id', 'unitLesson__unit_id', 'atime', 'is_trial',
+)
+
+REPORT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('author_id', pa.int64()),
+    ('author_name', pa.string()),
+    ('lti_identity', pa.string()),
+    ('text', pa.string()),
+    ('confidence', pa.string()),
+    ('selfeval', pa.string()),
+    ('status', pa.string()),
+    ('unitLesson_id', pa.int64()),
+    ('courselet_id', pa.int64()),
+    ('submitted_time', pa.string()),
+    ('is_trial', pa.bool_()),
+])
+
+REPORT_COLUMNS = REPORT_SCHEMA.names
+
+
+def get_course_responses(course_id):
+    return Response.objects.filter(
+        Q(kind='orct') | Q(sub_kind='choices'), unitLesson__order__isnull=False, course__id=course_id
+    )
+
+
+def get_high_water_mark(course_id, lag=None):
+    """
+    Return (max id, max atime) of the course report responses, (None, None) if there are no responses.
+
+    Response ids are not assigned in commit order, so only responses older than
+    lag seconds (settings.REPORT_HIGH_WATER_MARK_LAG by default) are taken into
+    account: younger ones are left to the next report, while transactions still
+    running may hold lower ids which would be skipped by it.
+    """
+    responses = get_course_responses(course_id)
+    if lag is None:
+        lag = settings.REPORT_HIGH_WATER_MARK_LAG
+    if lag:
+        responses = responses.filter(atime__lte=timezone.now() - timedelta(seconds=lag))
+    mark = responses.aggregate(Max('id'), Max('atime'))
+    return mark['id__max'], mark['atime__max']
+
+
+def get_report_responses(course_id, after_id=None, up_to_id=None):
+    """
+    Return the first ORCT/choices response of each student per thread of the course.
+
+    With after_id/up_to_id only first responses with ids in (after_id, up_to_id] are returned,
+    earlier responses are still taken into account to find the first ones.
+    """
+    responses = get_course_responses(course_id)
+    first_response = responses.filter(
+        unitLesson=OuterRef('unitLesson'), author=OuterRef('author')
+    ).order_by('atime', 'id').values('id')[:1]
+    if after_id is not None:
+        responses = responses.filter(id__gt=after_id)
+    if up_to_id is not None:
+        responses = responses.filter(id__lte=up_to_id)
+    return responses.filter(
+        id=Subquery(first_response)
+    ).annotate(
+        lti_identity=LTIUser.identity_subquery('author')
+    ).order_by('id')
+
+
+class TimezoneCache(dict):
+    """
+    pytz timezones by name, unknown names fall back to settings.TIME_ZONE.
+    """
+    def __missing__(self, name):
+        try:
+            user_tz = pytz.timezone(name)
+        except UnknownTimeZoneError:
+            user_tz = pytz.timezone(settings.TIME_ZONE)
+            log.warning('User has incorrect time zone %s in Profile. Will use default TZ.', name)
+        self[name] = user_tz
+        return user_tz
+
+
+def show_choices(text, lesson_text):
+    return Response(sub_kind='choices', text=text, lesson=Lesson(text=lesson_text)).show_my_choices()
+
+
+def build_report_frame(frame, timezones):
+    """
+    Turn a DataFrame of QUERY_FIELDS into the report DataFrame.
+    """
+    full_name = (frame['author__first_name'] + ' ' + frame['author__last_name']).str.strip()
+    frame['author_name'] = full_name.where(full_name != '', frame['author__username'])
+
+    choices = frame['sub_kind'] == 'choices'
+    if choices.any():
+        frame.loc[choices, 'text'] = [
+            show_choices(text, lesson_text)
+            for text, lesson_text in zip(frame.loc[choices, 'text'], frame.loc[choices, 'lesson__text'])
+        ]
+
+    tz_names = frame['author__profile__timezone'].fillna('').replace('', settings.TIME_ZONE)
+    frame['submitted_time'] = ''
+    for tz_name, atime in pd.to_datetime(frame['atime'], utc=True).groupby(tz_names):
+        frame.loc[atime.index, 'submitted_time'] = atime.dt.tz_convert(timezones[tz_name]).dt.strftime(
+            SUBMITTED_TIME_FORMAT
+        )
+    return frame.rename(columns={'unitLesson__unit_id': 'courselet_id'})[REPORT_COLUMNS]
+
+
+def iter_report_frames(course_id, chunk_size=None, after_id=None, up_to_id=None):
+    """
+    Yield report DataFrames of the course, one per chunk of responses.
+    """
+    chunk_size = chunk_size or settings.REPORT_CHUNK_SIZE
+    responses = get_report_responses(course_id, after_id, up_to_id)
+    rows = responses.values_list(*QUERY_FIELDS).iterator(chunk_size=chunk_size)
+    timezones = TimezoneCache()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield build_report_frame(pd.DataFrame.from_records(chunk, columns=QUERY_FIELDS), timezones)
+
+
+def copy_file(source, output, size=None):
+    """
+    Copy size bytes (the whole file by default) of the source file to the output.
+    """
+    while size is None or size > 0:
+        data = source.read(io.DEFAULT_BUFFER_SIZE if size is None else min(io.DEFAULT_BUFFER_SIZE, size))
+        if not data:
+            break
+        output.write(data)
+        if size is not None:
+            size -= len(data)
+
+
+def write_json(frames, output, previous=None):
+    """
+    Write an indented JSON list, new rows are appended to the previous list.
+    """
+    started = False
+    if previous:
+        # drop the closing "\n]" of the previous list
+        copy_file(previous, output, previous.size - 2)
+        started = True
+    count = 0
+    for frame in frames:
+        for row in frame.to_dict('records'):
+            output.write(b',\n' if started else b'[\n')
+            output.write(textwrap.indent(json.dumps(row, indent=4), '    ').encode())
+            started = True
+            count += 1
+    if started:
+        output.write(b'\n]')
+    return count
+
+
+def write_jsonl(frames, output, previous=None):
+    if previous:
+        copy_file(previous, output)
+    count = 0
+    for frame in frames:
+        for row in frame.to_dict('records'):
+            output.write(json.dumps(row).encode() + b'\n')
+            count += 1
+    return count
+
+
+def write_csv(frames, output, previous=None):
+    if previous:
+        copy_file(previous, output)
+    count = 0
+    for frame in frames:
+        output.write(frame.to_csv(index=False, header=not (count or previous)).encode())
+        count += len(frame)
+    return count
+
+
+def write_xlsx(frames, output, previous=None):
+    if previous:
+        raise ValueError('xlsx reports can not be merged')
+    count = 0
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for frame in frames:
+            frame.to_excel(
+                writer, sheet_name='sheet1', index=False, header=not count, startrow=count + 1 if count else 0
+            )
+            count += len(frame)
+        if not count:
+            pd.DataFrame(columns=REPORT_COLUMNS).to_excel(writer, sheet_name='sheet1', index=False)
+    return count
+
+
+def write_parquet(frames, output, previous=None):
+    """
+    Write every chunk as a row group, row groups of the previous file are copied first.
+    """
+    count = 0
+    writer = pq.ParquetWriter(output, REPORT_SCHEMA)
+    try:
+        if previous:
+            previous_file = pq.ParquetFile(previous)
+            for i in range(previous_file.num_row_groups):
+                writer.write_table(previous_file.read_row_group(i))
+        for frame in frames:
+            writer.write_table(pa.Table.from_pandas(frame, schema=REPORT_SCHEMA, preserve_index=False))
+            count += len(frame)
+    finally:
+        writer.close()
+    return count
+
+
+REPORT_FORMATS = {
+    'json': write_json,
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+    'xlsx': write_xlsx,
+    'parquet': write_parquet,
+}
+
+
+def write_report(course_id, output, report_format='json', chunk_size=None, after_id=None, up_to_id=None,
+                 previous=None):
+    """
+    Write the course report to the binary output in report_format.
+
+    Only responses with ids in (after_id, up_to_id] are extracted, rows are
+    appended to the previous report file of the same format if it is given.
+
+    Return number of written new rows.
+    """
+    frames = iter_report_frames(course_id, chunk_size, after_id, up_to_id)
+    return REPORT_FORMATS[report_format](frames, output, previous)
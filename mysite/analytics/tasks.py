@@ -1,109 +1,74 @@
-import pytz
-from pytz.exceptions import UnknownTimeZoneError
-from accounts.models import Profile
-from mysite import celery_app
-
-import json
 import uuid
-from io import BytesIO
+from tempfile import TemporaryFile
 
-from django.conf import settings
 from django.core.files import File
 from django.contrib.auth.models import User
-from django.db.models import Q
 
-from ct.models import Response
+from mysite import celery_app
 from .models import CourseReport
 
 
-@celery_app.task
-def report(course_id, user_id):
-    report = []
-    user = User.objects.filter(id=user_id).first()
+def get_previous_report(course_id, report_format, mode):
+    """
+    Return the report an incremental report continues, None if there is none.
 
-    lesson_responses = {}
-    last_resps = []
-
-    q = Response.objects.filter(
-        Q(kind='orct') | Q(sub_kind='choices'), unitLesson__order__isnull=False, course__id=course_id
-    )
-
-    for obj in q:
-        ul_resps = lesson_responses.setdefault(obj.unitLesson, {})
-        user_resps = ul_resps.setdefault(obj.author, [])
-        user_resps.append(obj)
+    Deltas continue the last report of the course, merges continue the last
+    full or merged report of the same format.
+    """
+    reports = CourseReport.objects.filter(course_id=course_id, last_response_id__isnull=False)
+    if mode == CourseReport.MERGE:
+        reports = reports.filter(
+            since_response_id__isnull=True, response_report__endswith='.{}'.format(report_format)
+        )
+    return reports.order_by('-last_response_id', '-id').first()
 
-    for _, user_resps in list(lesson_responses.items()):
-        for _, respss in list(user_resps.items()):
-            if respss:
-                last_resps.append(sorted(respss, key=lambda o: o.atime)[0])
 
-    for obj in last_resps:
-        _id = obj.id
-        author_id = obj.author.id
-        author_name = obj.author.get_full_name() or obj.author.username
-        lti_user = obj.author.lti_auth.first()
-        if lti_user:
-            lti_identity = lti_user.user_id
-        else:
-            lti_identity = None
-        if obj.sub_kind == 'choices':
-            text = obj.show_my_choices()
-        else:
-            text = obj.text
-        confidence = obj.confidence
-        selfeval = obj.selfeval
-        status = obj.status
-        unitLesson_id = obj.unitLesson.id
-        courselet_id = obj.unitLesson.unit.id
-        submit_time = obj.atime
-        is_trial = obj.is_trial
-
-        try:
-            u_tz = obj.author.profile.timezone or settings.TIME_ZONE
-        except Profile.DoesNotExist:
-            u_tz = settings.TIME_ZONE
+@celery_app.task
+def report(course_id, user_id, report_format='json', mode=CourseReport.FULL):
+    """
+    Save the report of first student responses of the course in report_format.
 
-        try:
-            user_tz = pytz.timezone(u_tz)
-        except UnknownTimeZoneError as e:
-            user_tz = pytz.timezone(settings.TIME_ZONE)
-            print("User has incorrect time zone in Profile. Will use default TZ.")
+    Responses are read in chunks and written to a temporary file, so the
+    report is never held in memory as a whole. Delta and merge reports only
+    extract responses past the high-water mark of the previous report, the
+    first report of the course and xlsx merges are full reports, but like
+    other incremental reports stop at the lagged high-water mark.
+    """
+    from .reports import get_high_water_mark, write_report  # pandas is loaded by workers only
 
-        localized_ts = submit_time.astimezone(user_tz).strftime("%d-%m-%Y-%H:%M:%SZ%z")
+    user = User.objects.filter(id=user_id).first()
+    incremental = mode in (CourseReport.DELTA, CourseReport.MERGE)
+    # full reports include the latest responses, incremental ones stop at the lagged mark
+    last_response_id, last_response_time = get_high_water_mark(course_id, lag=None if incremental else 0)
+    if incremental and last_response_id is None:
+        last_response_id = 0  # no response is old enough yet
+    previous = None
+    if mode == CourseReport.DELTA or (mode == CourseReport.MERGE and report_format in CourseReport.MERGE_FORMATS):
+        previous = get_previous_report(course_id, report_format, mode)
+    since_response_id = previous.last_response_id if previous else None
 
-        r = dict(
-          id=_id,
-          author_id=author_id,
-          author_name=author_name,
-          lti_identity=lti_identity,
-          text=text,
-          confidence=confidence,
-          selfeval=selfeval,
-          status=status,
-          unitLesson_id=unitLesson_id,
-          courselet_id=courselet_id,
-          submitted_time=localized_ts,
-          is_trial=is_trial
-        )
-        report.append(r)
-    if report:
-        report_dumped_indent = json.dumps(report, indent=4)
-        output = BytesIO()
-        output.write(report_dumped_indent.encode())
-        try:
-            file_instance = File(
-              file=output,
-              name="{}.json".format(uuid.uuid4().hex)
-            )
-            course_report = CourseReport(
-                course_id=course_id,
-                response_report=file_instance,
-                addedBy=user
+    with TemporaryFile() as output:
+        if mode == CourseReport.MERGE and previous:
+            with previous.response_report.open('rb') as previous_file:
+                count = write_report(
+                    course_id, output, report_format,
+                    after_id=since_response_id, up_to_id=last_response_id, previous=previous_file
+                )
+        else:
+            count = write_report(
+                course_id, output, report_format, after_id=since_response_id, up_to_id=last_response_id
             )
-            course_report.save()
-        finally:
-            output.close()
-        print('Done')
-    else:
-        print('Nothing to report')
+        if not count:
+            print('Nothing to report')
+            return
+        output.seek(0)
+        course_report = CourseReport(
+            course_id=course_id,
+            response_report=File(file=output, name="{}.{}".format(uuid.uuid4().hex, report_format)),
+            addedBy=user,
+            last_response_id=last_response_id,
+            last_response_time=last_response_time,
+            since_response_id=since_response_id if mode == CourseReport.DELTA else None,
+        )
+        course_report.save()
+    print('Done')
@@ -1,3 +1,274 @@
-from django.test import TestCase
+import io
+import json
+import os
+import subprocess
+import sys
+from datetime import timedelta
 
-# Create your tests here.
+import pandas as pd
+from openpyxl import load_workbook
+import pytest
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from accounts.models import Profile
+from ct.models import Response
+from lti.models import LTIUser
+from .models import CourseReport
+from .reports import REPORT_COLUMNS, REPORT_FORMATS, get_high_water_mark, iter_report_frames, write_report
+from .tasks import report
+
+
+@pytest.fixture
+def report_responses(lesson_question, unit_lesson, course, user):
+    now = timezone.now() - timedelta(hours=1)
+    return [
+        Response.objects.create(
+            lesson=lesson_question, unitLesson=unit_lesson, course=course,
+            text=text, author=user, confidence=Response.GUESS, atime=now + timedelta(minutes=delta)
+        )
+        for text, delta in (('second', 5), ('first', 0), ('third', 10))
+    ]
+
+
+def read_xlsx(f):
+    header, *rows = load_workbook(f).active.values
+    return pd.DataFrame(list(rows), columns=header)
+
+
+def report_rows(course_id, chunk_size=None):
+    return [row for frame in iter_report_frames(course_id, chunk_size) for row in frame.to_dict('records')]
+
+
+@pytest.mark.django_db
+def test_report_first_response(report_responses, user, course, unit_lesson):
+    LTIUser.objects.create(user_id='lti_id', extra_data='{}', django_user=user)
+    Profile.objects.update_or_create(user=user, defaults={'timezone': 'Europe/Kiev'})
+
+    rows = report_rows(course.id)
+
+    assert len(rows) == 1
+    assert list(rows[0]) == REPORT_COLUMNS
+    assert rows[0]['id'] == report_responses[1].id
+    assert rows[0]['text'] == 'first'
+    assert rows[0]['lti_identity'] == 'lti_id'
+    assert rows[0]['author_name'] == user.username
+    assert rows[0]['unitLesson_id'] == unit_lesson.id
+    assert rows[0]['courselet_id'] == unit_lesson.unit_id
+    assert rows[0]['submitted_time'] == report_responses[1].atime.astimezone(
+        timezone.pytz.timezone('Europe/Kiev')
+    ).strftime("%d-%m-%Y-%H:%M:%SZ%z")
+
+
+@pytest.mark.django_db
+def test_report_chunks(report_responses, course, unit, user, django_user_model):
+    student = django_user_model.objects.create_user(username='student', first_name='Jo', last_name='Doe')
+    lesson = unit.create_lesson('choices', 'Which?\r\n[choices]\r\n() one\r\n(*) two', user)
+    unit_lesson = lesson.unitlesson_set.get()
+    Response.objects.create(
+        lesson=lesson, unitLesson=unit_lesson, course=course, kind=Response.ORCT_RESPONSE, sub_kind='choices',
+        text='[selected_choices] 1', author=student, confidence=Response.GUESS
+    )
+
+    rows = report_rows(course.id, chunk_size=1)
+
+    assert [(row['author_name'], row['text']) for row in rows] == [
+        ('admin', 'first'), ('Jo Doe', '(*) two')
+    ]
+
+
+@pytest.mark.django_db
+def test_report_queries(report_responses, course, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        rows = report_rows(course.id)
+    assert rows[0]['lti_identity'] is None
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('report_format, read', [
+    ('json', lambda f: pd.DataFrame(json.load(f))),
+    ('jsonl', lambda f: pd.read_json(f, lines=True)),
+    ('csv', pd.read_csv),
+    ('xlsx', read_xlsx),
+    ('parquet', pd.read_parquet),
+])
+def test_write_report(report_responses, course, report_format, read):
+    output = io.BytesIO()
+
+    assert write_report(course.id, output, report_format) == 1
+
+    output.seek(0)
+    frame = read(output)
+    assert list(frame.columns) == REPORT_COLUMNS
+    assert frame['id'].tolist() == [report_responses[1].id]
+
+
+def test_report_formats():
+    assert sorted(REPORT_FORMATS) == sorted(CourseReport.FORMATS)
+    assert set(CourseReport.MERGE_FORMATS) < set(CourseReport.FORMATS)
+
+
+def test_views_do_not_load_pandas():
+    code = (
+        'import sys, django; django.setup(); import api.v0.views; '
+        'sys.exit(bool({"pandas", "pyarrow"} & set(sys.modules)))'
+    )
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='mysite.settings.test')
+    assert subprocess.run([sys.executable, '-c', code], env=env, cwd=settings.BASE_DIR).returncode == 0
+
+
+@pytest.mark.django_db
+def test_report(report_responses, user, course, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    report(course.id, user.id)
+
+    course_report = CourseReport.objects.get(course=course)
+    with course_report.response_report.open('rb') as f:
+        rows = json.loads(f.read().decode())
+    assert [row['id'] for row in rows] == [report_responses[1].id]
+
+
+@pytest.mark.django_db
+def test_report_csv(report_responses, user, course, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    report(course.id, user.id, 'csv')
+
+    course_report = CourseReport.objects.get(course=course)
+    assert course_report.response_report.name.endswith('.csv')
+
+
+@pytest.mark.django_db
+def test_report_empty(user, course):
+    report(course.id, user.id)
+
+    assert not CourseReport.objects.filter(course=course).exists()
+
+
+@pytest.mark.django_db
+def test_get_report_command(report_responses, course, tmpdir):
+    with tmpdir.as_cwd():
+        call_command('get_report', course.id, '--format', 'csv', '--format', 'parquet')
+        files = sorted(os.listdir(str(tmpdir)))
+
+    assert [os.path.splitext(name)[1] for name in files] == ['.csv', '.parquet']
+
+
+def read_report(course_report):
+    with course_report.response_report.open('rb') as f:
+        return READERS[course_report.report_format](f)
+
+
+READERS = {
+    'json': lambda f: pd.DataFrame(json.load(f)),
+    'jsonl': lambda f: pd.read_json(f, lines=True),
+    'csv': pd.read_csv,
+    'xlsx': read_xlsx,
+    'parquet': pd.read_parquet,
+}
+
+
+def create_response(response, author, text='new'):
+    return Response.objects.create(
+        lesson=response.lesson, unitLesson=response.unitLesson, course=response.course,
+        text=text, author=author, confidence=Response.GUESS
+    )
+
+
+@pytest.mark.django_db
+def test_report_high_water_mark(report_responses, user, course, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+
+    report(course.id, user.id)
+
+    course_report = CourseReport.objects.get(course=course)
+    assert course_report.last_response_id == report_responses[-1].id
+    assert course_report.last_response_time == report_responses[-1].atime
+    assert not course_report.is_delta
+
+
+@pytest.mark.django_db
+def test_high_water_mark_lag(report_responses, course, settings):
+    settings.REPORT_HIGH_WATER_MARK_LAG = 2 * 60 * 60
+    # responses of still running transactions may get lower ids, so fresh responses are not marked
+    assert get_high_water_mark(course.id) == (None, None)
+
+    atime = timezone.now() - timedelta(hours=3)
+    Response.objects.filter(id=report_responses[0].id).update(atime=atime)
+    assert get_high_water_mark(course.id) == (report_responses[0].id, atime)
+
+
+@pytest.mark.django_db
+def test_report_delta(report_responses, user, course, settings, tmpdir, django_user_model):
+    settings.MEDIA_ROOT = str(tmpdir)
+    report(course.id, user.id)
+    first_report = CourseReport.objects.get(course=course)
+    # not the first response of the student, does not get into reports
+    create_response(report_responses[0], user, 'later')
+    new_response = create_response(report_responses[0], django_user_model.objects.create_user(username='student'))
+
+    report(course.id, user.id, 'csv', CourseReport.DELTA)
+
+    delta = CourseReport.objects.exclude(id=first_report.id).get()
+    assert delta.is_delta
+    assert delta.since_response_id == first_report.last_response_id
+    assert delta.last_response_id == new_response.id
+    assert read_report(delta)['id'].tolist() == [new_response.id]
+
+
+@pytest.mark.django_db
+def test_report_delta_nothing_new(report_responses, user, course, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    report(course.id, user.id)
+
+    report(course.id, user.id, 'json', CourseReport.DELTA)
+
+    assert CourseReport.objects.filter(course=course).count() == 1
+
+
+@pytest.mark.django_db
+def test_report_lag(report_responses, user, course, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    settings.REPORT_HIGH_WATER_MARK_LAG = 2 * 60 * 60
+    # every response is younger than the lag: incremental reports wait for them
+    report(course.id, user.id, 'json', CourseReport.DELTA)
+    assert not CourseReport.objects.filter(course=course).exists()
+
+    # full reports include the latest responses
+    report(course.id, user.id)
+    course_report = CourseReport.objects.get(course=course)
+    assert course_report.last_response_id == report_responses[-1].id
+    with course_report.response_report.open('rb') as f:
+        assert [row['id'] for row in json.load(f)] == [report_responses[1].id]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('report_format', ['json', 'jsonl', 'csv', 'parquet', 'xlsx'])
+def test_report_merge(report_responses, user, course, settings, tmpdir, django_user_model, report_format):
+    settings.MEDIA_ROOT = str(tmpdir)
+    report(course.id, user.id, report_format)
+    new_response = create_response(report_responses[0], django_user_model.objects.create_user(username='student'))
+
+    report(course.id, user.id, report_format, CourseReport.MERGE)
+
+    merged = CourseReport.objects.filter(course=course).order_by('id').last()
+    assert not merged.is_delta
+    assert merged.last_response_id == new_response.id
+    frame = read_report(merged)
+    assert list(frame.columns) == REPORT_COLUMNS
+    assert frame['id'].tolist() == [report_responses[1].id, new_response.id]
+
+
+@pytest.mark.django_db
+def test_report_merge_skips_deltas(report_responses, user, course, settings, tmpdir, django_user_model):
+    settings.MEDIA_ROOT = str(tmpdir)
+    report(course.id, user.id)
+    new_response = create_response(report_responses[0], django_user_model.objects.create_user(username='student'))
+    report(course.id, user.id, 'json', CourseReport.DELTA)
+
+    report(course.id, user.id, 'json', CourseReport.MERGE)
+
+    merged = CourseReport.objects.filter(course=course).order_by('id').last()
+    assert read_report(merged)['id'].tolist() == [report_responses[1].id, new_response.id]
@@ -0,0 +1,75 @@
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.fields import DateTimeField, IntegerField
+from rest_framework.generics import get_object_or_404
+from rest_framework.utils.encoders import JSONEncoder
+
+from ct.models import Course
+from .pagination import KeysetPagination
+from .permissions import IsInstructor
+
+
+class CourseReportListMixin(object):
+    """
+    Keyset paginated list of course objects for the course instructor.
+
+    Query params:
+     - `since`, `until` - datetime range of `date_field`
+     - `courselet` - Unit id, compared with `courselet_field`
+     - `stream` - return all objects as one streamed JSON list instead of pages
+    """
+    authentication_classes = (SessionAuthentication,)
+    permission_classes = (IsInstructor,)
+    pagination_class = KeysetPagination
+    course_field = None
+    date_field = None
+    courselet_field = None
+
+    def get_queryset(self):
+        course = get_object_or_404(Course, id=self.kwargs.get('course_id'))
+        self.check_object_permissions(
+            self.request, course
+        )
+        queryset = super(CourseReportListMixin, self).get_queryset()
+        return queryset.filter(**{self.course_field: course.id})
+
+    def filter_queryset(self, queryset):
+        queryset = super(CourseReportListMixin, self).filter_queryset(queryset)
+        params = self.request.query_params
+        if params.get('since'):
+            queryset = queryset.filter(
+                **{self.date_field + '__gte': DateTimeField().to_internal_value(params['since'])}
+            )
+        if params.get('until'):
+            queryset = queryset.filter(
+                **{self.date_field + '__lt': DateTimeField().to_internal_value(params['until'])}
+            )
+        if params.get('courselet'):
+            queryset = queryset.filter(**{self.courselet_field: IntegerField().to_internal_value(params['courselet'])})
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') not in ('1', 'true'):
+            return super(CourseReportListMixin, self).list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset()).order_by('id')
+        return StreamingHttpResponse(self.stream(queryset), content_type='application/json')
+
+    def stream(self, queryset):
+        """
+        Yield JSON list of serialized objects, settings.API_STREAM_CHUNK_SIZE objects at once.
+        """
+        chunk_size = settings.API_STREAM_CHUNK_SIZE
+        objects = queryset.iterator(chunk_size=chunk_size)
+        separator = ''
+        yield '['
+        while True:
+            chunk = list(islice(objects, chunk_size))
+            if not chunk:
+                break
+            yield separator + json.dumps(self.get_serializer(chunk, many=True).data, cls=JSONEncoder)[1:-1]
+            separator = ','
+        yield ']'
@@ -6,4 +6,4 @@ class IsInstructor(permissions.BasePermission):
     Check that user is asked for object is owner/user of the course(obj).
     """
     def has_object_permission(self, request, view, obj):
-        return obj.addedBy == request.user
+        return obj.addedBy_id == request.user.id
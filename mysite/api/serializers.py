@@ -6,11 +6,14 @@ from analytics.models import CourseReport
 
 
 class ResponseSerializer(serializers.ModelSerializer):
+    """
+    Response serializer, `lti_identity` is annotated by LTIUser.identity_subquery('author').
+    """
     author_id = serializers.ReadOnlyField()
     author_name = serializers.SerializerMethodField()
-    lti_identity = serializers.SerializerMethodField()
+    lti_identity = serializers.ReadOnlyField()
     unitLesson_id = serializers.ReadOnlyField()
-    courselet_id = serializers.ReadOnlyField(source='unitLesson.unit.id')
+    courselet_id = serializers.ReadOnlyField(source='unitLesson.unit_id')
     submitted_time = serializers.SerializerMethodField()
 
     class Meta:
@@ -35,14 +38,6 @@ class ResponseSerializer(serializers.ModelSerializer):
         """
         return obj.author.get_full_name() or obj.author.username
 
-    def get_lti_identity(self, obj):
-        """
-        Returning LTI user_id.
-        """
-        lti_user = obj.author.lti_auth.first()
-        if lti_user:
-            return lti_user.user_id
-
     def get_submitted_time(self, obj):
         """
         Return Response submitted time.
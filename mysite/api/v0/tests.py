@@ -1,7 +1,10 @@
 import json
+from datetime import timedelta
 from unittest import mock
 
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from pymongo.errors import ServerSelectionTimeoutError
 
@@ -10,8 +13,9 @@ from analytics.models import CourseReport
 from api.v0.utils import get_result_course_calculation
 from core.common.mongo import c_onboarding_status
 from core.common import onboarding
-from ct.models import UnitLesson, StudentError, Concept
+from ct.models import UnitLesson, StudentError, Concept, Response
 from ctms.tests import MyTestCase
+from lti.models import LTIUser
 
 
 HEALTH_URL = reverse('api:v0:health-check')
@@ -29,6 +33,18 @@ def test_health_positive(client, db):
     assert 'ok' in json.loads(result.content)
 
 
+def test_health_pool_staff_only(client, db, mocker, user):
+    do_health = mocker.patch('api.v0.views.do_health')
+    do_health.return_value = {'ok': 1.0}, {'ok': 1.0}
+
+    assert 'pool' not in json.loads(client.get(HEALTH_URL).content)
+
+    user.is_staff = True
+    user.save()
+    client.force_login(user)
+    assert 'in_use' in json.loads(client.get(HEALTH_URL).content)['pool']
+
+
 def test_health_non_ok(client, db, mocker):
     """
     Ping and Stats Mongo command return non ok results.
@@ -166,10 +182,61 @@ class TestResponseViewSet(ApiAccessMixinTest, MyTestCase):
     def test_serializer_author_name(self):
         response = self.client.get(reverse(self.namespace, kwargs={'course_id': self.course.id}))
         self.assertEqual(
-            json.loads(response.content)[0].get('author_name'),
+            json.loads(response.content)['results'][0].get('author_name'),
             self.user.get_full_name() or self.user.username
         )
 
+    def test_serializer_lti_identity(self):
+        LTIUser.objects.create(user_id='lti_id', extra_data='{}', django_user=self.user)
+        response = self.client.get(reverse(self.namespace, kwargs={'course_id': self.course.id}))
+        self.assertEqual(json.loads(response.content)['results'][0]['lti_identity'], 'lti_id')
+
+    def test_queries(self):
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        with self.assertNumQueries(5):
+            # session, user, site, course and the page
+            self.client.get(url, data={'page_size': 1})
+
+    def test_keyset_pagination(self):
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        page = json.loads(self.client.get(url, data={'page_size': 1}).content)
+        self.assertEqual([item['id'] for item in page['results']], [self.resp1.id])
+
+        page = json.loads(self.client.get(page['next']).content)
+        self.assertEqual([item['id'] for item in page['results']], [self.resp2.id])
+        self.assertIsNone(page['next'])
+
+    def test_filters(self):
+        Response.objects.filter(id=self.resp1.id).update(atime=timezone.now() - timedelta(days=2))
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        page = json.loads(self.client.get(url, data={'since': since}).content)
+        self.assertEqual([item['id'] for item in page['results']], [self.resp2.id])
+
+        page = json.loads(self.client.get(url, data={'until': since}).content)
+        self.assertEqual([item['id'] for item in page['results']], [self.resp1.id])
+
+        page = json.loads(self.client.get(url, data={'courselet': self.unit.id + 1}).content)
+        self.assertEqual(page['results'], [])
+
+    def test_invalid_filter(self):
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        self.assertEqual(self.client.get(url, data={'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, data={'courselet': 'first'}).status_code, 400)
+
+    @override_settings(API_STREAM_CHUNK_SIZE=1)
+    def test_stream(self):
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        response = self.client.get(url, data={'stream': 1, 'courselet': self.unit.id})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([item['id'] for item in data], [self.resp1.id, self.resp2.id])
+
+    def test_stream_empty(self):
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        response = self.client.get(url, data={'stream': 1, 'courselet': self.unit.id + 1})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), [])
+
 
 class TestErrorViewSet(ApiAccessMixinTest, MyTestCase):
 
@@ -200,9 +267,22 @@ class TestErrorViewSet(ApiAccessMixinTest, MyTestCase):
         fields_set = set([
             'id', 'lesson_concept_id', 'lesson_concept_isAbort', 'lesson_concept_isFail', 'lesson_text', 'treeID'
         ])
-        em_data_set = set(json.loads(response.content)[0]['em_data'])
+        em_data_set = set(json.loads(response.content)['results'][0]['em_data'])
         self.assertSetEqual(fields_set, em_data_set)
 
+    def test_queries(self):
+        StudentError.objects.create(response=self.resp2, errorModel=self.unit_lesson_error, author=self.user)
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        with self.assertNumQueries(5):
+            # session, user, site, course and the page
+            self.client.get(url)
+
+    def test_stream(self):
+        url = reverse(self.namespace, kwargs={'course_id': self.course.id})
+        response = self.client.get(url, data={'stream': 'true'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([item['id'] for item in data], [self.student_error.id])
+
 
 class TestGenReportView(MyTestCase):
     namespace = 'api:v0:gen-report'
@@ -224,7 +304,32 @@ class TestGenReportView(MyTestCase):
     def test_report_generated(self, report):
         response = self.client.get(reverse(self.namespace), data={'course_id': self.course.id})
         self.assertEqual(response.status_code, 200)
-        report.assert_called_with(str(self.course.id), self.user.id)
+        report.assert_called_with(str(self.course.id), self.user.id, report_format='json', mode='full')
+
+    @mock.patch('api.v0.views.report.delay')
+    def test_report_format(self, report):
+        response = self.client.get(
+            reverse(self.namespace),
+            data={'course_id': self.course.id, 'report_format': 'parquet', 'report_mode': 'delta'}
+        )
+        self.assertEqual(response.status_code, 200)
+        report.assert_called_with(str(self.course.id), self.user.id, report_format='parquet', mode='delta')
+
+    @mock.patch('api.v0.views.report.delay')
+    def test_report_format_not_supported(self, report):
+        response = self.client.get(
+            reverse(self.namespace), data={'course_id': self.course.id, 'report_format': 'doc'}
+        )
+        self.assertEqual(response.status_code, 400)
+        report.assert_not_called()
+
+    @mock.patch('api.v0.views.report.delay')
+    def test_report_mode_not_supported(self, report):
+        response = self.client.get(
+            reverse(self.namespace), data={'course_id': self.course.id, 'report_mode': 'weekly'}
+        )
+        self.assertEqual(response.status_code, 400)
+        report.assert_not_called()
 
 
 class TestCourseReportViewSet(ApiAccessMixinTest, MyTestCase):
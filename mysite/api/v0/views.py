@@ -15,9 +15,13 @@ from analytics.tasks import report
 from ct.models import Response, StudentError, Course, Role, Unit
 from ctms.forms import BestPractice1Form, BestPractice2Form
 from ctms.models import BestPractice, BestPracticeTemplate
-from core.common.mongo import do_health, c_onboarding_status
-from core.common import onboarding
-from core.common.utils import get_onboarding_steps, get_onboarding_status_with_settings, create_intercom_event
+from core.common.mongo import do_health, get_pool_metrics
+from core.common.utils import (
+    get_onboarding_steps, get_onboarding_status, get_onboarding_status_with_settings, set_onboarding_steps,
+    create_intercom_event
+)
+from lti.models import LTIUser
+from ..mixins import CourseReportListMixin
 from ..permissions import IsInstructor
 from ..serializers import ResponseSerializer, ErrorSerializer, CourseReportSerializer, UnitSerializer
 from .utils import get_result_course_calculation, get_result_courselet_calculation
@@ -26,45 +30,36 @@ from .utils import get_result_course_calculation, get_result_courselet_calculati
 logger = logging.getLogger(__name__)
 
 
-class ResponseViewSet(viewsets.mixins.ListModelMixin, viewsets.GenericViewSet):
+class ResponseViewSet(CourseReportListMixin, viewsets.mixins.ListModelMixin, viewsets.GenericViewSet):
     """
     Django RestFramework class to implement Course student responses report.
     """
-    authentication_classes = (SessionAuthentication,)
-    permission_classes = (IsInstructor,)
-    queryset = Response.objects.filter(kind='orct', unitLesson__order__isnull=False)
+    queryset = Response.objects.filter(
+        kind='orct', unitLesson__order__isnull=False
+    ).select_related('author', 'unitLesson').annotate(lti_identity=LTIUser.identity_subquery('author'))
     serializer_class = ResponseSerializer
+    course_field = 'course__id'
+    date_field = 'atime'
+    courselet_field = 'unitLesson__unit_id'
 
-    def get_queryset(self):
-        course = get_object_or_404(Course, id=self.kwargs.get('course_id'))
-        self.check_object_permissions(
-            self.request, course
-        )
-        queryset = super(ResponseViewSet, self).get_queryset()
-        return queryset.filter(course__id=self.kwargs.get('course_id'))
 
-
-class ErrorViewSet(viewsets.mixins.ListModelMixin, viewsets.GenericViewSet):
+class ErrorViewSet(CourseReportListMixin, viewsets.mixins.ListModelMixin, viewsets.GenericViewSet):
     """
     Django RestFramework class to implement Course student errors report.
     """
-    authentication_classes = (SessionAuthentication,)
-    permission_classes = (IsInstructor,)
-    queryset = StudentError.objects.all()
+    queryset = StudentError.objects.select_related('errorModel__lesson__concept')
     serializer_class = ErrorSerializer
-
-    def get_queryset(self):
-        course = get_object_or_404(Course, id=self.kwargs.get('course_id'))
-        self.check_object_permissions(
-            self.request, course
-        )
-        queryset = super(ErrorViewSet, self).get_queryset()
-        return queryset.filter(response__course__id=self.kwargs.get('course_id'))
+    course_field = 'response__course__id'
+    date_field = 'atime'
+    courselet_field = 'response__unitLesson__unit_id'
 
 
 class GenReportView(APIView):
     """
     Start `report` Celery task for `course_id`.
+
+    `report_format` is one of CourseReport.FORMATS, json by default.
+    `report_mode` is one of CourseReport.MODES, full by default.
     """
     authentication_classes = (SessionAuthentication,)
 
@@ -72,6 +67,12 @@ class GenReportView(APIView):
         course_id = request.GET.get('course_id')
         if not course_id:
             return RestResponse('course_id is not provided', status=400)
+        report_format = request.GET.get('report_format', 'json')
+        if report_format not in CourseReport.FORMATS:
+            return RestResponse('report_format is not supported', status=400)
+        report_mode = request.GET.get('report_mode', CourseReport.FULL)
+        if report_mode not in CourseReport.MODES:
+            return RestResponse('report_mode is not supported', status=400)
         course = get_object_or_404(Course, id=course_id)
         course_instructors = course.role_set.filter(role=Role.INSTRUCTOR).values_list('user_id', flat=True)
         if (
@@ -79,7 +80,7 @@ class GenReportView(APIView):
                 not course.addedBy == request.user
         ):
             return RestResponse('action is not allowed', status=403)
-        report.delay(course_id, request.user.id)
+        report.delay(course_id, request.user.id, report_format=report_format, mode=report_mode)
         return RestResponse(status=200)
 
 
@@ -116,6 +117,8 @@ class EchoDataView(APIView):
 class HealthCheck(APIView):
     """
     Sevice health check.
+
+    Mongo connection pool counters are shown to staff users only.
     """
 
     def get(self, request, *args, **kwargs):
@@ -131,7 +134,8 @@ class HealthCheck(APIView):
                 # TODO implement analyzing and return more descriptive response
                 response = RestResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
             else:
-                response = RestResponse(ping, status=status.HTTP_200_OK)
+                data = dict(ping, pool=get_pool_metrics()) if request.user.is_staff else ping
+                response = RestResponse(data, status=status.HTTP_200_OK)
 
         return response
 
@@ -148,9 +152,7 @@ class OnboardingStatus(APIView):
             k: bool(v) for k, v in list(steps_to_update.items()) if k in get_onboarding_steps()
         }
         if to_update and request.user.id:
-            projection = {k: 1 for k, v in list(to_update.items())}
-            projection['_id'] = 0
-            passed_steps = c_onboarding_status().find_one({onboarding.USER_ID: user_id}, projection) or {}
+            passed_steps = get_onboarding_status(user_id)
             for step in to_update:
                 if to_update[step] and not passed_steps.get(step):
                     create_intercom_event(
@@ -159,7 +161,7 @@ class OnboardingStatus(APIView):
                         email=request.user.email,
                         metadata={'step': step}
                     )
-            c_onboarding_status().update_one({onboarding.USER_ID: user_id}, {'$set': to_update}, upsert=True)
+            set_onboarding_steps(user_id, to_update)
             return RestResponse({'status': 'Ok'}, status=status.HTTP_200_OK)
         return RestResponse({'status': 'Failed'}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -1,4 +1,5 @@
 import base64
+import hashlib
 from itertools import chain
 
 import injections
@@ -7,6 +8,10 @@ from django.http.response import Http404
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import ValidationError
+from django.db.models import Q, Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.encoding import force_bytes
 from rest_framework.parsers import JSONParser
 from rest_framework import viewsets, generics
 from rest_framework.views import APIView
@@ -19,8 +24,10 @@ from chat.views import CheckChatInitialView, InitializeLiveSession, CourseletPre
 from chat.services import ProgressHandler, FsmHandler
 from chat.permissions import IsOwner
 from core.common import onboarding
-from core.common.mongo import c_faq_data, c_chat_context
-from core.common.utils import get_onboarding_setting, update_onboarding_step
+from core.common.mongo import c_faq_data
+from core.common.chat_context import get_chat_context
+from core.common.utils import ONBOARDING_STEP, get_onboarding_setting
+from core.outbox import publish
 from lti.utils import key_secret_generator
 from .models import Message, Chat, ChatDivider, EnrollUnitCode
 from .views import ChatInitialView
@@ -49,37 +56,42 @@ def get_additional_messages(response, chat, selected: list) -> None:
     """
     student_errors = response.studenterror_set.filter(errorModel__id__in=selected)
     dummy_ul = UnitLesson.objects.filter(lesson__title='Hope you\'ve overcame the misconception').first()
+    lookups = []
     for each in student_errors:
         if not each.errorModel.get_em_resolutions()[1]:
-            Message.objects.get_or_create(contenttype='unitlesson', content_id=dummy_ul.id, chat=chat,
-                                          owner=chat.user,
-                                          input_type='custom',
-                                          student_error=each,
-                                          kind='message',
-                                          text='Hope you\'ve overcame the misconception',
-                                          is_additional=True)
-        [Message.objects.get_or_create(contenttype='unitlesson',
-                                       content_id=ul.id,
-                                       chat=chat,
-                                       owner=chat.user,
-                                       input_type='custom',
-                                       student_error=each,
-                                       kind='message',
-                                       is_additional=True) for ul in reversed(each.errorModel.get_em_resolutions()[1])]
+            lookups.append(dict(contenttype='unitlesson', content_id=dummy_ul.id, chat=chat,
+                                owner=chat.user,
+                                input_type='custom',
+                                student_error=each,
+                                kind='message',
+                                text='Hope you\'ve overcame the misconception',
+                                is_additional=True))
+        lookups.extend(dict(contenttype='unitlesson',
+                            content_id=ul.id,
+                            chat=chat,
+                            owner=chat.user,
+                            input_type='custom',
+                            student_error=each,
+                            kind='message',
+                            is_additional=True) for ul in reversed(each.errorModel.get_em_resolutions()[1]))
+    Message.objects.bulk_get_or_create(lookups)
 
 
 def get_help_messages(chat):
     """
     Emit HELP additional messages.
     """
-    for each in chat.enroll_code.courseUnit.unit.get_aborts():
-        [Message.objects.get_or_create(contenttype='unitlesson',
-                                       content_id=ul.id,
-                                       chat=chat,
-                                       owner=chat.user,
-                                       input_type='custom',
-                                       kind='abort',
-                                       is_additional=True) for ul in reversed(each.get_em_resolutions()[1])]
+    Message.objects.bulk_get_or_create([
+        dict(contenttype='unitlesson',
+             content_id=ul.id,
+             chat=chat,
+             owner=chat.user,
+             input_type='custom',
+             kind='abort',
+             is_additional=True)
+        for each in chat.enroll_code.courseUnit.unit.get_aborts()
+        for ul in reversed(each.get_em_resolutions()[1])
+    ])
 
 
 class ValidateMixin(object):
@@ -533,9 +545,81 @@ class InitNewChat(ValidateMixin, generics.RetrieveAPIView):
 class HistoryView(ValidateMixin, generics.RetrieveAPIView):
     """
     List all messages in chat w/ additional info.
+
+    Optional params:
+        after - message id or ISO 8601 timestamp, return only later messages
+        before - message id or ISO 8601 timestamp, return only earlier messages
+        limit - return only this many latest messages, see hasOlderMessages
+
+    Responds with 304 if If-None-Match matches the ETag of chat history.
     """
     permission_classes = (IsAuthenticated, IsOwner)
 
+    def validate_cursor(self, chat, cursor, lookup):
+        """
+        Return Q selecting chat messages `lookup` ('gt' or 'lt') than `cursor`.
+        """
+        if cursor.isdigit():
+            message = chat.message_set.filter(id=cursor, timestamp__isnull=False).first()
+            if not message:
+                raise ValidationError('There is no message by cursor {}.'.format(cursor))
+            return (
+                Q(**{'timestamp__' + lookup: message.timestamp}) |
+                Q(**{'timestamp': message.timestamp, 'id__' + lookup: message.id})
+            )
+        timestamp = parse_datetime(cursor)
+        if not timestamp:
+            raise ValidationError('Cursor should be a message id or a timestamp.')
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return Q(**{'timestamp__' + lookup: timestamp})
+
+    def get_etag(self, chat):
+        """
+        Return ETag of chat history.
+
+        Edits of messages, of responses, lessons and dividers shown by them
+        change `updated`, so they change the ETag too.
+        """
+        messages = chat.message_set.exclude(timestamp__isnull=True)
+        stats = messages.aggregate(
+            count=Count('id'), last_id=Max('id'), last_timestamp=Max('timestamp'), last_updated=Max('updated')
+        )
+        responses_updated = StudentResponse.objects.get_all_responses_queryset().filter(
+            Q(id__in=messages.filter(contenttype='response').values('content_id')) |
+            Q(id__in=messages.filter(response_to_check__isnull=False).values('response_to_check_id'))
+        ).aggregate(last_updated=Max('updated'))['last_updated']
+        # courselet lessons cover questions, answers and error models shown by unitlesson and uniterror messages
+        lessons_updated = Lesson.objects.filter(
+            Q(unitlesson__unit__courseunit__enrollunitcode=chat.enroll_code_id) |
+            Q(unitlesson__id__in=messages.filter(contenttype='unitlesson').values('content_id'))
+        ).aggregate(last_updated=Max('updated'))['last_updated']
+        dividers_updated = ChatDivider.objects.filter(
+            id__in=messages.filter(contenttype='chatdivider').values('content_id')
+        ).aggregate(last_updated=Max('updated'))['last_updated']
+        key = (
+            chat.id, chat.state_id, chat.state.fsmNode_id if chat.state else None, chat.next_point_id,
+            stats['count'], stats['last_id'], stats['last_timestamp'], stats['last_updated'], responses_updated,
+            lessons_updated, dividers_updated,
+            sorted(self.request.GET.items()),
+        )
+        return '"{}"'.format(hashlib.md5(force_bytes(repr(key))).hexdigest())
+
+    def get_history_params(self, chat):
+        """
+        Return ChatHistorySerializer context built from cursor and limit params.
+        """
+        context = {'cursors': []}
+        for param, lookup in (('after', 'gt'), ('before', 'lt')):
+            if self.request.GET.get(param):
+                context['cursors'].append(self.validate_cursor(chat, self.request.GET[param], lookup))
+        limit = self.request.GET.get('limit')
+        if limit:
+            if not limit.isdigit() or not int(limit):
+                raise ValidationError('limit should be a positive number.')
+            context['limit'] = int(limit)
+        return context
+
     def get(self, request, *args, **kwargs):
         chat_id = self.request.GET.get('chat_id')
         try:
@@ -543,8 +627,16 @@ class HistoryView(ValidateMixin, generics.RetrieveAPIView):
         except ValidationError as e:
             return Response({'errors': str(e)})
         self.check_object_permissions(self.request, chat)
-        serializer = ChatHistorySerializer(chat)
-        return Response(serializer.data)
+        try:
+            context = self.get_history_params(chat)
+        except ValidationError as e:
+            return Response({'errors': str(e)})
+        etag = self.get_etag(chat)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        serializer = ChatHistorySerializer(chat, context=context)
+        return Response(serializer.data, headers={'ETag': etag})
 
 
 class ProgressView(ValidateMixin, generics.RetrieveAPIView):
@@ -570,7 +662,7 @@ class ProgressView(ValidateMixin, generics.RetrieveAPIView):
         if course_id == get_onboarding_setting(onboarding.INTRODUCTION_COURSE_ID) and \
             courselet_id == get_onboarding_setting(onboarding.INTRODUCTION_COURSELET_ID) and \
                 serializer_data.get('progress', 0) * 100 >= 70:
-            update_onboarding_step(onboarding.STEP_2, self.request.user.id)
+            publish(ONBOARDING_STEP, step=onboarding.STEP_2, user_id=self.request.user.id)
         return Response(serializer_data)
 
 
@@ -680,8 +772,9 @@ class UpdatesView(ValidateMixin, APIView):
         unitlesson = get_object_or_404(UnitLesson, pk=pk)
 
         if chat.state:
-            saved_actual_ul = c_chat_context().find_one({"chat_id": chat.id}).get('actual_ul_id')
-            thread = c_chat_context().find_one({"chat_id": chat.id}).get('thread_id')
+            context = get_chat_context(chat.id)
+            saved_actual_ul = context.get('actual_ul_id')
+            thread = context.get('thread_id')
             chat.state.set_data_attr('saved_next_point', chat.next_point.id)
             chat.state.set_data_attr('saved_actual_ul', saved_actual_ul)
             chat.state.set_data_attr('thread', thread)
@@ -2,11 +2,11 @@ from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 
-from core.common.mongo import c_chat_context
-from ct.models import UnitStatus, UnitLesson, Lesson, NEED_HELP_STATUS, NEED_REVIEW_STATUS
+from core.common.chat_context import get_chat_context
+from ct.models import UnitStatus, UnitLesson, Lesson
 from ct.templatetags.ct_extras import md2html
 from chat.models import Message, ChatDivider
-from chat.utils import is_last_thread, has_updates
+from chat.utils import is_last_thread, has_updates, get_updated_thread
 
 
 def next_lesson_after_errors(self, edge, fsmStack, request, useCurrent=False, **kwargs):
@@ -14,7 +14,7 @@ def next_lesson_after_errors(self, edge, fsmStack, request, useCurrent=False, **
     Edge method that moves us to right state for next lesson (or END).
     """
     fsm = edge.fromNode.fsm
-    if c_chat_context().find_one({"chat_id": fsmStack.id}).get('need_faqs'):
+    if get_chat_context(fsmStack.id).get('need_faqs'):
         return fsm.get_node('FAQ')
 
     return edge.toNode
@@ -56,16 +56,12 @@ def next_lesson_after_title(self, edge, fsmStack, request, useCurrent=False, **k
     # Update chat context
     # Don't ask
     chat = fsmStack
-    c_chat_context().update_one(
-        {"chat_id": chat.id},
-        {"$set": {
-            "actual_ul_id": answer.id if answer else nextUL.id,
-            "thread_id": nextUL.id,
-            f"activity.{nextUL.id}": timezone.now(),
-            "need_faqs": False
-        }},
-        upsert=True
-    )
+    get_chat_context(chat.id).set({
+        "actual_ul_id": answer.id if answer else nextUL.id,
+        "thread_id": nextUL.id,
+        f"activity.{nextUL.id}": timezone.now(),
+        "need_faqs": False
+    }, upsert=True)
     if nextUL.is_question():
         return fsm.get_node(name='ASK')
     else:  # just a lesson to read
@@ -82,11 +78,7 @@ def check_selfassess_and_next_lesson(self, edge, fsmStack, request, useCurrent=F
         if (fsmStack.next_point.content.unitLesson.get_errors() or
                 fsmStack.next_point.content.lesson.add_unit_aborts and
                 fsmStack.next_point.content.unitLesson.unit.get_aborts()):
-            c_chat_context().update_one(
-                {"chat_id": fsmStack.id},
-                {"$set": {"need_faqs": True}},
-                upsert=True
-            )
+            get_chat_context(fsmStack.id).set({"need_faqs": True}, upsert=True)
             return fsm.get_node('ERRORS')
         else:
             resp = fsmStack.next_point.content
@@ -151,13 +143,9 @@ class TITLE(object):
     )
 
     def _update_thread_id(self, chat, thread_id):
-        c_chat_context().update_one(
-            {"chat_id": chat.id},
-            {"$set": {
-                "thread_id": thread_id,
-            }},
-            upsert=True
-        )
+        get_chat_context(chat.id).set({
+            "thread_id": thread_id,
+        }, upsert=True)
 
     def get_message(self, chat, next_lesson, is_additional, *args, **kwargs):
         self._update_thread_id(chat, next_lesson.id)
@@ -174,7 +162,8 @@ class TITLE(object):
             'chat': chat,
             'owner': chat.user,
             'kind': 'message',
-            'is_additional': is_additional
+            'is_additional': is_additional,
+            'thread_id': next_lesson.id
         }
         message = Message(**_data)
         message.save()
@@ -278,11 +267,7 @@ class INCORRECT_CHOICE(object):
         if (fsmStack.next_point.content.unitLesson.get_errors() or
                 fsmStack.next_point.content.lesson.add_unit_aborts and
                 fsmStack.next_point.content.unitLesson.unit.get_aborts()):
-            c_chat_context().update_one(
-                {"chat_id": fsmStack.id},
-                {"$set": {"need_faqs": True}},
-                upsert=True
-            )
+            get_chat_context(fsmStack.id).set({"need_faqs": True}, upsert=True)
             return fsm.get_node('ERRORS')
         else:
             return fsm.get_node('FAQ')
@@ -419,27 +404,15 @@ class TRANSITION(object):
             return edge.toNode
 
     def get_message(self, chat, next_lesson, is_additional, *args, **kwargs) -> Message:
-        threads = chat.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order')
         has_updates = {
             'enabled': False,
             'thread_id': None
         }
-        for thread in threads:
-            # TODO: move to a dedicated util
-            response_msg = chat.message_set.filter(
-                lesson_to_answer_id=thread.id,
-                kind='response',
-                contenttype='response',
-                content_id__isnull=False).last()
-            if not response_msg:
-                continue
-            response = response_msg.content
-            is_need_help = response.status in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS)
-            if is_need_help and thread.updates_count(chat) > 0:
-                has_updates.update({'thread_id': thread.id})
-                chat.state.set_data_attr('next_update', has_updates)
-                chat.state.save_json_data()
-                break
+        thread = get_updated_thread(chat)
+        if thread:
+            has_updates.update({'thread_id': thread.id})
+            chat.state.set_data_attr('next_update', has_updates)
+            chat.state.save_json_data()
         if has_updates['thread_id']:
             unitStatus = chat.state.get_data_attr('unitStatus')
             next_lesson = unitStatus.get_next_lesson()
@@ -1,7 +1,8 @@
 from django.db.models import Q
 
 from ct.models import UnitStatus, Response, InquiryCount
-from core.common.mongo import c_faq_data, c_chat_context
+from core.common.mongo import c_faq_data
+from core.common.chat_context import get_chat_context
 
 from .chat import get_lesson_url
 
@@ -122,10 +123,9 @@ class GET_FOR_FAQ_ANSWER(object):
     def next_edge(self, edge, fsmStack, request, useCurrent=False, **kwargs):
         fsm = edge.fromNode.fsm
         next_node = edge.toNode
-        ul_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_ul_id')
+        ul_id = get_chat_context(fsmStack.id).get('actual_ul_id')
         if fsmStack.next_point.text.lower() == 'yes':
-            actual_faq_id = c_chat_context().find_one(
-                {"chat_id": fsmStack.id}).get('actual_faq_id', None)
+            actual_faq_id = get_chat_context(fsmStack.id).get('actual_faq_id', None)
             faq = Response.objects.filter(id=int(actual_faq_id)).first()
             try:
                 ob, _ = InquiryCount.objects.get_or_create(response=faq, addedBy=request.user)
@@ -134,10 +134,7 @@ class GET_FOR_FAQ_ANSWER(object):
                     response=faq, addedBy=request.user
                 ).order_by('-atime').first()
             faq.notify_instructors()
-            c_chat_context().update_one(
-                {"chat_id": fsmStack.id},
-                {"$set": {"actual_inquiry_id": ob.id}},
-            )
+            get_chat_context(fsmStack.id).set({"actual_inquiry_id": ob.id})
 
             faq_answers = faq.response_set.all()
             if faq_answers:
@@ -176,9 +173,8 @@ class SHOW_FAQ_ANSWERS(object):
     def next_edge(self, edge, fsmStack, request, useCurrent=False, **kwargs):
         fsm = edge.fromNode.fsm
 
-        ul_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_ul_id')
-        actual_faq_id = c_chat_context().find_one(
-            {"chat_id": fsmStack.id}).get('actual_faq_id', None)
+        ul_id = get_chat_context(fsmStack.id).get('actual_ul_id')
+        actual_faq_id = get_chat_context(fsmStack.id).get('actual_faq_id', None)
         if actual_faq_id:
             faq_answers = c_faq_data().find_one(
                 {
@@ -218,7 +214,7 @@ class GET_UNDERSTANDING(object):
 
     def next_edge(self, edge, fsmStack, request, useCurrent=False, **kwargs):
         fsm = edge.fromNode.fsm
-        inquiry_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_inquiry_id')
+        inquiry_id = get_chat_context(fsmStack.id).get('actual_inquiry_id')
         if inquiry_id:
             ob = InquiryCount.objects.filter(id=inquiry_id).first()
             ob.status = fsmStack.next_point.text.lower()
@@ -230,7 +226,7 @@ class GET_UNDERSTANDING(object):
         if fsmStack.next_point.text.lower() == 'help':
             next_node = fsm.get_node('WILL_TRY_MESSAGE_3')
         else:
-            ul_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_ul_id')
+            ul_id = get_chat_context(fsmStack.id).get('actual_ul_id')
 
             show_another_faq = False
             for key, value in list(self.get_pending_faqs(chat_id=fsmStack.id, ul_id=ul_id).items()):
@@ -259,7 +255,7 @@ class WILL_TRY_MESSAGE_2(object):
 
     def next_edge(self, edge, fsmStack, request, useCurrent=False, **kwargs):
         fsm = edge.fromNode.fsm
-        ul_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_ul_id')
+        ul_id = get_chat_context(fsmStack.id).get('actual_ul_id')
 
         show_another_faq = False
         for key, value in list(self.get_pending_faqs(chat_id=fsmStack.id, ul_id=ul_id).items()):
@@ -285,7 +281,7 @@ class WILL_TRY_MESSAGE_3(object):
 
     def next_edge(self, edge, fsmStack, request, useCurrent=False, **kwargs):
         fsm = edge.fromNode.fsm
-        ul_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_ul_id')
+        ul_id = get_chat_context(fsmStack.id).get('actual_ul_id')
 
         show_another_faq = False
         for key, value in list(self.get_pending_faqs(chat_id=fsmStack.id, ul_id=ul_id).items()):
@@ -311,7 +307,7 @@ class SELECT_NEXT_FAQ(object):
 
     def next_edge(self, edge, fsmStack, request, useCurrent=False, **kwargs):
         fsm = edge.fromNode.fsm
-        ul_id = c_chat_context().find_one({"chat_id": fsmStack.id}).get('actual_ul_id')
+        ul_id = get_chat_context(fsmStack.id).get('actual_ul_id')
 
         show_another_faq = False
         for key, value in list(self.get_pending_faqs(chat_id=fsmStack.id, ul_id=ul_id).items()):
@@ -1,4 +1,4 @@
-from core.common.mongo import c_chat_context
+from core.common.chat_context import get_chat_context
 from chat.models import Message, ChatDivider
 
 
@@ -175,13 +175,9 @@ class TITLE(object):
     )
 
     def _update_thread_id(self, chat, thread_id):
-        c_chat_context().update_one(
-            {"chat_id": chat.id},
-            {"$set": {
-                "thread_id": thread_id,
-            }},
-            upsert=True
-        )
+        get_chat_context(chat.id).set({
+            "thread_id": thread_id,
+        }, upsert=True)
 
     def get_message(self, chat, next_lesson, is_additional, *args, **kwargs):
         self._update_thread_id(chat, next_lesson.id)
@@ -198,7 +194,8 @@ class TITLE(object):
             'chat': chat,
             'owner': chat.user,
             'kind': 'message',
-            'is_additional': is_additional
+            'is_additional': is_additional,
+            'thread_id': next_lesson.id
         }
         message = Message(**_data)
         message.save()
@@ -1,6 +1,6 @@
 from ct.models import UnitStatus
 
-from core.common.mongo import c_chat_context
+from core.common.chat_context import get_chat_context
 from chat.models import Message
 
 
@@ -63,13 +63,9 @@ class START(object):
         )
 
     def _update_thread_id(self, chat, thread_id):
-        c_chat_context().update_one(
-            {"chat_id": chat.id},
-            {"$set": {
-                "thread_id": thread_id,
-            }},
-            upsert=True
-        )
+        get_chat_context(chat.id).set({
+            "thread_id": thread_id,
+        }, upsert=True)
 
     next_edge = next_lesson
     # node specification data goes here
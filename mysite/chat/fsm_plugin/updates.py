@@ -6,11 +6,11 @@ from django.db.models import Q
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
-from core.common.mongo import c_chat_context
-from ct.models import UnitStatus, Response, NEED_HELP_STATUS, DONE_STATUS, NEED_REVIEW_STATUS
+from core.common.chat_context import get_chat_context
+from ct.models import UnitStatus, Response, NEED_HELP_STATUS, DONE_STATUS
 from ct.templatetags.ct_extras import md2html
 from chat.models import Message, UnitError, YES_NO_OPTIONS
-from chat.utils import is_last_thread, has_updates
+from chat.utils import is_last_thread, has_updates, get_updated_thread
 
 
 class START(object):
@@ -26,15 +26,11 @@ class START(object):
 
     # TODO add unittests
     def update_activity(self, chat_id: int, thread_id: int) -> None:
-        c_chat_context().update_one(
-            {"chat_id": chat_id},
-            {"$set": {
-                "thread_id": thread_id,
-                f"activity.{thread_id}": timezone.now(),
-                "need_faqs": False
-            }},
-            upsert=True
-        )
+        get_chat_context(chat_id).set({
+            "thread_id": thread_id,
+            f"activity.{thread_id}": timezone.now(),
+            "need_faqs": False
+        }, upsert=True)
 
     def collect_updates(self, node, fsmStack, request, **kwargs):
         # TODO add unittests
@@ -47,8 +43,7 @@ class START(object):
             content_id__isnull=False).first().content
         affected_ems = [i.errorModel for i in response.studenterror_set.all()]
 
-        context = c_chat_context().find_one({"chat_id": chat.id})
-        last_access_time = context.get('activity', {}).get(f"{unit_lesson.id}") if context else None
+        last_access_time = get_chat_context(chat.id).get('activity', {}).get(f"{unit_lesson.id}")
         tz_aware_datetime = (
             last_access_time.replace(tzinfo=tz.tzutc()) if last_access_time else
             chat.last_modify_timestamp.replace(tzinfo=tz.tzutc()))
@@ -135,10 +130,7 @@ class UPDATES(object):
                 'new_ems' in data,
                 'new_faqs' in data)):
             text = 'There are new updates for a Thread you asked for a help.'
-            c_chat_context().update_one(
-                {"chat_id": chat.id},
-                {"$set": {"actual_ul_id": chat.state.unitLesson.id}}
-            )
+            get_chat_context(chat.id).set({"actual_ul_id": chat.state.unitLesson.id})
         else:
             text = 'I can\'t find updates for you.'
         _data = {
@@ -537,25 +529,7 @@ class GET_ACT(object):
     def next_edge(self, edge, *args, **kwargs):
         if not args[0].state.parentState:
             chat = args[0]
-            threads = chat.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order')
-            has_updates = False
-
-            for thread in threads:
-                # TODO: move to a dedicated util
-                response_msg = chat.message_set.filter(
-                    lesson_to_answer_id=thread.id,
-                    kind='response',
-                    contenttype='response',
-                    content_id__isnull=False).last()
-                if not response_msg:
-                    continue
-                response = response_msg.content
-                is_need_help = response.status in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS)
-                if is_need_help and thread.updates_count(chat) > 0:
-                    has_updates = True
-                    break
-
-            if not has_updates:
+            if not get_updated_thread(chat):
                 return edge.fromNode.fsm.get_node('END')
 
         return edge.toNode
@@ -630,28 +604,15 @@ class TRANSITION(object):
         return edge.toNode
 
     def get_message(self, chat, next_lesson, is_additional, *args, **kwargs) -> Message:
-        threads = chat.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order')
         has_updates = {
             'enabled': False,
             'thread_id': None
         }
-
-        for thread in threads:
-            # TODO: move to a dedicated util
-            response_msg = chat.message_set.filter(
-                lesson_to_answer_id=thread.id,
-                kind='response',
-                contenttype='response',
-                content_id__isnull=False).last()
-            if not response_msg:
-                continue
-            response = response_msg.content
-            is_need_help = response.status in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS)
-            if is_need_help and thread.updates_count(chat) > 0:
-                has_updates.update({'thread_id': thread.id})
-                chat.state.set_data_attr('next_update', has_updates)
-                chat.state.save_json_data()
-                break
+        thread = get_updated_thread(chat)
+        if thread:
+            has_updates.update({'thread_id': thread.id})
+            chat.state.set_data_attr('next_update', has_updates)
+            chat.state.save_json_data()
 
         if has_updates['thread_id']:
             text = f"""
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.common.storage import get_storage
+
+
+class Command(BaseCommand):
+    """
+    Create indexes of settings.CHAT_STORAGE_BACKEND, run it on deploy and after QUESTION_STACK_TTL changes.
+    """
+    help = 'Create chat storage indexes'
+
+    def handle(self, *args, **options):
+        get_storage().ensure_indexes()
+        self.stdout.write('Indexes of {} are ensured'.format(get_storage().__class__.__name__))
@@ -1,44 +1,129 @@
-from functools import reduce
+import datetime
+import logging
+from multiprocessing import Pool
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
 
-from chat.serializers import LessonSerializer
+from chat.serializers import ChatProgressSerializer
 from chat.models import Chat
 
 
+log = logging.getLogger(__name__)
+
+
+def get_chat_progress(chat, messages=None, lessons=None):
+    """
+    Return chat progress in percents, computed from chat breakpoints.
+
+    Outdated stored breakpoints are rebuilt into chat.progress_data, which is
+    left for the caller to save. messages and lessons are passed to
+    Chat.get_progress_key.
+    """
+    progress_key = chat.get_progress_key(messages, lessons)
+    lessons_dict = chat.load_progress(progress_key)
+    if lessons_dict is None:
+        lessons_dict = ChatProgressSerializer().build_breakpoints(chat)
+        chat.save_progress(progress_key, lessons_dict, commit=False)
+    if lessons_dict and chat.state:
+        done = sum(1 for lesson in lessons_dict if lesson['isDone'])
+        return int(round(float(done) / len(lessons_dict), 2) * 100)
+    # if no lessons passed yet - return 1
+    return 100
+
+
+def update_chats_progress(chat_ids):
+    """
+    Update progress and stored breakpoints of chats with given ids with one bulk UPDATE.
+
+    Return (last chat id, number of updated chats).
+    """
+    changed = []
+    chats = list(Chat.objects.filter(id__in=chat_ids).select_related(
+        'state__parentState', 'enroll_code__courseUnit__unit', 'user'
+    ))
+    messages, lessons = Chat.get_progress_aggregates(chats)
+    for chat in chats:
+        progress_data = chat.progress_data
+        try:
+            progress = get_chat_progress(chat, messages[chat.id], lessons[chat.enroll_code_id])
+        except Exception:
+            log.exception('Cannot update progress of chat %s', chat.id)
+            continue
+        if chat.progress != progress or chat.progress_data != progress_data:
+            chat.progress = progress
+            changed.append(chat)
+    Chat.objects.bulk_update(changed, ['progress', 'progress_data'])
+    return chat_ids[-1], len(changed)
+
+
+def close_connections():
+    connections.close_all()
+
+
 class Command(BaseCommand):
     """
     Update all Chats progress.
+
+    Chats are processed in chunks ordered by id, so an interrupted run can be
+    resumed with --after-id, and nightly runs can be limited with --since.
     """
+    help = 'Update progress of chats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only update chats created or modified since this date/datetime')
+        parser.add_argument('--after-id', type=int, default=0, help='Resume after chat with this id')
+        parser.add_argument('--batch-size', type=int, default=500, help='Chats per chunk')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+
+    def get_since(self, value):
+        try:
+            since = parse_datetime(value) or parse_date(value)
+        except ValueError:
+            since = None
+        if since is None:
+            raise CommandError('--since should be an ISO 8601 date or datetime.')
+        if not hasattr(since, 'hour'):
+            since = datetime.datetime.combine(since, datetime.time.min)
+        return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+    def iter_chunks(self, queryset, batch_size):
+        """
+        Yield lists of chat ids using keyset pagination.
+        """
+        last_id = None
+        while True:
+            chunk = queryset.filter(id__gt=last_id) if last_id else queryset
+            ids = list(chunk.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return
+            yield ids
+            last_id = ids[-1]
+
     def handle(self, *args, **options):
-        for chat in Chat.objects.all():
-            messages = chat.message_set.filter(contenttype='chatdivider', is_additional=False)
-            lessons = list(
-                chat.enroll_code.courseUnit.unit.unitlesson_set.filter(
-                    order__isnull=False
-                ).order_by('order')
-            )
-            for each in messages:
-                try:
-                    if each.content.unitlesson in lessons:
-                        lessons[lessons.index(each.content.unitlesson)].message = each.id
-                    elif each.content.unitlesson and each.content.unitlesson.kind != 'answers':
-                        lesson = each.content.unitlesson
-                        lesson.message = each.id
-                        lessons.append(lesson)
-                except:
-                    pass
-            lessons_dict = LessonSerializer(many=True).to_representation(lessons)
-
-            if lessons_dict and chat.state:
-                done = reduce(lambda x, y: x+y, [x['isDone'] for x in lessons_dict])
-                progress = round(float(done)/len(lessons_dict), 2)
-            else:
-                # if no lessons passed yet - return 1
-                progress = 1
-
-            if not chat.progress == (progress * 100):
-                chat.progress = progress * 100
-                chat.save()
-
-        self.stdout.write('Updated.')
+        started = timezone.now()
+        queryset = Chat.objects.filter(id__gt=options['after_id']).order_by('id')
+        if options['since']:
+            since = self.get_since(options['since'])
+            queryset = queryset.filter(Q(last_modify_timestamp__gte=since) | Q(timestamp__gte=since))
+        chunks = self.iter_chunks(queryset, max(options['batch_size'], 1))
+
+        updated = 0
+        if options['workers'] > 1:
+            close_connections()  # forked workers must not share the parent connection
+            with Pool(options['workers'], initializer=close_connections) as pool:
+                results = pool.imap(update_chats_progress, chunks)
+                for last_id, count in results:
+                    updated += count
+                    self.stdout.write('Processed chats up to id {}'.format(last_id))
+        else:
+            for last_id, count in map(update_chats_progress, chunks):
+                updated += count
+                self.stdout.write('Processed chats up to id {}'.format(last_id))
+
+        self.stdout.write('Updated {} chats. Use --since {} for the next run.'.format(
+            updated, started.isoformat()
+        ))
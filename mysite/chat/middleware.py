@@ -0,0 +1,13 @@
+from core.common.chat_context import chat_context_scope
+
+
+class ChatContextMiddleware(object):
+    """
+    Load each chat context once per request and write its changes at the end.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with chat_context_scope():
+            return self.get_response(request)
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_message_thread_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatdivider',
+            name='html',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatdivider',
+            name='sidebar_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_chatdivider_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='progress_data',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
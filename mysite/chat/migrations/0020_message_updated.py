@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-19 01:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_chat_progress_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-19 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0020_message_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatdivider',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -1,24 +1,31 @@
 import re
+import json
+import hashlib
+import operator
 from uuid import uuid4
+from collections import defaultdict
 from functools import reduce
 from itertools import starmap
 import datetime
 
+from django.apps import apps
 from django.db import models
-from django.db.models import Q
-from django.db.models import Count
+from django.db.models import Q, Prefetch
+from django.db.models import Count, Max, Sum, F
 from django.utils.text import Truncator
 from django.utils.functional import cached_property
 from django.contrib.auth.models import User
-from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from django.utils.encoding import force_bytes
 from django.conf import settings
 
 from core.common import onboarding
-from core.common.mongo import c_chat_context, c_faq_data
-from core.common.utils import update_onboarding_step
-from .utils import enroll_generator
+from core.common.mongo import c_faq_data
+from core.common.chat_context import get_chat_context
+from core.common.utils import ONBOARDING_STEP
+from core.outbox import publish
+from .utils import enroll_generator, get_threads_updates
 from ct.models import (
     CourseUnit,
     UnitLesson,
@@ -28,7 +35,7 @@ from ct.models import (
     Lesson,
     STATUS_CHOICES,
     StudentError,
-    NEED_HELP_STATUS,
+    RenderedTextMixin,
 )
 from ct.templatetags.ct_extras import md2html
 
@@ -46,6 +53,13 @@ MODEL_CHOISES = (
     ('unitlesson', 'unitlesson'),
     ('uniterror', 'uniterror'),
 )
+# Message.contenttype -> (content model, related rows used to render it)
+MESSAGE_CONTENT_MODELS = {
+    'chatdivider': ('chat.ChatDivider', ('unitlesson__lesson', 'unitlesson__addedBy')),
+    'response': ('ct.Response', ('lesson', 'author', 'unitLesson__lesson')),
+    'unitlesson': ('ct.UnitLesson', ('lesson', 'parent__lesson', 'addedBy')),
+    'uniterror': ('chat.UnitError', ('unit', 'response__unitLesson__lesson')),
+}
 
 MESSAGE_TYPES = (
     ('message', 'message'),
@@ -111,11 +125,85 @@ class Chat(models.Model):
     last_modify_timestamp = models.DateTimeField(null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     progress = models.IntegerField(default=0, blank=True, null=True)
+    progress_data = models.TextField(null=True, blank=True)  # JSON: breakpoints stored by save_progress
     is_trial = models.BooleanField(default=False)
 
     class Meta:
         ordering = ['-last_modify_timestamp']
 
+    PROGRESS_MESSAGES = dict(count=Count('id'), last_id=Max('id'), last_timestamp=Max('timestamp'))
+    PROGRESS_LESSONS = dict(
+        count=Count('id'), last_id=Max('id'),
+        order=Sum(F('id') * F('order'), output_field=models.BigIntegerField()),
+        lessons=Sum('lesson_id'), last_lesson_atime=Max('lesson__atime')
+    )
+
+    @classmethod
+    def get_progress_aggregates(cls, chats):
+        """
+        Return (messages, lessons) aggregates of get_progress_key for many chats with two grouped queries.
+
+        messages are keyed by chat id, lessons by enroll code id, missing keys
+        get the aggregates of an empty queryset.
+        """
+        messages = defaultdict(lambda: dict(dict.fromkeys(cls.PROGRESS_MESSAGES), count=0))
+        messages.update(
+            (row.pop('chat_id'), row) for row in Message.objects.filter(
+                chat__in=chats
+            ).order_by().values('chat_id').annotate(**cls.PROGRESS_MESSAGES)
+        )
+        lessons = defaultdict(lambda: dict(dict.fromkeys(cls.PROGRESS_LESSONS), count=0))
+        lessons.update(
+            (row.pop('unit__courseunit__enrollunitcode'), row) for row in UnitLesson.objects.filter(
+                unit__courseunit__enrollunitcode__in={chat.enroll_code_id for chat in chats}, order__isnull=False
+            ).order_by().values('unit__courseunit__enrollunitcode').annotate(**cls.PROGRESS_LESSONS)
+        )
+        return messages, lessons
+
+    def get_progress_key(self, messages=None, lessons=None):
+        """
+        Return fingerprint of what chat progress breakpoints depend on.
+
+        These are FSM position, chat messages and courselet lessons,
+        so any FSM transition or new message changes the key. Lesson titles
+        edited in place are not part of the key, such edits drop stored
+        progress in ct.signals.invalidate_lesson_caches.
+        messages and lessons are this chat's rows of get_progress_aggregates,
+        they are queried if omitted.
+        """
+        state = self.state
+        parent = state.parentState if state else None
+        if messages is None:
+            messages = self.message_set.aggregate(**self.PROGRESS_MESSAGES)
+        if lessons is None:
+            lessons = UnitLesson.objects.filter(
+                unit__courseunit__enrollunitcode=self.enroll_code_id, order__isnull=False
+            ).aggregate(**self.PROGRESS_LESSONS)
+        key = (
+            self.is_live,
+            tuple((s.id, s.fsmNode_id, s.unitLesson_id) if s else None for s in (state, parent)),
+            sorted(messages.items()),
+            sorted(lessons.items()),
+        )
+        return hashlib.md5(force_bytes(repr(key))).hexdigest()
+
+    def load_progress(self, key):
+        """
+        Return breakpoints stored for progress `key`, None if they are outdated.
+        """
+        if self.progress_data:
+            data = json.loads(self.progress_data)
+            if data.get('key') == key:
+                return data['breakpoints']
+
+    def save_progress(self, key, breakpoints, commit=True):
+        """
+        Store breakpoints for progress `key`, with commit=False the caller has to save progress_data.
+        """
+        self.progress_data = json.dumps({'key': key, 'breakpoints': breakpoints})
+        if commit:
+            Chat.objects.filter(id=self.id).update(progress_data=self.progress_data)
+
     def get_options(self):
         options = None
         if self.next_point.input_type == 'options':
@@ -164,26 +252,8 @@ class Chat(models.Model):
         Threshold settings: settings.NEW_UPDATES_THRESHOLD
         If there are no updates or insufficient updates count - return None
         """
-        threads = self.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order')
-        count = 0
-        for thread in threads:
-            # TODO: move this to a separate cashed util function
-            response_msg = self.message_set.filter(
-                lesson_to_answer_id=thread.id,
-                kind='response',
-                contenttype='response',
-                content_id__isnull=False).last()
-
-            if not response_msg:
-                continue
-
-            response = response_msg.content
-            is_need_help = response.status in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS) if response else None
-
-            if is_need_help:
-                count += thread.updates_count(self)
-                if count > settings.NEW_UPDATES_THRESHOLD:
-                    return True
+        if sum(get_threads_updates(self).values()) > settings.NEW_UPDATES_THRESHOLD:
+            return True
 
     @cached_property
     def is_history(self):
@@ -234,6 +304,92 @@ class Chat(models.Model):
         return all(is_done)
 
 
+def get_content_queryset(contenttype, prefetch=False):
+    """
+    Return queryset of Message content model for `contenttype`.
+
+    Responses are not filtered by is_preview, unlike Response.objects.
+    With prefetch=True also load rows that Message.get_html needs for
+    every message of a chat (question answers, error models).
+    """
+    model_label, related = MESSAGE_CONTENT_MODELS[contenttype]
+    queryset = apps.get_model(model_label)._base_manager.select_related(*related)
+    if prefetch and contenttype == 'unitlesson':
+        queryset = queryset.prefetch_related(Prefetch(
+            'parent__unitlesson_set',
+            queryset=UnitLesson.objects.filter(kind=UnitLesson.ANSWERS)
+            .select_related('lesson', 'parent__lesson').order_by('pk'),
+            to_attr='prefetched_answers'
+        ))
+    elif prefetch and contenttype == 'uniterror':
+        queryset = queryset.prefetch_related(Prefetch(
+            'response__unitLesson__unitlesson_set',
+            queryset=UnitLesson.objects.filter(kind=UnitLesson.MISUNDERSTANDS).select_related('lesson'),
+            to_attr='prefetched_errors'
+        ), 'response__studenterror_set')
+    return queryset
+
+
+class MessageQuerySet(models.QuerySet):
+    """
+    QuerySet able to load Message.content for all messages at once.
+    """
+    _with_content = False
+
+    def with_content(self):
+        """
+        Load content of fetched messages with one query per content type.
+        """
+        clone = self._chain()
+        clone._with_content = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_content = self._with_content
+        return clone
+
+    def _fetch_all(self):
+        prefetch = self._with_content and self._result_cache is None
+        super()._fetch_all()
+        if prefetch and self._iterable_class is models.query.ModelIterable:
+            Message.prefetch_content(self._result_cache)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create messages with one query, assigning active thread of their chats.
+        """
+        objs = list(objs)
+        threads = {}
+        for message in objs:
+            if message.thread_id is None and message.chat_id is not None:
+                if message.chat_id not in threads:
+                    threads[message.chat_id] = get_chat_context(message.chat_id).get('thread_id')
+                message.thread_id = threads[message.chat_id]
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_get_or_create(self, lookups):
+        """Like get_or_create() for a list of lookup dicts
+
+        Finds existing messages with one query and creates missing ones with
+        bulk_create(). Return messages in lookups order.
+        """
+        if not lookups:
+            return []
+        existing = list(self.filter(reduce(operator.or_, (Q(**lookup) for lookup in lookups))))
+        messages, missing = [], []
+        for lookup in lookups:
+            values = Message.get_lookup_values(lookup)
+            message = next((msg for msg in existing if Message.get_lookup_values(lookup, msg) == values), None)
+            if message is None:
+                message = Message(**lookup)
+                missing.append(message)
+                existing.append(message)
+            messages.append(message)
+        self.bulk_create(missing)
+        return messages
+
+
 class Message(models.Model):
     """
     Message model represent chat message.
@@ -257,6 +413,9 @@ class Message(models.Model):
     userMessage = models.BooleanField(default=False)
     is_new = models.BooleanField(default=False)
     thread_id = models.IntegerField(null=True)
+    updated = models.DateTimeField(auto_now=True, null=True)
+
+    objects = MessageQuerySet.as_manager()
 
     class Meta:
         ordering = ['timestamp']
@@ -270,16 +429,50 @@ class Message(models.Model):
 
     @property
     def content(self):
+        """
+        Return content object, loaded once per contenttype and content_id.
+        """
         if self.contenttype == 'NoneType':
             return self.text
-        app_label = 'chat' if self.contenttype == 'uniterror' or self.contenttype == 'chatdivider' else 'ct'
-        model = ContentType.objects.get(app_label=app_label, model=self.contenttype).model_class()
-        if self.contenttype == 'response':
-            """Filter responses using custom filter_all method.
-            Because filter() and all() methods are return only valuable responses
-            with is_test=False and is_preview=False."""
-            return model.objects.filter_all(id=self.content_id).first()
-        return model.objects.filter(id=self.content_id).first()
+        key = (self.contenttype, self.content_id)
+        cached = self.__dict__.get('_content')
+        if cached is None or cached[0] != key:
+            content = get_content_queryset(self.contenttype).filter(id=self.content_id).first()
+            self._content = cached = (key, content)
+        return cached[1]
+
+    @staticmethod
+    def get_lookup_values(lookup, message=None):
+        """
+        Get lookup values as stored in db, taken from message if given.
+        """
+        values = []
+        for name, value in sorted(lookup.items()):
+            field = Message._meta.get_field(name)
+            if message is not None:
+                value = getattr(message, field.attname)
+            elif field.is_relation and isinstance(value, models.Model):
+                value = value.pk
+            values.append(value)
+        return values
+
+    @staticmethod
+    def prefetch_content(messages):
+        """
+        Load content of messages with one query per content type.
+        """
+        ids = {}
+        for message in messages:
+            if message.contenttype in MESSAGE_CONTENT_MODELS and message.content_id is not None:
+                ids.setdefault(message.contenttype, set()).add(message.content_id)
+        contents = {
+            contenttype: get_content_queryset(contenttype, prefetch=True).in_bulk(content_ids)
+            for contenttype, content_ids in ids.items()
+        }
+        for message in messages:
+            if message.contenttype in contents:
+                key = (message.contenttype, message.content_id)
+                message._content = (key, contents[message.contenttype].get(message.content_id))
 
     def get_next_point(self):
         return self.chat.next_point.id if self.chat and self.chat.next_point else None
@@ -307,11 +500,9 @@ class Message(models.Model):
         if node and hasattr(node._plugin, 'get_errors'):
             return node._plugin.get_errors(self)
         errors = None
-        error_list = UnitError.objects.get(id=self.content_id).get_errors()
+        error_list = self.content.get_errors()
         if error_list:
-            checked_errors = UnitError.objects.get(
-                id=self.content_id
-            ).response.studenterror_set.all().values_list('errorModel', flat=True)
+            checked_errors = [se.errorModel_id for se in self.content.response.studenterror_set.all()]
             error_str = (
                 '<li><div class="chat-check chat-selectable {}" data-selectable-attribute="errorModel" '
                 'data-selectable-value="{:d}"></div><h3>{}</h3></li>'
@@ -382,10 +573,7 @@ class Message(models.Model):
     def should_ask_confidence(self):
         """Use this method to check whether this FSM should ask for CONFIDENCE."""
         if self.chat.state:
-            fsm_nodes = [
-                i['name']
-                for i in self.chat.state.fsmNode.fsm.fsmnode_set.all().values('name')
-            ]
+            fsm_nodes = self.chat.state.fsmNode.fsm.get_graph().node_names
             return 'CONFIDENCE' in fsm_nodes or 'ADDITIONAL_CONFIDENCE' in fsm_nodes
         return False
 
@@ -446,6 +634,10 @@ class Message(models.Model):
         # return html.split("\n")[0]
         p = re.compile(r'<.*?>')
 
+        if not self.text:
+            source = self.content.lesson if self.contenttype == 'unitlesson' else self.content
+            if getattr(source, 'sidebar_text', None) is not None:
+                return source.sidebar_text
         raw_html = self.text or self.content.text
 
         raw_html = raw_html.split("\n")[0]
@@ -484,7 +676,7 @@ class Message(models.Model):
                     if self.sub_kind == 'add_faq':
                         html = self.text
                     else:
-                        html = mark_safe(md2html(self.content.text))
+                        html = self.content.get_text_html()
                         if self.content.attachment:
                             # display svg inline
                             html += mark_safe(self.content.get_html())
@@ -545,7 +737,7 @@ class Message(models.Model):
                         lesson_kwargs['disabled'] = response.attachment.url
                     except (AttributeError, IndexError, ValueError):
                         pass
-                    html = mark_safe(md2html(self.content.lesson.text))
+                    html = self.content.lesson.get_text_html()
                     html += self.content.lesson.get_html(**lesson_kwargs)
                 elif (self.content.kind == 'answers' and
                       self.content.parent.sub_kind and
@@ -573,9 +765,9 @@ class Message(models.Model):
                             self.content.lesson.url,
                             self.content.lesson.text
                         )
+                        html = mark_safe(md2html(raw_html))
                     else:
-                        raw_html = self.content.lesson.text
-                    html = mark_safe(md2html(raw_html))
+                        html = self.content.lesson.get_text_html()
 
                     if (self.content.lesson.sub_kind == Lesson.CANVAS
                             or (self.content.parent and self.content.parent.sub_kind == Lesson.CANVAS)
@@ -673,9 +865,9 @@ class Message(models.Model):
         )
 
     def save(self, *args, **kwargs):
-        context = c_chat_context().find_one({"chat_id": self.chat_id}) or dict()
-        if not (self.pk or self.thread_id):
-            self.thread_id = context.get('thread_id')
+        # only new messages without explicit thread_id need the active thread
+        if not (self.pk or self.thread_id) and self.chat_id:
+            self.thread_id = get_chat_context(self.chat_id).get('thread_id')
         super().save(*args, **kwargs)
 
 
@@ -714,7 +906,7 @@ class EnrollUnitCode(models.Model):
             'isPreview': is_preview,
             'isTest': isTest
         }
-        update_onboarding_step(onboarding.STEP_6, user.id)
+        publish(ONBOARDING_STEP, step=onboarding.STEP_6, user_id=user.id)
         enroll = cls.objects.filter(courseUnit=course_unit, isLive=is_live, chat__user=user, **filter_kw).first()
         if enroll:
             return enroll
@@ -732,7 +924,8 @@ class UnitError(models.Model):
 
     def get_errors(self):
         unit_lesson = self.response.unitLesson
-        error_list = list(unit_lesson.get_errors())
+        error_list = getattr(unit_lesson, 'prefetched_errors', None)  # see Message.prefetch_content
+        error_list = list(unit_lesson.get_errors() if error_list is None else error_list)
         # Change this to real check
         if unit_lesson.lesson.add_unit_aborts:
             error_list += self.unit.get_aborts()
@@ -766,6 +959,13 @@ class UnitError(models.Model):
             raise AttributeError
 
 
-class ChatDivider(models.Model):
+class ChatDivider(RenderedTextMixin, models.Model):
     text = models.CharField(max_length=200)
+    html = models.TextField(null=True, blank=True, editable=False)  # rendered text
+    sidebar_text = models.TextField(null=True, blank=True, editable=False)
     unitlesson = models.ForeignKey(UnitLesson, null=True, on_delete=models.CASCADE)
+    updated = models.DateTimeField(auto_now=True, null=True)
+
+    def save(self, *args, **kwargs):
+        self.render_text()
+        super().save(*args, **kwargs)
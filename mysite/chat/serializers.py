@@ -10,6 +10,7 @@ from django.conf import settings
 from lti.models import GradedLaunch
 from lti.tasks import send_outcome
 from ct.models import UnitLesson, NEED_HELP_STATUS, NEED_REVIEW_STATUS
+from ct.templatetags.ct_extras import md2html_batch
 from accounts.models import Instructor
 from . models import Message, Chat
 from . services import ProgressHandler
@@ -18,6 +19,18 @@ from . services import ProgressHandler
 log = logging.getLogger(__name__)
 
 
+class InternalMessageListSerializer(serializers.ListSerializer):
+    """
+    Render ReST of all listed messages with a single pandoc run.
+    """
+    def to_representation(self, data):
+        with md2html_batch() as batch:
+            messages = super(InternalMessageListSerializer, self).to_representation(data)
+        for message in messages:
+            message['html'] = batch.resolve(message['html'])
+        return messages
+
+
 class InternalMessageSerializer(serializers.ModelSerializer):
     """
     Serializer for addMessage list representation.
@@ -41,6 +54,7 @@ class InternalMessageSerializer(serializers.ModelSerializer):
             'threadId',
             'is_new'
         )
+        list_serializer_class = InternalMessageListSerializer
 
     def get_avatar(self, obj):
         if not obj.userMessage:
@@ -175,6 +189,7 @@ class ChatHistorySerializer(serializers.ModelSerializer):
     """
     input = serializers.SerializerMethodField()
     addMessages = serializers.SerializerMethodField()
+    hasOlderMessages = serializers.SerializerMethodField()
     extras = serializers.SerializerMethodField()
 
     class Meta:
@@ -182,9 +197,30 @@ class ChatHistorySerializer(serializers.ModelSerializer):
         fields = (
             'input',
             'addMessages',
+            'hasOlderMessages',
             'extras'
         )
 
+    def get_messages(self, obj):
+        """
+        Return (messages, has_older) page of chat history.
+
+        Context may limit the page with `cursors` - list of Q filters
+        over messages, and `limit` - number of latest messages to return.
+        """
+        if not hasattr(self, 'messages_page'):
+            queryset = obj.message_set.exclude(timestamp__isnull=True)
+            for cursor in self.context.get('cursors', ()):
+                queryset = queryset.filter(cursor)
+            queryset = queryset.select_related('response_to_check', 'lesson_to_answer__lesson').with_content()
+            limit = self.context.get('limit')
+            if limit:
+                messages = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+                self.messages_page = messages[limit - 1::-1], len(messages) > limit
+            else:
+                self.messages_page = list(queryset.order_by('timestamp', 'id')), False
+        return self.messages_page
+
     def get_input(self, obj):
         """
         Getting description for next message.
@@ -246,9 +282,10 @@ class ChatHistorySerializer(serializers.ModelSerializer):
         return InputSerializer().to_representation(input_data)
 
     def get_addMessages(self, obj):
-        return InternalMessageSerializer(many=True).to_representation(
-            obj.message_set.all().exclude(timestamp__isnull=True).order_by('timestamp')
-        )
+        return InternalMessageSerializer(many=True).to_representation(self.get_messages(obj)[0])
+
+    def get_hasOlderMessages(self, obj):
+        return self.get_messages(obj)[1]
 
     def get_extras(self, obj):
         extras = {
@@ -301,9 +338,16 @@ class LessonSerializer(serializers.ModelSerializer):
         else:
             return obj.id
 
+    def get_message(self, obj):
+        """
+        Return breakpoint message of the lesson, see ChatProgressSerializer.get_breakpoints.
+        """
+        message = getattr(obj, 'message_instance', None)
+        return message if message is not None else Message.objects.get(id=obj.message)
+
     def get_isUnlocked(self, obj):
         if hasattr(obj, 'message'):
-            message = Message.objects.get(id=obj.message)
+            message = self.get_message(obj)
             return message.timestamp is not None
         else:
             return False
@@ -313,7 +357,7 @@ class LessonSerializer(serializers.ModelSerializer):
             return obj.is_done
 
         if hasattr(obj, 'message'):
-            msg = Message.objects.get(id=obj.message)
+            msg = self.get_message(obj)
             lesson_order = msg.content.unitlesson.order
             chat = msg.chat
 
@@ -414,49 +458,73 @@ class ChatProgressSerializer(serializers.ModelSerializer):
             'is_live',
         )
 
+    def get_live_lessons(self, obj, messages):
+        """
+        Return lessons of live chat breakpoint messages.
+        """
+        lessons = []
+        for msg in messages:
+            try:  # pragma: no cover
+                lesson = msg.content.unitlesson
+                lesson.message = msg.id
+                lesson.message_instance = msg
+                lessons.append(lesson)
+            except AttributeError as ex:
+                log.error(
+                    "{}, Error details: message_id '{}', chat_id '{}', user '{}', kind '{}', text '{}'".format(
+                        ex,
+                        msg.id,
+                        obj.id,
+                        obj.user.username,
+                        msg.kind,
+                        msg.text
+                    )
+                )  # pragma: no cover
+        return lessons
+
+    def get_courselet_lessons(self, obj, messages):
+        """
+        Return ordered courselet lessons followed by additional lessons of breakpoint messages.
+        """
+        lessons = list(
+            obj.enroll_code.courseUnit.unit.unitlesson_set.filter(
+                order__isnull=False
+            ).order_by('order')
+        )
+        for each in messages:
+            try:
+                if each.content.unitlesson in lessons:
+                    lesson = lessons[lessons.index(each.content.unitlesson)]
+                elif each.content.unitlesson and each.content.unitlesson.kind != 'answers':
+                    lesson = each.content.unitlesson
+                    lessons.append(lesson)
+                else:
+                    continue
+                lesson.message = each.id
+                lesson.message_instance = each
+            except:
+                pass
+        return lessons
+
+    def build_breakpoints(self, obj):
+        messages = obj.message_set.filter(contenttype='chatdivider', is_additional=False).with_content()
+        if obj.is_live:
+            lessons = self.get_live_lessons(obj, messages)
+        else:
+            lessons = self.get_courselet_lessons(obj, messages)
+        return LessonSerializer(many=True, context={'chat': obj}).to_representation(lessons)
+
     def get_breakpoints(self, obj):
-        if not self.lessons_dict:
-            messages = obj.message_set.filter(contenttype='chatdivider', is_additional=False)
-            if obj.is_live:
-                lessons = []
-                for msg in messages:
-                    try:  # pragma: no cover
-                        lesson = msg.content.unitlesson
-                        lesson.message = msg.id
-                        lessons.append(lesson)
-                    except AttributeError as ex:
-                        log.error(
-                            "{}, Error details: message_id '{}', chat_id '{}', user '{}', kind '{}', text '{}'".format(
-                                ex,
-                                msg.id,
-                                obj.id,
-                                self.context['request'].user.username,
-                                msg.kind,
-                                msg.text
-                            )
-                        )  # pragma: no cover
-            else:
-                lessons = list(
-                    obj.enroll_code.courseUnit.unit.unitlesson_set.filter(
-                        order__isnull=False
-                    ).order_by('order')
-                )
-                for each in messages:
-                    try:
-                        if each.content.unitlesson in lessons:
-                            lessons[lessons.index(each.content.unitlesson)].message = each.id
-                        elif each.content.unitlesson and each.content.unitlesson.kind != 'answers':
-                            lesson = each.content.unitlesson
-                            lesson.message = each.id
-                            lessons.append(lesson)
-                    except:
-                        pass
-
-            self.lessons_dict = LessonSerializer(many=True, context={'chat': obj}).to_representation(lessons)
+        if self.lessons_dict is None:
+            progress_key = obj.get_progress_key()
+            self.lessons_dict = obj.load_progress(progress_key)
+            if self.lessons_dict is None:
+                self.lessons_dict = self.build_breakpoints(obj)
+                obj.save_progress(progress_key, self.lessons_dict)
         return self.lessons_dict
 
     def get_progress(self, obj):
-        if not self.lessons_dict:
+        if self.lessons_dict is None:
             try:
                 self.get_breakpoints(obj)
             except:
@@ -6,7 +6,7 @@ from django.utils import timezone
 
 from fsm.fsm_base import FSMStack
 from ct.models import Lesson, UnitLesson
-from core.common.mongo import c_chat_context
+from core.common.chat_context import get_chat_context
 from .models import Message
 from .utils import (
     is_last_main_transition_wo_updates,
@@ -120,21 +120,18 @@ class FsmHandler(GroupMessageMixin, ProgressHandler):
         if chat.state and chat.state.fsmNode.node_name_is_one_of('END'):
             if chat.state.fsmNode.fsm.fsm_name_is_one_of('faq'):
                 self.pop_state(chat)
-                edge = chat.state.fsmNode.outgoing.get(name='next')
+                edge = chat.state.fsmNode.get_edge('next')
                 chat.state.fsmNode = edge.transition(chat, request)
                 chat.state.save()
                 saved_actual_ul = (
                     chat.state.get_data_attr('saved_actual_ul')
                     if 'saved_actual_ul' in chat.state.load_json_data() else None)
-                c_chat_context().update_one(
-                    {"chat_id": chat.id},
-                    {"$set": {"actual_ul_id": saved_actual_ul}}
-                ) if saved_actual_ul else None
+                get_chat_context(chat.id).set({"actual_ul_id": saved_actual_ul}) if saved_actual_ul else None
                 next_point = chat.state.fsmNode.get_message(chat, request, current=current, message=message)
             elif chat.state.fsmNode.fsm.fsm_name_is_one_of('updates'):
                 self.pop_state(chat)
                 if chat.state:
-                    edge = chat.state.fsmNode.outgoing.get(name='next')
+                    edge = chat.state.fsmNode.get_edge('next')
                     chat.state.fsmNode = edge.transition(chat, request)
                     chat.state.save()
                     next_point = chat.state.fsmNode.get_message(chat, request, current=current, message=message)
@@ -142,13 +139,13 @@ class FsmHandler(GroupMessageMixin, ProgressHandler):
                 self.pop_state(chat)
 
         if chat.state and chat.state.fsmNode.node_name_is_one_of('FAQ'):
-            chat_context = c_chat_context().find_one({'chat_id': chat.id})
+            chat_context = get_chat_context(chat.id)
             self.push_state(chat, request, 'faq', {
                 'unitlesson': UnitLesson.objects.filter(id=chat_context.get('actual_ul_id')).first(),
                 'chat': chat})
             next_point = chat.state.fsmNode.get_message(chat, request, current=current, message=message)
         if chat.state and chat.state.fsmNode.node_name_is_one_of('FAQ_UPDATES'):
-            saved_actual_ul = c_chat_context().find_one({"chat_id": chat.id}).get('actual_ul_id')
+            saved_actual_ul = get_chat_context(chat.id).get('actual_ul_id')
             chat.state.set_data_attr('saved_actual_ul', saved_actual_ul)
             chat.state.save_json_data()
             thread_answer = chat.state.unitLesson.get_answers().first()
@@ -158,9 +155,7 @@ class FsmHandler(GroupMessageMixin, ProgressHandler):
                 'updates': True,
                 'new_faqs': (chat.state.get_data_attr('new_faqs')
                              if 'new_faqs' in chat.state.load_json_data() else None)})
-            c_chat_context().update_one(
-                {"chat_id": chat.id},
-                {"$set": {"actual_ul_id": thread_answer.id}})
+            get_chat_context(chat.id).set({"actual_ul_id": thread_answer.id})
             next_point = chat.state.fsmNode.get_message(chat, request, current=current, message=message)
         elif helps and not chat.state.fsmNode.fsm.fsm_name_is_one_of('help'):
             unitlesson = helps.first().content
@@ -189,7 +184,7 @@ class FsmHandler(GroupMessageMixin, ProgressHandler):
         elif chat.state:
             if not next_point:
                 if not chat.state.fsmNode.node_name_is_one_of('END'):
-                    edge = chat.state.fsmNode.outgoing.get(name='next')
+                    edge = chat.state.fsmNode.get_edge('next')
                     chat.state.fsmNode = edge.transition(chat, request)
                     chat.state.save()
                 if not (chat.state.fsmNode.node_name_is_one_of('FAQ', 'VIEWUPDATES', 'UPDATES') or
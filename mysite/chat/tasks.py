@@ -1,40 +1,121 @@
+from itertools import groupby, islice
 from urllib.parse import urljoin
 
 from django.conf import settings
 from django.template import loader
 from django.contrib.sites.models import Site
+from django.db.models import Exists, OuterRef, Subquery
+from django.db.models.functions import Mod
 from django.urls import reverse
+from django.utils import timezone
 
-from core.utils import send_emails
+from core.utils import send_mass_emails
 from mysite import celery_app
-from ct.models import Course
+from ct.models import Course, Role
+from .models import Chat
+
+
+def get_history_chats(course_ids):
+    """
+    Return last chats of enrolled students per released courselet which are history chats.
+
+    Chats are ordered by course and id.
+    """
+    last_chat = Chat.objects.filter(
+        user=OuterRef('user'), enroll_code__courseUnit=OuterRef('enroll_code__courseUnit')
+    ).order_by('-id').values('id')[:1]
+    is_student = Role.objects.filter(
+        course=OuterRef('enroll_code__courseUnit__course'), user=OuterRef('user'), role=Role.ENROLLED
+    )
+    return Chat.objects.filter(
+        enroll_code__courseUnit__course_id__in=course_ids,
+        enroll_code__courseUnit__releaseTime__lt=timezone.now(),
+    ).annotate(
+        is_student=Exists(is_student)
+    ).filter(
+        id=Subquery(last_chat), is_student=True, state__isnull=True
+    ).select_related(
+        'user', 'instructor', 'enroll_code__courseUnit__course', 'enroll_code__courseUnit__unit'
+    ).order_by('enroll_code__courseUnit__course_id', 'id')
+
+
+def get_updates_emails(chats, domain, subj_template, text_template):
+    """
+    Return (subj, text, email_from, recipients) messages for chats having updates.
+
+    Subject is rendered once per courselet and instructor.
+    """
+    messages = []
+    subjects = {}
+    for chat in chats:
+        if not chat.has_updates:
+            continue
+        courselet = chat.enroll_code.courseUnit
+        url = reverse('chat:chat_enroll', kwargs={'enroll_key': chat.enroll_code.enrollCode})
+        context = {
+            'student_first_name': chat.user.first_name,
+            'instructor_full_name': chat.instructor.get_full_name() if chat.instructor else '',
+            'courselet_name': courselet,
+            'link_to_courselet': urljoin(domain, url + settings.UPDATES_HASH)
+        }
+        subject_key = (courselet.id, chat.instructor_id)
+        if subject_key not in subjects:
+            subjects[subject_key] = subj_template.render(context).strip()
+        messages.append(
+            (subjects[subject_key], text_template.render(context), settings.EMAIL_FROM, [chat.user.email])
+        )
+    return messages
 
 
 @celery_app.task
 def notify_for_updates(**kwargs):
     """
     Notify students about new updates.
+
+    Courses are split into settings.NOTIFY_UPDATES_SHARDS shards, each one is processed by its own task.
+    """
+    shards = settings.NOTIFY_UPDATES_SHARDS
+    for shard in range(shards):
+        notify_courses_for_updates.delay(shard=shard, shards=shards)
+
+
+@celery_app.task(bind=True, max_retries=3, default_retry_delay=5 * 60)
+def notify_courses_for_updates(self, shard=0, shards=1, after_course_id=0, after_chat_id=None):
+    """
+    Notify students of courses with `id % shards == shard` about new updates.
+
+    Courses are processed in id order, chats of a course in id order and in chunks of
+    settings.NOTIFY_UPDATES_CHUNK_SIZE. A failed task is retried after the last sent chunk:
+    after_chat_id is the last notified chat of course after_course_id, None if the course is done.
     """
+    courses = Course.objects.annotate(shard=Mod('id', shards)).filter(shard=shard)
+    if after_chat_id is None:
+        courses = courses.filter(id__gt=after_course_id)
+    else:
+        courses = courses.filter(id__gte=after_course_id)
+    course_ids = list(courses.order_by('id').values_list('id', flat=True))
+    if not course_ids:
+        return
     domain = 'https://{0}'.format(Site.objects.get_current().domain)
-    for course in Course.objects.all():
-        for courselet in course.get_course_units():
-            for student in course.students:
-                last_chat = student.chat_set.filter(enroll_code__courseUnit=courselet).order_by('id').last()
-                if last_chat.is_history and last_chat.has_updates:
-                    url = reverse(
-                        'chat:chat_enroll',
-                        kwargs={'enroll_key': last_chat.enroll_code.enrollCode}
-                    )
-                    kwargs = {
-                        'student_first_name': student.first_name,
-                        'instructor_full_name': last_chat.instructor.get_full_name,
-                        'courselet_name': courselet,
-                        'link_to_courselet': urljoin(domain, url + settings.UPDATES_HASH)
-                    }
-                    subj_template = loader.get_template('chat/email/notify_students_subject')
-                    rendered_subj = subj_template.render(kwargs)
-
-                    text_template = loader.get_template('chat/email/notify_students_text')
-                    rendered_text = text_template.render(kwargs)
-
-                    send_emails(rendered_subj, rendered_text, settings.EMAIL_FROM, [student.email])
+    subj_template = loader.get_template('chat/email/notify_students_subject')
+    text_template = loader.get_template('chat/email/notify_students_text')
+
+    chats = get_history_chats(course_ids)
+    if after_chat_id is not None:
+        chats = chats.exclude(enroll_code__courseUnit__course_id=after_course_id, id__lte=after_chat_id)
+    chunk_size = settings.NOTIFY_UPDATES_CHUNK_SIZE
+    for course_id, course_chats in groupby(chats.iterator(), key=lambda chat: chat.enroll_code.courseUnit.course_id):
+        while True:
+            chunk = list(islice(course_chats, chunk_size))
+            if not chunk:
+                break
+            try:
+                send_mass_emails(
+                    get_updates_emails(chunk, domain, subj_template, text_template), chunk_size=chunk_size
+                )
+            except Exception as e:
+                raise self.retry(exc=e, kwargs={
+                    'shard': shard, 'shards': shards, 'after_course_id': after_course_id, 'after_chat_id': after_chat_id
+                })
+            after_course_id, after_chat_id = course_id, chunk[-1].id
+        after_course_id, after_chat_id = course_id, None
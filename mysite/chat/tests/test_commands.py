@@ -0,0 +1,73 @@
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from chat.management.commands.update_progress import update_chats_progress
+from chat.models import Chat, ChatDivider, Message
+
+
+@pytest.mark.django_db
+def test_update_progress(chat, unit_lesson):
+    Chat.objects.filter(id=chat.id).update(progress=0)
+    call_command('update_progress', '--batch-size', '1')
+    # chat has no state, so it is treated as completed
+    assert Chat.objects.get(id=chat.id).progress == 100
+
+
+@pytest.mark.django_db
+def test_update_progress_one_update_per_batch(chat, user, unit_lesson):
+    for _ in range(3):
+        Chat.objects.create(enroll_code=chat.enroll_code, user=user)
+    Chat.objects.update(progress=0, progress_data=None)
+    chat_ids = list(Chat.objects.order_by('id').values_list('id', flat=True))
+
+    with CaptureQueriesContext(connection) as queries:
+        assert update_chats_progress(chat_ids) == (chat_ids[-1], 4)
+    updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+    assert len(updates) == 1
+    assert not Chat.objects.filter(progress_data=None).exists()
+
+    # stored breakpoints are up to date, so nothing is updated
+    with CaptureQueriesContext(connection) as queries:
+        assert update_chats_progress(chat_ids) == (chat_ids[-1], 0)
+    assert not [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+
+
+@pytest.mark.django_db
+def test_update_progress_aggregates(chat, user, unit_lesson):
+    other = Chat.objects.create(enroll_code=chat.enroll_code, user=user)
+    Message.objects.create(chat=chat, owner=user, kind='message')
+    messages, lessons = Chat.get_progress_aggregates([chat, other])
+    for each in (chat, other):
+        assert each.get_progress_key(messages[each.id], lessons[each.enroll_code_id]) == each.get_progress_key()
+
+
+@pytest.mark.django_db
+def test_update_progress_divider_without_lesson(chat, user, unit_lesson):
+    live = Chat.objects.create(enroll_code=chat.enroll_code, user=user, is_live=True, progress=0)
+    divider = ChatDivider.objects.create(text='Lesson without content')
+    Message.objects.create(
+        chat=live, owner=user, kind='message', contenttype='chatdivider', content_id=divider.id
+    )
+    Chat.objects.filter(id=chat.id).update(progress=0)
+
+    assert update_chats_progress([chat.id, live.id]) == (live.id, 2)
+    assert Chat.objects.get(id=live.id).progress == 100
+
+
+@pytest.mark.django_db
+def test_update_progress_since(chat, unit_lesson):
+    Chat.objects.filter(id=chat.id).update(
+        progress=0, timestamp=timezone.now() - timezone.timedelta(days=2), last_modify_timestamp=None
+    )
+    call_command('update_progress', '--since', (timezone.now() - timezone.timedelta(days=1)).date().isoformat())
+    assert Chat.objects.get(id=chat.id).progress == 0
+
+    call_command('update_progress', '--after-id', chat.id)
+    assert Chat.objects.get(id=chat.id).progress == 0
+
+    with pytest.raises(CommandError):
+        call_command('update_progress', '--since', 'yesterday')
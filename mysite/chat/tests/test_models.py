@@ -5,7 +5,8 @@ import pytest
 from django.urls import reverse
 from django.utils import timezone
 
-from chat.models import EnrollUnitCode
+from chat.models import EnrollUnitCode, Message, ChatDivider
+from core.common.chat_context import get_chat_context
 from ct.models import CourseUnit
 
 
@@ -115,6 +116,63 @@ def test_message(message, unit_lesson, chat):
     assert message.get_sidebar_html().strip() == unit_lesson.text
 
 
+@pytest.mark.django_db
+def test_message_content_cached(message, unit_lesson, response, django_assert_num_queries):
+    message = Message.objects.get(id=message.id)
+    with django_assert_num_queries(1):
+        assert message.content == unit_lesson
+        assert message.content == unit_lesson
+
+    message.contenttype, message.content_id = 'response', response.id
+    assert message.content == response
+
+
+@pytest.mark.django_db
+def test_message_with_content(chat, user, unit_lesson, response, unit_error, django_assert_num_queries):
+    divider = ChatDivider.objects.create(text='divider', unitlesson=unit_lesson)
+    contents = [unit_lesson, response, unit_error, divider]
+    for content in contents:
+        Message.objects.create(
+            chat=chat, owner=user, contenttype=content.__class__.__name__.lower(), content_id=content.id
+        )
+
+    # messages, one query per content type, error models and student errors of the uniterror
+    with django_assert_num_queries(1 + len(contents) + 2):
+        messages = list(chat.message_set.order_by('id').with_content())
+        assert [m.content for m in messages] == contents
+        assert messages[0].content.lesson.text == unit_lesson.lesson.text
+        assert messages[1].content.author == user
+
+
+@pytest.mark.django_db
+def test_message_thread_id(chat, user, unit_lesson, mocker):
+    get_chat_context(chat.id).set({'thread_id': unit_lesson.id}, upsert=True)
+    message = Message.objects.create(chat=chat, owner=user)
+    assert message.thread_id == unit_lesson.id
+
+    get_storage = mocker.patch('core.common.chat_context.get_storage')
+    message.text = 'updated'
+    message.save()
+    Message.objects.create(chat=chat, owner=user, thread_id=42)
+    get_storage.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_message_bulk_get_or_create(chat, user, unit_lesson, django_assert_num_queries):
+    get_chat_context(chat.id).set({'thread_id': unit_lesson.id}, upsert=True)
+    existing = Message.objects.create(chat=chat, owner=user, contenttype='unitlesson', content_id=1, kind='abort')
+    lookups = [
+        dict(chat=chat, owner=user, contenttype='unitlesson', content_id=content_id, kind='abort')
+        for content_id in (1, 2, 3, 2)
+    ]
+    with django_assert_num_queries(2):
+        messages = Message.objects.bulk_get_or_create(lookups)
+    assert messages[0] == existing
+    assert messages[1] is messages[3]
+    created = chat.message_set.filter(content_id__in=(2, 3)).order_by('id')
+    assert [(m.content_id, m.thread_id) for m in created] == [(2, unit_lesson.id), (3, unit_lesson.id)]
+
+
 @pytest.mark.django_db
 def test_unit_error(unit_error):
     assert len(unit_error.get_errors()) == 0
@@ -0,0 +1,99 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from chat.models import Chat, Message, ChatDivider
+from chat.serializers import ChatHistorySerializer, ChatProgressSerializer
+from ct.models import UnitLesson
+
+
+def add_question_messages(chat, user, question, response, unit_error):
+    """
+    Add messages a student sees for one question to the chat.
+    """
+    answer = question.get_answers().first()
+    divider = ChatDivider.objects.create(text=question.lesson.title, unitlesson=question)
+    contents = (
+        ('chatdivider', divider.id, {}),
+        ('unitlesson', question.id, {'lesson_to_answer': question}),
+        ('response', response.id, {'input_type': 'text', 'userMessage': True}),
+        ('unitlesson', answer.id, {'response_to_check': response, 'lesson_to_answer': question}),
+        ('uniterror', unit_error.id, {}),
+    )
+    for contenttype, content_id, kwargs in contents:
+        Message.objects.create(
+            chat=chat, owner=user, contenttype=contenttype, content_id=content_id,
+            timestamp=timezone.now(), **kwargs
+        )
+
+
+def count_history_queries(chat):
+    chat = Chat.objects.get(id=chat.id)
+    with CaptureQueriesContext(connection) as queries:
+        messages = ChatHistorySerializer().get_addMessages(chat)
+    return len(queries), len(messages)
+
+
+@pytest.mark.django_db
+def test_history_messages_constant_queries(chat, user, lesson_answer, response, unit_error):
+    chat.instructor = user
+    chat.save()
+    add_question_messages(chat, user, lesson_answer, response, unit_error)
+    queries, messages = count_history_queries(chat)
+
+    for _ in range(3):
+        add_question_messages(chat, user, lesson_answer, response, unit_error)
+    more_queries, more_messages = count_history_queries(chat)
+
+    assert more_messages == 4 * messages
+    assert more_queries == queries
+
+
+@pytest.mark.django_db
+def test_progress_breakpoints_stored(chat, user, unit, unit_lesson, django_assert_num_queries):
+    divider = ChatDivider.objects.create(text=unit_lesson.lesson.title, unitlesson=unit_lesson)
+    Message.objects.create(
+        chat=chat, owner=user, contenttype='chatdivider', content_id=divider.id, timestamp=timezone.now()
+    )
+    breakpoints = ChatProgressSerializer().get_breakpoints(Chat.objects.get(id=chat.id))
+    assert [(b['id'], b['isUnlocked']) for b in breakpoints] == [(chat.message_set.get().id, True)]
+
+    # only messages and lessons stats are queried to validate stored breakpoints
+    chat = Chat.objects.get(id=chat.id)
+    with django_assert_num_queries(2):
+        assert ChatProgressSerializer().get_breakpoints(chat) == breakpoints
+
+    UnitLesson.objects.create(
+        unit=unit, lesson=unit_lesson.lesson, addedBy=user, treeID=unit_lesson.treeID, order=2
+    )
+    assert len(ChatProgressSerializer().get_breakpoints(Chat.objects.get(id=chat.id))) == 2
+
+
+@pytest.mark.django_db
+def test_progress_empty_breakpoints_stored(chat, django_assert_num_queries):
+    assert ChatProgressSerializer().get_breakpoints(Chat.objects.get(id=chat.id)) == []
+
+    # stored empty breakpoints are used, not rebuilt and saved again
+    chat = Chat.objects.get(id=chat.id)
+    with django_assert_num_queries(2):
+        assert ChatProgressSerializer().get_breakpoints(chat) == []
+
+
+@pytest.mark.django_db
+def test_progress_lesson_title_change(chat, user, unit_lesson):
+    divider = ChatDivider.objects.create(text=unit_lesson.lesson.title, unitlesson=unit_lesson)
+    Message.objects.create(
+        chat=chat, owner=user, contenttype='chatdivider', content_id=divider.id, timestamp=timezone.now()
+    )
+    ChatProgressSerializer().get_breakpoints(Chat.objects.get(id=chat.id))
+    lesson = unit_lesson.lesson
+    lesson.text = 'new text'
+    lesson.save()
+    assert Chat.objects.get(id=chat.id).progress_data is not None
+
+    lesson.title = 'New title'
+    lesson.save()
+    assert Chat.objects.get(id=chat.id).progress_data is None
+    breakpoints = ChatProgressSerializer().get_breakpoints(Chat.objects.get(id=chat.id))
+    assert [b['html'] for b in breakpoints] == ['New title']
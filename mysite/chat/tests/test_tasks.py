@@ -1,14 +1,81 @@
 import pytest
+from celery.exceptions import Retry
 
-from chat.tasks import notify_for_updates
+from django.contrib.auth.models import User
+from django.core import mail
+from django.utils import timezone
+
+from chat.models import Chat
+from chat import tasks
+from chat.tasks import notify_for_updates, notify_courses_for_updates, get_history_chats
+from ct.models import Role
 
 
 @pytest.mark.unittest
 @pytest.mark.django_db
 def test_notify_for_updates(mocker):
-    mock_send_emails = mocker.patch('chat.tasks.send_emails')
+    mock_send_emails = mocker.patch('chat.tasks.send_mass_emails')
     assert notify_for_updates() is None
     assert mock_send_emails.call_count == 0
 
 
-# TODO: check that no message will be send to a DONE threads
\ No newline at end of file
+@pytest.mark.django_db
+def test_notify_courses_for_updates(mocker, settings, chat, user, course, course_unit, django_assert_num_queries):
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    course_unit.releaseTime = timezone.now() - timezone.timedelta(days=1)
+    course_unit.save()
+    user.first_name, user.email = 'Bob', 'bob@example.com'
+    user.save()
+    Role.objects.create(course=course, user=user, role=Role.ENROLLED)
+    # only the last chat of a student is checked
+    last_chat = Chat.objects.create(enroll_code=chat.enroll_code, user=user)
+    mocker.patch.object(Chat, 'has_updates', True)
+
+    with django_assert_num_queries(1):
+        assert [c.id for c in get_history_chats([course.id])] == [last_chat.id]
+
+    notify_courses_for_updates(shard=course.id % 2, shards=2)
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].to == ['bob@example.com']
+    assert 'Bob' in mail.outbox[0].body
+
+    notify_courses_for_updates(shard=course.id % 2, shards=2, after_course_id=course.id)
+    notify_courses_for_updates(shard=(course.id + 1) % 2, shards=2)
+    assert len(mail.outbox) == 1
+
+
+@pytest.mark.django_db
+def test_notify_courses_for_updates_retry(mocker, settings, chat, user, course, course_unit):
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    settings.NOTIFY_UPDATES_CHUNK_SIZE = 1
+    course_unit.releaseTime = timezone.now() - timezone.timedelta(days=1)
+    course_unit.save()
+    emails = []
+    for i in range(3):
+        student = User.objects.create_user(username=f'student{i}', email=f'student{i}@example.com')
+        Role.objects.create(course=course, user=student, role=Role.ENROLLED)
+        Chat.objects.create(enroll_code=chat.enroll_code, user=student)
+        emails.append(student.email)
+    mocker.patch.object(Chat, 'has_updates', True)
+    send_mass_emails = tasks.send_mass_emails
+    calls = []
+
+    def fail_second_chunk(messages, **kwargs):
+        calls.append(messages)
+        if len(calls) == 2:
+            raise ConnectionError('SMTP is down')
+        return send_mass_emails(messages, **kwargs)
+    mocker.patch('chat.tasks.send_mass_emails', side_effect=fail_second_chunk)
+
+    retry = mocker.patch.object(notify_courses_for_updates, 'retry', side_effect=Retry)
+
+    with pytest.raises(Retry):
+        notify_courses_for_updates(shard=course.id % 2, shards=2)
+    assert len(mail.outbox) == 1
+    notify_courses_for_updates(**retry.call_args[1]['kwargs'])
+    # the retry starts with the failed chunk, so every student gets exactly one email
+    assert sorted(m.to[0] for m in mail.outbox) == emails
+    assert len(calls) == 4
+
+
+# TODO: check that no message will be send to a DONE threads
@@ -3,9 +3,16 @@ import random
 from itertools import permutations, combinations_with_replacement
 from dateutil import tz
 
+from django.contrib.auth.models import User
 from django.utils import timezone
 
-from chat.utils import update_activity, c_chat_context, is_end_update_node
+from chat.models import Message
+from chat.utils import (
+    update_activity, is_end_update_node, get_need_help_threads, get_threads_updates, get_updated_thread_id
+)
+from core.common.chat_context import chat_context_scope
+from core.common.mongo import c_chat_context
+from ct.models import Lesson, UnitLesson, Response
 
 
 @pytest.mark.integration
@@ -51,3 +58,60 @@ def test_is_end_update_node(mocker, node_name_is_one_of, fsm_name_is_one_of, res
     node.fsm.fsm_name_is_one_of = mocker.Mock(return_value=fsm_name_is_one_of)
 
     assert is_end_update_node(state) is result
+
+
+@pytest.mark.django_db
+def test_threads_updates(chat, user, lesson_answer, course, django_assert_num_queries):
+    other = User.objects.create_user(username='other', password='test')
+    answer = lesson_answer.get_answers().first()
+    lesson = lesson_answer.lesson
+    Chat = chat.__class__
+    Chat.objects.filter(id=chat.id).update(last_modify_timestamp=timezone.now() - timezone.timedelta(days=1))
+    chat.refresh_from_db()
+
+    faq = Response.objects.create(
+        lesson=lesson, unitLesson=answer, course=course, author=user, kind=Response.STUDENT_QUESTION
+    )
+    Response.objects.create(lesson=lesson, unitLesson=answer, course=course, author=other,
+                            kind=Response.STUDENT_QUESTION)
+    Response.objects.create(lesson=lesson, unitLesson=answer, course=course, author=other,
+                            kind=Response.COMMENT, parent=faq)
+    em_lesson = Lesson(title='em', addedBy=other, kind=Lesson.ERROR_MODEL)
+    em_lesson.save_root()
+    em = UnitLesson.create_from_lesson(em_lesson, lesson_answer.unit, parent=lesson_answer)
+    resolution = Lesson(title='resolution', addedBy=other)
+    resolution.save_root()
+    UnitLesson.create_from_lesson(resolution, lesson_answer.unit, kind=UnitLesson.RESOLVES, parent=em)
+    response = Response.objects.create(lesson=lesson, unitLesson=lesson_answer, course=course, author=user)
+    Message.objects.create(chat=chat, owner=user, kind='response', contenttype='response',
+                           content_id=response.id, lesson_to_answer=lesson_answer)
+
+    assert get_threads_updates(chat) == {lesson_answer: lesson_answer.updates_count(chat)}
+    assert lesson_answer.updates_count(chat) == 4
+    assert get_updated_thread_id(chat) == lesson_answer.id
+
+    with chat_context_scope():
+        get_threads_updates(chat)
+        # threads, last responses and their statuses only
+        with django_assert_num_queries(3):
+            assert get_threads_updates(chat) == {lesson_answer: 4}
+
+    Response.objects.filter(id=response.id).update(status='done')
+    assert get_threads_updates(chat) == {}
+
+
+@pytest.mark.django_db
+def test_need_help_threads_preview(chat, user, lesson_answer, course):
+    Chat = chat.__class__
+    Chat.objects.filter(id=chat.id).update(is_preview=True)
+    chat.refresh_from_db()
+    response = Response.objects.create(
+        lesson=lesson_answer.lesson, unitLesson=lesson_answer, course=course, author=user, is_preview=True
+    )
+    Message.objects.create(chat=chat, owner=user, kind='response', contenttype='response',
+                           content_id=response.id, lesson_to_answer=lesson_answer)
+
+    assert get_need_help_threads(chat) == [lesson_answer]
+
+    Response.objects.filter_all(id=response.id).update(status='done')
+    assert get_need_help_threads(chat) == []
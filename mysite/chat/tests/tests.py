@@ -14,7 +14,7 @@ from django.utils.safestring import mark_safe
 from unittest.mock import patch, Mock
 import injections
 
-from ct.models import Course, Unit, Lesson, UnitLesson, CourseUnit, Role, Concept
+from ct.models import Course, Unit, Lesson, UnitLesson, CourseUnit, Role, Concept, Response as StudentResponse
 from ct.templatetags.ct_extras import md2html
 from ..models import EnrollUnitCode, Message
 from ..serializers import (
@@ -1127,6 +1127,89 @@ class HistoryAPIViewTests(CustomTestCase):
             self.compile_html(self.unitlesson)
         )
 
+    def test_cursor(self):
+        """
+        Check history paging by cursor and ETag support.
+        """
+        enroll_code = EnrollUnitCode.get_code(self.courseunit)
+        self.client.login(username='test', password='test')
+        response = self.client.get(
+            reverse(
+                'chat:init_chat_api',
+                kwargs={
+                    'enroll_key': enroll_code,
+                    'chat_id': 0
+                }
+            ),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        chat_id = json.loads(response.content)['id']
+        chat_id = self.client.get(
+            reverse('chat:chat_enroll', args=(enroll_code, chat_id)), follow=True
+        ).context['chat_id']
+
+        response = self.client.get(reverse('chat:history'), {'chat_id': chat_id})
+        ids = [message['id'] for message in json.loads(response.content)['addMessages']]
+        self.assertFalse(json.loads(response.content)['hasOlderMessages'])
+
+        response = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'limit': 2})
+        json_content = json.loads(response.content)
+        self.assertEqual([message['id'] for message in json_content['addMessages']], ids[-2:])
+        self.assertTrue(json_content['hasOlderMessages'])
+
+        response = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'before': ids[-2], 'limit': 5})
+        json_content = json.loads(response.content)
+        self.assertEqual([message['id'] for message in json_content['addMessages']], ids[:-2])
+        self.assertFalse(json_content['hasOlderMessages'])
+
+        response = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'after': ids[0]})
+        self.assertEqual([message['id'] for message in json.loads(response.content)['addMessages']], ids[1:])
+
+        response = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'after': 'yesterday'})
+        self.assertIn('errors', json.loads(response.content))
+
+        response = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]})
+        self.assertEqual(json.loads(response.content)['addMessages'], [])
+        response = self.client.get(
+            reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]}, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # edits of a message or of a shown response change the ETag
+        etag = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]})['ETag']
+        message = Message.objects.get(id=ids[-1])
+        message.text = 'edited'
+        message.save()
+        response = self.client.get(
+            reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+        student_response = StudentResponse.objects.create(
+            lesson=self.unitlesson.lesson, unitLesson=self.unitlesson, course=self.course, text='answer',
+            confidence=StudentResponse.GUESS, author=self.user, is_preview=True
+        )
+        message.contenttype = 'response'
+        message.content_id = student_response.id
+        message.save()
+        etag = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]})['ETag']
+        student_response.selfeval = StudentResponse.CORRECT
+        student_response.save()
+        response = self.client.get(
+            reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # so do edits of courselet lessons rendered by messages
+        etag = self.client.get(reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]})['ETag']
+        lesson = self.unitlesson.lesson
+        lesson.text = 'edited lesson text'
+        lesson.save()
+        response = self.client.get(
+            reverse('chat:history'), {'chat_id': chat_id, 'after': ids[-1]}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+
 
 @override_settings(SUSPEND_SIGNALS=True)
 class NumbersTest(CustomTestCase):
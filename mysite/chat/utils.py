@@ -1,9 +1,11 @@
+from collections import OrderedDict
 from uuid import uuid4
 
+from dateutil import tz
 from django.utils import timezone
 
-from core.common.mongo import c_chat_context
-from ct.models import NEED_HELP_STATUS, NEED_REVIEW_STATUS
+from core.common.chat_context import get_chat_context
+from ct.models import UnitLesson, Response, NEED_HELP_STATUS, NEED_REVIEW_STATUS
 
 
 def enroll_generator():
@@ -17,15 +19,63 @@ def update_activity(chat_id: int) -> None:
     """
     Update chat context for a currently active thread.
     """
-    context = c_chat_context().find_one({"chat_id": chat_id})
-    if context and context.get('thread_id'):
-        thread_id = context.get('thread_id')
-        c_chat_context().update_one(
-            {"chat_id": chat_id},
-            {"$set": {
-                f"activity.{thread_id}": timezone.now()
-            }},
-        )
+    context = get_chat_context(chat_id)
+    thread_id = context.get('thread_id')
+    if thread_id:
+        context.set({
+            f"activity.{thread_id}": timezone.now()
+        })
+
+
+def get_need_help_threads(chat) -> '[UnitLesson]':
+    """
+    Get chat Threads, in order, where the last Student response needs help.
+    """
+    threads = list(chat.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order'))
+    last_responses = {}
+    for thread_id, response_id in chat.message_set.filter(
+            lesson_to_answer_id__in=[thread.id for thread in threads],
+            kind='response',
+            contenttype='response',
+            content_id__isnull=False).order_by('-timestamp').values_list('lesson_to_answer_id', 'content_id'):
+        last_responses.setdefault(thread_id, response_id)
+    statuses = dict(Response.objects.filter_all(id__in=last_responses.values()).values_list('id', 'status'))
+    return [
+        thread for thread in threads
+        if last_responses.get(thread.id) in statuses and
+        statuses[last_responses[thread.id]] in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS)
+    ]
+
+
+def get_threads_updates(chat) -> 'OrderedDict[UnitLesson, int]':
+    """Get updates count of chat Threads the Student needs help with
+
+    Counts are computed for all Threads at once and memoized in the chat
+    context, i.e. for the rest of the request.
+    """
+    context = get_chat_context(chat.id)
+    activity = context.get('activity', {})
+    last_access_times = OrderedDict()
+    for thread in get_need_help_threads(chat):
+        last_access_time = activity.get(f"{thread.id}") or chat.last_modify_timestamp
+        last_access_times[thread] = last_access_time and last_access_time.replace(tzinfo=tz.tzutc())
+    missing = {
+        thread.id: last_access_time for thread, last_access_time in last_access_times.items()
+        if last_access_time and ('updates_count', thread.id, last_access_time) not in context.cache
+    }
+    for thread_id, count in UnitLesson.updates_counts(missing, chat.user).items():
+        context.cache[('updates_count', thread_id, missing[thread_id])] = count
+    return OrderedDict(
+        (thread, context.cache.get(('updates_count', thread.id, last_access_time), 0))
+        for thread, last_access_time in last_access_times.items()
+    )
+
+
+def get_updated_thread(chat) -> UnitLesson:
+    """
+    Get first chat Thread having updates, if any.
+    """
+    return next((thread for thread, count in get_threads_updates(chat).items() if count > 0), None)
 
 
 def is_last_main_transition_wo_updates(state):
@@ -57,23 +107,7 @@ def is_update_transition_wo_updates_w_last_main(state, chat):
     if not state.fsmNode.node_name_is_one_of('TRANSITION'):
         return False
 
-    threads = chat.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order')
-
-    has_update = False
-    for thread in threads:
-        # TODO: move to a dedicated util
-        response_msg = chat.message_set.filter(
-            lesson_to_answer_id=thread.id,
-            kind='response',
-            contenttype='response',
-            content_id__isnull=False).last()
-        if not response_msg:
-            continue
-        response = response_msg.content
-        is_need_help = response.status in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS)
-        if is_need_help and thread.updates_count(chat) > 0:
-            has_update = True
-            break
+    has_update = get_updated_thread(chat) is not None
 
     parent = state.parentState
 
@@ -109,29 +143,8 @@ def get_updated_thread_id(history):
 
     :history:: chat.models.Chat instance.
     """
-    # TODO: Cover with tests?
-    updated_thread_id = None
-
-    threads = history.enroll_code.courseUnit.unit.unitlesson_set.filter(order__isnull=False).order_by('order')
-
-    for thread in threads:
-        response_msg = history.message_set.filter(
-            lesson_to_answer_id=thread.id,
-            kind='response',
-            contenttype='response',
-            content_id__isnull=False).last()
-
-        if not response_msg:
-            continue
-
-        response = response_msg.content
-        is_need_help = response.status in (None, NEED_HELP_STATUS, NEED_REVIEW_STATUS) if response else None
-
-        if is_need_help and thread.updates_count(history) > 0:
-            updated_thread_id = thread.id
-            break
-
-    return updated_thread_id
+    updated_thread = get_updated_thread(history)
+    return updated_thread.id if updated_thread else None
 
 
 def is_last_thread(state):
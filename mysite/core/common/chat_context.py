@@ -0,0 +1,108 @@
+"""
+Chat context unit of work.
+
+Chat context documents are read and updated many times while processing one
+request. Inside `chat_context_scope()` every chat context is loaded once,
+updated in memory and written back with a single `$set` when the scope ends.
+Outside of a scope every update is written immediately.
+"""
+import threading
+from contextlib import contextmanager
+
+from .storage import CHAT_CONTEXT, get_storage, set_path
+
+
+_local = threading.local()
+
+
+class ChatContext(object):
+    """
+    Chat context document of one chat.
+    """
+    def __init__(self, chat_id, deferred=False):
+        self.chat_id = chat_id
+        self.deferred = deferred
+        self._doc = None
+        self._loaded = False
+        self._changes = {}
+        self._upsert = False
+        # values derived from the document, kept as long as the context is
+        self.cache = {}
+
+    @property
+    def doc(self):
+        """
+        Chat context document with pending changes applied, or None.
+        """
+        if not self._loaded:
+            self._doc = get_storage().get(CHAT_CONTEXT, {'chat_id': self.chat_id})
+            self._loaded = True
+            if self._changes:
+                self._apply(self._changes, self._upsert)
+        return self._doc
+
+    def get(self, key, default=None):
+        return (self.doc or {}).get(key, default)
+
+    def set(self, values, upsert=False):
+        """
+        Set fields given by (dotted) keys, like `update_one` with `$set` does.
+
+        Without upsert nothing is changed if there is no document yet.
+        """
+        if self.deferred:
+            self._changes.update(values)
+            self._upsert = self._upsert or upsert
+        else:
+            get_storage().update(CHAT_CONTEXT, {'chat_id': self.chat_id}, values, upsert=upsert)
+        if self._loaded:
+            self._apply(values, upsert)
+
+    def _apply(self, values, upsert):
+        if self._doc is None and upsert:
+            self._doc = {'chat_id': self.chat_id}
+        if self._doc is not None:
+            for key, value in values.items():
+                set_path(self._doc, key, value)
+
+    def flush(self):
+        """
+        Write pending changes with one update.
+        """
+        if self._changes:
+            get_storage().update(CHAT_CONTEXT, {'chat_id': self.chat_id}, self._changes, upsert=self._upsert)
+            self._changes = {}
+            self._upsert = False
+
+
+def get_chat_context(chat_id):
+    """
+    Get chat context of the current scope, or a write-through one outside of it.
+    """
+    contexts = getattr(_local, 'contexts', None)
+    if contexts is None:
+        return ChatContext(chat_id)
+    try:
+        return contexts[chat_id]
+    except KeyError:
+        context = contexts[chat_id] = ChatContext(chat_id, deferred=True)
+        return context
+
+
+@contextmanager
+def chat_context_scope():
+    """
+    Share chat contexts and defer their writes until the end of the block.
+
+    Nested scopes join the outermost one.
+    """
+    if getattr(_local, 'contexts', None) is not None:
+        yield
+        return
+    _local.contexts = {}
+    try:
+        yield
+    finally:
+        contexts, _local.contexts = _local.contexts, None
+        for context in contexts.values():
+            context.flush()
@@ -1,8 +1,11 @@
 """
 Core MongoDB connector.
 """
+import os
+import threading
+
 import pymongo
-from pymongo import ReadPreference
+from pymongo import ReadPreference, monitoring
 
 from django.conf import settings
 
@@ -11,6 +14,7 @@ DB_DATA = settings.DB_DATA
 
 COLLECTION_CHAT_STACK = 'chat_stack'
 COLLECTION_MILESTONE_ORCT = 'milestone_students_orct'
+COLLECTION_MILESTONE_ORCT_COUNTS = 'milestone_students_orct_counts'
 COLLECTION_ONBOARDING_STATUS = 'onboarding_status'
 COLLECTION_ONBOARDING_SETTINGS = 'onboarding_settings'
 COLLECTION_FAQ_DATA = 'faq_data'
@@ -26,16 +30,82 @@ class Singleton(object):
         return cls._instance
 
 
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool counters of the current process.
+
+    pymongo calls the listener from its own threads, so counters are updated under a lock.
+    """
+    COUNTERS = (
+        'connections_created', 'connections_closed', 'checked_out', 'checked_in', 'checkout_failed', 'pools_cleared'
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def _inc(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc('pools_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc('connections_created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc('connections_closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._inc('checked_out')
+
+    def connection_checked_in(self, event):
+        self._inc('checked_in')
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['open_connections'] = stats['connections_created'] - stats['connections_closed']
+        stats['in_use'] = stats['checked_out'] - stats['checked_in']
+        return stats
+
+
 class MongoConnector(Singleton):
     """
     Mongo connector as singleton object to utilize
     mongo connection pool.
+
+    The client and the database/collection handles are created once per
+    process: a forked worker (celery prefork, uwsgi) gets its own client.
     """
     _conn = None
+    _pid = None
+    _handles = None
+    metrics = PoolMetrics()
 
     @property
     def connector(self):
-        if not self._conn:
+        if not self._conn or self._pid != os.getpid():
             self._mongo_init()
         return self._conn
 
@@ -43,44 +113,78 @@ class MongoConnector(Singleton):
         """
         Set class _conn variable.
         """
-        self._conn = pymongo.MongoClient(settings.MONGO_HOST)
+        self.metrics.reset()
+        self._conn = pymongo.MongoClient(
+            settings.MONGO_HOST,
+            connect=False,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+            event_listeners=[self.metrics],
+        )
+        self._pid = os.getpid()
+        self._handles = {}
+
+    def get_database(self, db, use_secondary=False):
+        conn = self.connector
+        key = (db, use_secondary)
+        if key not in self._handles:
+            self._handles[key] = conn.get_database(
+                db, read_preference=ReadPreference.SECONDARY_PREFERRED if use_secondary else ReadPreference.PRIMARY
+            )
+        return self._handles[key]
+
+    def get_collection(self, name, db, use_secondary=False):
+        database = self.get_database(db, use_secondary)
+        key = (db, use_secondary, name)
+        if key not in self._handles:
+            self._handles[key] = database[name]
+        return self._handles[key]
 
 
 _conn = MongoConnector()
 
 
 def mongo_data_database(db=DB_DATA, use_secondary=False):
-    _read_preference = (
-        ReadPreference.SECONDARY_PREFERRED
-        if use_secondary else
-        ReadPreference.PRIMARY
-    )
+    return _conn.get_database(db, use_secondary=use_secondary)
 
-    return _conn.connector.get_database(db, read_preference=_read_preference)
+
+def get_pool_metrics():
+    """
+    Return connection pool counters of the current process.
+    """
+    return _conn.metrics.get_stats()
 
 
 def c_chat_stack(use_secondary=False):
-    return mongo_data_database(use_secondary=use_secondary)[COLLECTION_CHAT_STACK]
+    return _conn.get_collection(COLLECTION_CHAT_STACK, DB_DATA, use_secondary=use_secondary)
 
 
 def c_milestone_orct(use_secondary=False):
-    return mongo_data_database(use_secondary=use_secondary)[COLLECTION_MILESTONE_ORCT]
+    return _conn.get_collection(COLLECTION_MILESTONE_ORCT, DB_DATA, use_secondary=use_secondary)
+
+
+def c_milestone_orct_counts(use_secondary=False):
+    return _conn.get_collection(COLLECTION_MILESTONE_ORCT_COUNTS, DB_DATA, use_secondary=use_secondary)
 
 
 def c_onboarding_status(use_secondary=False):
-    return mongo_data_database(use_secondary=use_secondary)[COLLECTION_ONBOARDING_STATUS]
+    return _conn.get_collection(COLLECTION_ONBOARDING_STATUS, DB_DATA, use_secondary=use_secondary)
 
 
 def c_onboarding_settings(use_secondary=False):
-    return mongo_data_database(use_secondary=use_secondary)[COLLECTION_ONBOARDING_SETTINGS]
+    return _conn.get_collection(COLLECTION_ONBOARDING_SETTINGS, DB_DATA, use_secondary=use_secondary)
 
 
 def c_faq_data(use_secondary=False):
-    return mongo_data_database(use_secondary=use_secondary)[COLLECTION_FAQ_DATA]
+    return _conn.get_collection(COLLECTION_FAQ_DATA, DB_DATA, use_secondary=use_secondary)
 
 
 def c_chat_context(use_secondary=False):
-    return mongo_data_database(use_secondary=use_secondary)[COLLECTION_CHAT_CONTEXT]
+    return _conn.get_collection(COLLECTION_CHAT_CONTEXT, DB_DATA, use_secondary=use_secondary)
 
 
 def do_health(use_secondary=False):
@@ -0,0 +1,260 @@
+"""
+Storage of small per-chat documents and question stacks.
+
+Documents are found by a key dict (like a Mongo filter) in a collection and
+updated with (dotted) field values like Mongo `$set` does. Stacks are lists
+of ids identified by a stack id. Stacks keep settings.QUESTION_STACK_MAX_SIZE
+last values and expire settings.QUESTION_STACK_TTL seconds after the last push
+(MemoryStorage stacks do not expire). MongoStorage indexes, including the
+expiring one, are created by the ensure_storage_indexes command on deploy.
+
+settings.CHAT_STORAGE_BACKEND selects the backend:
+`MongoStorage` (default), `RedisStorage` or `MemoryStorage` (tests, benchmarks).
+
+Only chat contexts and question stacks are kept here, Mongo stays required
+with any backend for the rest of chat data:
+
+- FAQ selections (`c_faq_data`) are queried and updated by array elements,
+  e.g. `faqs.<id>.answers.done` with a positional `$` update;
+- onboarding status (`c_onboarding_status`) is read by `$in` queries and
+  bulk written by the onboarding_preprocess command, and read per request
+  through its own cache (settings.ONBOARDING_CACHE_ALIAS).
+"""
+import copy
+import datetime
+import logging
+import pickle
+import threading
+
+import redis
+from django.conf import settings
+from pymongo.errors import OperationFailure
+from django.utils.module_loading import import_string
+
+from .mongo import c_chat_context, c_chat_stack
+
+
+log = logging.getLogger(__name__)
+
+CHAT_CONTEXT = 'chat_context'
+CHAT_STACK = 'chat_stack'
+
+
+def set_path(doc, key, value):
+    """
+    Set value in doc by dotted Mongo key, e.g. "activity.42".
+    """
+    *parents, last = key.split('.')
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+class BaseStorage(object):
+    """
+    Storage backend interface.
+    """
+    def get(self, collection, key):
+        """
+        Return document found by key or None.
+        """
+        raise NotImplementedError
+
+    def update(self, collection, key, values, upsert=False):
+        """
+        Set (dotted) fields of the document, create it with key fields if upsert.
+        """
+        raise NotImplementedError
+
+    def ensure_indexes(self):
+        """
+        Create indexes the backend needs, see the ensure_storage_indexes command.
+        """
+
+    def push(self, stack_id, value):
+        raise NotImplementedError
+
+    def pop(self, stack_id):
+        """
+        Remove and return the last stack value or None if the stack is empty.
+        """
+        raise NotImplementedError
+
+    def peek(self, stack_id):
+        """
+        Return the last stack value or None if the stack is empty.
+        """
+        raise NotImplementedError
+
+
+class MongoStorage(BaseStorage):
+    """
+    Documents and stacks in Mongo collections, stacks are `stack` fields of chat_stack documents.
+    """
+    collections = {
+        CHAT_CONTEXT: c_chat_context,
+        CHAT_STACK: c_chat_stack,
+    }
+
+    def get(self, collection, key):
+        return self.collections[collection]().find_one(key)
+
+    def update(self, collection, key, values, upsert=False):
+        self.collections[collection]().update_one(key, {'$set': values}, upsert=upsert)
+
+    def ensure_indexes(self):
+        """
+        Create stack indexes, the expiring index is updated if settings.QUESTION_STACK_TTL changed.
+        """
+        stacks = c_chat_stack()
+        try:
+            stacks.create_index('stack_id')
+            try:
+                stacks.create_index('updated', expireAfterSeconds=settings.QUESTION_STACK_TTL)
+            except OperationFailure:  # the index exists with another TTL
+                stacks.database.command(
+                    'collMod', stacks.name,
+                    index={'keyPattern': {'updated': 1}, 'expireAfterSeconds': settings.QUESTION_STACK_TTL}
+                )
+        except OperationFailure as e:
+            log.error('Can not create chat stack indexes: {}'.format(e))
+
+    def push(self, stack_id, value):
+        c_chat_stack().update_one(
+            {'stack_id': stack_id},
+            {
+                '$push': {'stack': {'$each': [value], '$slice': -settings.QUESTION_STACK_MAX_SIZE}},
+                '$set': {'updated': datetime.datetime.utcnow()},
+            },
+            upsert=True
+        )
+
+    def pop(self, stack_id):
+        document = c_chat_stack().find_one_and_update({'stack_id': stack_id}, {'$pop': {'stack': 1}})
+        stack = document.get('stack') if document else None
+        return stack[-1] if stack else None
+
+    def peek(self, stack_id):
+        document = c_chat_stack().find_one({'stack_id': stack_id}, {'stack': 1})
+        stack = document.get('stack') if document else None
+        return stack[-1] if stack else None
+
+
+class MemoryStorage(BaseStorage):
+    """
+    Process local storage.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._documents = {}
+        self._stacks = {}
+
+    def _doc_key(self, collection, key):
+        return (collection,) + tuple(sorted(key.items()))
+
+    def get(self, collection, key):
+        document = self._documents.get(self._doc_key(collection, key))
+        return copy.deepcopy(document)
+
+    def update(self, collection, key, values, upsert=False):
+        doc_key = self._doc_key(collection, key)
+        with self._lock:
+            document = self._documents.get(doc_key)
+            if document is None:
+                if not upsert:
+                    return
+                document = self._documents[doc_key] = dict(key)
+            for field, value in values.items():
+                set_path(document, field, copy.deepcopy(value))
+
+    def push(self, stack_id, value):
+        with self._lock:
+            stack = self._stacks.setdefault(stack_id, [])
+            stack.append(value)
+            del stack[:-settings.QUESTION_STACK_MAX_SIZE]
+
+    def pop(self, stack_id):
+        with self._lock:
+            stack = self._stacks.get(stack_id)
+            return stack.pop() if stack else None
+
+    def peek(self, stack_id):
+        stack = self._stacks.get(stack_id)
+        return stack[-1] if stack else None
+
+
+class RedisStorage(BaseStorage):
+    """
+    Documents are Redis hashes of dotted fields, stacks are Redis lists.
+
+    Values are pickled, so datetimes and nested dicts are kept as they are.
+    """
+    def __init__(self, url=None):
+        self.redis = redis.Redis.from_url(url or settings.CHAT_STORAGE_REDIS_URL)
+
+    def _doc_name(self, collection, key):
+        return ':'.join([collection] + ['{}={}'.format(name, key[name]) for name in sorted(key)])
+
+    def _stack_name(self, stack_id):
+        return 'stack:{}'.format(stack_id)
+
+    def get(self, collection, key):
+        fields = self.redis.hgetall(self._doc_name(collection, key))
+        if not fields:
+            return None
+        document = dict(key)
+        # parents go first, so nested fields update them
+        for field in sorted(fields, key=lambda field: field.count(b'.')):
+            set_path(document, field.decode(), pickle.loads(fields[field]))
+        return document
+
+    def update(self, collection, key, values, upsert=False):
+        name = self._doc_name(collection, key)
+        fields = self.redis.hkeys(name)
+        if not fields:
+            if not upsert:
+                return
+            values = dict(key, **values)
+        # a set field replaces its nested fields
+        overridden = [
+            field for field in fields
+            if any(field.decode().startswith(value_field + '.') for value_field in values)
+        ]
+        pipe = self.redis.pipeline()
+        if overridden:
+            pipe.hdel(name, *overridden)
+        for field, value in values.items():
+            pipe.hset(name, field, pickle.dumps(value))
+        pipe.execute()
+
+    def push(self, stack_id, value):
+        name = self._stack_name(stack_id)
+        pipe = self.redis.pipeline()
+        pipe.rpush(name, pickle.dumps(value))
+        pipe.ltrim(name, -settings.QUESTION_STACK_MAX_SIZE, -1)
+        pipe.expire(name, settings.QUESTION_STACK_TTL)
+        pipe.execute()
+
+    def pop(self, stack_id):
+        value = self.redis.rpop(self._stack_name(stack_id))
+        return pickle.loads(value) if value is not None else None
+
+    def peek(self, stack_id):
+        value = self.redis.lindex(self._stack_name(stack_id), -1)
+        return pickle.loads(value) if value is not None else None
+
+
+_storages = {}
+
+
+def get_storage():
+    """
+    Return the instance of settings.CHAT_STORAGE_BACKEND.
+    """
+    path = settings.CHAT_STORAGE_BACKEND
+    if path not in _storages:
+        _storages[path] = import_string(path)()
+    return _storages[path]
@@ -10,6 +10,7 @@ import waffle
 from django.dispatch import receiver
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.core.mail import send_mail
 from django.shortcuts import reverse
 from django.template import loader
@@ -17,6 +18,7 @@ from django.template import loader
 from core.common.mongo import c_onboarding_status, c_onboarding_settings
 from core.common import onboarding
 from core.tasks import intercom_event
+from core.outbox import outbox_handler
 
 
 logger = logging.getLogger(__name__)
@@ -100,26 +102,52 @@ def get_onboarding_steps():
     ]
 
 
+def onboarding_status_cache_key(user_id):
+    return 'onboarding_status.{}'.format(user_id)
+
+
+def get_onboarding_status(user_id):
+    """
+    Return onboarding status document of the user, cached per user.
+    """
+    cache = caches[settings.ONBOARDING_CACHE_ALIAS]
+    key = onboarding_status_cache_key(user_id)
+    status = cache.get(key)
+    if status is None:
+        status = c_onboarding_status().find_one({onboarding.USER_ID: user_id}, {'_id': 0}) or {}
+        cache.set(key, status, settings.ONBOARDING_CACHE_TIMEOUT)
+    return status
+
+
+def set_onboarding_steps(user_id, steps):
+    """
+    Save steps (step: bool) to the user's onboarding status and drop the cached one.
+    """
+    c_onboarding_status().update_one({onboarding.USER_ID: user_id}, {'$set': steps}, upsert=True)
+    caches[settings.ONBOARDING_CACHE_ALIAS].delete(onboarding_status_cache_key(user_id))
+
+
+def get_status_percentage(status):
+    steps = [status.get(key, False) for key in get_onboarding_steps()]
+    # TODO rewrite it to len([x for x in steps if x]) / float(len(steps)) * 100, ?
+    return round(len(list([x for x in steps if x])) / float(len(steps)) * 100, 0)
+
+
 def get_onboarding_percentage(user_id):
     if user_id:
-        status = c_onboarding_status(use_secondary=True).find_one({onboarding.USER_ID: user_id}) or {}
+        status = get_onboarding_status(user_id)
         if status:
-            steps = [status.get(key, False) for key in get_onboarding_steps()]
-            return round(
-                # TODO rewrite it to len([x for x in steps if x]) / float(len(steps)) * 100, ?
-                len(list([x for x in steps if x])) / float(len(steps)) * 100,
-                0
-            )
+            return get_status_percentage(status)
     return 0
 
 
+ONBOARDING_STEP = 'core.onboarding_step'
+
+
+@outbox_handler(ONBOARDING_STEP)
 def update_onboarding_step(step, user_id):
-    find_crit = {onboarding.USER_ID: user_id}
-    onboarding_data = c_onboarding_status(use_secondary=True).find_one(find_crit)
-    if not onboarding_data or not onboarding_data.get(step):
-        c_onboarding_status().update_one(find_crit, {'$set': {
-            step: True
-        }}, upsert=True)
+    if not get_onboarding_status(user_id).get(step):
+        set_onboarding_steps(user_id, {step: True})
         user = User.objects.filter(id=user_id).first()
         if user:
             create_intercom_event(
@@ -202,7 +230,7 @@ def get_onboarding_status_with_settings(user_id):
         }
     }
     """
-    onboarding_status = c_onboarding_status().find_one({onboarding.USER_ID: user_id}, {'_id': 0, 'user_id': 0}) or {}
+    onboarding_status = get_onboarding_status(user_id)
 
     return {
         step: {
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class OutboxEvent(models.Model):
+    """
+    Event written in the transaction of the change it describes.
+
+    Events are processed after commit by the `core.tasks.drain_outbox` task, see core.outbox.
+    """
+    kind = models.CharField(max_length=64)
+    payload = models.TextField()  # JSON: handler kwargs
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '{} {}'.format(self.kind, self.payload)
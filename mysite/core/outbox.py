@@ -0,0 +1,85 @@
+"""
+Transactional outbox.
+
+Side effects of a request (emails, Mongo and Intercom updates) are published
+as `OutboxEvent` rows in the same DB transaction and processed in batches by
+the `core.tasks.drain_outbox` celery task, so they neither slow the request
+down nor get lost when the broker is unavailable.
+
+With settings.OUTBOX_ALWAYS_EAGER events are processed right away.
+"""
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import OutboxEvent
+
+
+log = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def outbox_handler(kind):
+    """
+    Register function as the handler of `kind` events.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def dispatch(kind, payload):
+    return _handlers[kind](**payload)
+
+
+def publish(kind, **payload):
+    """
+    Publish an event, handler of `kind` is called with payload as kwargs.
+    """
+    if settings.OUTBOX_ALWAYS_EAGER:
+        return dispatch(kind, payload)
+    OutboxEvent.objects.create(kind=kind, payload=json.dumps(payload))
+    transaction.on_commit(schedule_drain)
+
+
+def schedule_drain():
+    from .tasks import drain_outbox
+
+    try:
+        drain_outbox.delay()
+    except Exception as e:  # the periodic drain_outbox run will process the events
+        log.warning('Can not schedule outbox drain: {}'.format(e))
+
+
+def drain(batch_size, after_id=0):
+    """
+    Process a batch of pending events with id greater than `after_id`.
+
+    Processed events are deleted, failed ones are retried by the next runs up to
+    settings.OUTBOX_MAX_ATTEMPTS times. Return id of the last event of the batch
+    or None if there are no pending events.
+    """
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(id__gt=after_id, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+            .order_by('id')[:batch_size]
+        )
+        processed = []
+        for event in events:
+            try:
+                with transaction.atomic():
+                    dispatch(event.kind, json.loads(event.payload))
+            except Exception as e:
+                log.exception('Outbox event {} failed'.format(event.id))
+                event.attempts += 1
+                event.last_error = repr(e)
+                event.save(update_fields=['attempts', 'last_error'])
+            else:
+                processed.append(event.id)
+        OutboxEvent.objects.filter(id__in=processed).delete()
+    return events[-1].id if events else None
@@ -56,3 +56,16 @@ def faq_notify_students(**kwargs) -> None:
             settings.EMAIL_FROM,
             kwargs.get('students'),
         )
+
+
+@celery_app.task
+def drain_outbox(batch_size=None) -> None:
+    """
+    Process pending outbox events in batches.
+    """
+    from .outbox import drain
+
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    last_id = drain(batch_size)
+    while last_id:
+        last_id = drain(batch_size, after_id=last_id)
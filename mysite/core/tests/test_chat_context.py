@@ -0,0 +1,38 @@
+import random
+
+from core.common.chat_context import get_chat_context, chat_context_scope
+from core.common.mongo import c_chat_context
+
+
+def test_chat_context_write_through():
+    chat_id = random.randint(9999, 999999)
+    get_chat_context(chat_id).set({'thread_id': 1})
+    assert c_chat_context().find_one({'chat_id': chat_id}) is None
+
+    get_chat_context(chat_id).set({'thread_id': 1, 'activity.1': 'now'}, upsert=True)
+    assert get_chat_context(chat_id).get('activity') == {'1': 'now'}
+
+
+def test_chat_context_scope(mocker):
+    chat_id = random.randint(9999, 999999)
+    c_chat_context().insert_one({'chat_id': chat_id, 'thread_id': 1, 'activity': {'1': 'then'}})
+    find_one = mocker.spy(c_chat_context().__class__, 'find_one')
+    update_one = mocker.spy(c_chat_context().__class__, 'update_one')
+
+    with chat_context_scope():
+        context = get_chat_context(chat_id)
+        context.set({'need_faqs': True})
+        assert get_chat_context(chat_id) is context
+        assert context.get('thread_id') == 1
+        with chat_context_scope():
+            get_chat_context(chat_id).set({'thread_id': 2, 'activity.2': 'now'}, upsert=True)
+        assert context.get('thread_id') == 2
+        assert context.get('activity') == {'1': 'then', '2': 'now'}
+        assert update_one.call_count == 0
+
+    assert find_one.call_count == 1
+    assert update_one.call_count == 1
+    doc = c_chat_context().find_one({'chat_id': chat_id})
+    assert doc['thread_id'] == 2
+    assert doc['need_faqs'] is True
+    assert doc['activity'] == {'1': 'then', '2': 'now'}
@@ -0,0 +1,52 @@
+import threading
+
+from core.common import mongo
+
+
+def test_collection_handles_cached(mocker):
+    get_database = mocker.spy(mongo._conn.connector.__class__, 'get_database')
+    mongo.c_chat_context(use_secondary=True)
+    mongo.c_chat_context(use_secondary=True)
+    mongo.c_faq_data(use_secondary=True)
+    assert get_database.call_count <= 1
+
+
+def test_reconnect_after_fork(mocker):
+    mongo.c_chat_context()
+    init = mocker.spy(mongo.MongoConnector, '_mongo_init')
+    mocker.patch('core.common.mongo.os.getpid', return_value=-1)
+
+    mongo.c_chat_context()
+    mongo.c_chat_context()
+    assert init.call_count == 1
+    assert mongo._conn._pid == -1
+
+
+def test_pool_metrics(mocker):
+    metrics = mongo.PoolMetrics()
+    event = mocker.Mock()
+    metrics.connection_created(event)
+    metrics.connection_created(event)
+    metrics.connection_checked_out(event)
+    metrics.connection_closed(event)
+
+    stats = metrics.get_stats()
+    assert stats['connections_created'] == 2
+    assert stats['open_connections'] == 1
+    assert stats['in_use'] == 1
+
+
+def test_pool_metrics_threads(mocker):
+    metrics = mongo.PoolMetrics()
+    event = mocker.Mock()
+
+    def check_out():
+        for _ in range(1000):
+            metrics.connection_checked_out(event)
+
+    threads = [threading.Thread(target=check_out) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.get_stats()['checked_out'] == 8000
@@ -0,0 +1,50 @@
+import pytest
+
+from core.models import OutboxEvent
+from core.outbox import outbox_handler, publish
+from core.tasks import drain_outbox
+
+
+calls = []
+
+
+@outbox_handler('test.append')
+def append(value):
+    if value == 'fail':
+        raise ValueError(value)
+    calls.append(value)
+
+
+@pytest.mark.django_db
+def test_publish_eager(settings):
+    del calls[:]
+    settings.OUTBOX_ALWAYS_EAGER = True
+    publish('test.append', value=1)
+    assert calls == [1]
+    assert not OutboxEvent.objects.exists()
+
+
+@pytest.mark.django_db
+def test_publish_drain(settings, mocker):
+    del calls[:]
+    settings.OUTBOX_ALWAYS_EAGER = False
+    settings.OUTBOX_MAX_ATTEMPTS = 2
+    delay = mocker.patch('core.tasks.drain_outbox.delay', side_effect=ConnectionError)
+
+    for value in (1, 'fail', 2, 3):
+        publish('test.append', value=value)
+    assert calls == []
+    assert OutboxEvent.objects.count() == 4
+
+    drain_outbox(batch_size=2)
+    assert calls == [1, 2, 3]
+    failed = OutboxEvent.objects.get()
+    assert failed.attempts == 1
+    assert 'fail' in failed.last_error
+
+    drain_outbox()
+    drain_outbox()
+    assert calls == [1, 2, 3]
+    assert OutboxEvent.objects.get().attempts == 2
+    # broker errors do not break publishing, the test transaction is never committed
+    assert delay.call_count == 0
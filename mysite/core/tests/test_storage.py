@@ -0,0 +1,86 @@
+import random
+
+import pytest
+from django.utils import timezone
+from pymongo.errors import OperationFailure
+from redis.exceptions import ConnectionError
+
+from core.common.chat_context import get_chat_context
+from core.common.storage import CHAT_CONTEXT, MemoryStorage, MongoStorage, RedisStorage, get_storage
+
+
+@pytest.fixture(params=[MongoStorage, MemoryStorage, RedisStorage])
+def storage(request):
+    storage = request.param()
+    if isinstance(storage, RedisStorage):
+        try:
+            storage.redis.ping()
+        except ConnectionError:
+            pytest.skip('Redis is not available')
+    return storage
+
+
+def test_documents(storage):
+    key = {'chat_id': random.randint(9999, 999999)}
+    now = timezone.now().replace(microsecond=0)
+    storage.update(CHAT_CONTEXT, key, {'thread_id': 1})
+    assert storage.get(CHAT_CONTEXT, key) is None
+
+    storage.update(CHAT_CONTEXT, key, {'thread_id': 1, 'activity.1': now}, upsert=True)
+    storage.update(CHAT_CONTEXT, key, {'activity.2': now, 'need_faqs': False})
+    document = storage.get(CHAT_CONTEXT, key)
+    assert document['chat_id'] == key['chat_id']
+    assert document['thread_id'] == 1
+    assert document['need_faqs'] is False
+    assert set(document['activity']) == {'1', '2'}
+
+    storage.update(CHAT_CONTEXT, key, {'activity': {'3': now}})
+    assert list(storage.get(CHAT_CONTEXT, key)['activity']) == ['3']
+
+
+def test_stack(storage):
+    stack_id = 'question_stack:uid:1:chat_id:{}'.format(random.randint(9999, 999999))
+    assert storage.peek(stack_id) is None
+    assert storage.pop(stack_id) is None
+
+    storage.push(stack_id, 1)
+    storage.push(stack_id, 2)
+    assert storage.peek(stack_id) == 2
+    assert storage.pop(stack_id) == 2
+    assert storage.pop(stack_id) == 1
+    assert storage.pop(stack_id) is None
+
+
+def test_chat_context_backend(settings):
+    settings.CHAT_STORAGE_BACKEND = 'core.common.storage.MemoryStorage'
+    get_chat_context(1).set({'thread_id': 2}, upsert=True)
+    assert get_storage().get(CHAT_CONTEXT, {'chat_id': 1})['thread_id'] == 2
+    assert get_chat_context(1).get('thread_id') == 2
+
+
+def test_stack_max_size(storage, settings):
+    settings.QUESTION_STACK_MAX_SIZE = 2
+    stack_id = 'question_stack:uid:1:chat_id:{}'.format(random.randint(9999, 999999))
+    for value in (1, 2, 3):
+        storage.push(stack_id, value)
+    assert storage.pop(stack_id) == 3
+    assert storage.pop(stack_id) == 2
+    assert storage.pop(stack_id) is None
+
+
+def test_mongo_ensure_indexes(mocker, settings):
+    stacks = mocker.patch('core.common.storage.c_chat_stack').return_value
+    stacks.create_index.side_effect = [None, OperationFailure('IndexOptionsConflict')]
+    MongoStorage().ensure_indexes()
+    # changed TTL of the existing index is updated
+    stacks.database.command.assert_called_once_with(
+        'collMod', stacks.name,
+        index={'keyPattern': {'updated': 1}, 'expireAfterSeconds': settings.QUESTION_STACK_TTL}
+    )
+
+    stacks.create_index.side_effect = OperationFailure('not authorized')
+    MongoStorage().ensure_indexes()  # logged, not raised
+
+    MongoStorage().push('question_stack:uid:1:chat_id:1', 1)
+    stacks.update_one.assert_called_once()
+    assert stacks.create_index.call_count == 3
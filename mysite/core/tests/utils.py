@@ -8,13 +8,14 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core import mail
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.shortcuts import reverse
 from django.utils import timezone
 
 from accounts.models import Instructor
 from chat.models import EnrollUnitCode, Chat
-from core.common.utils import send_email, get_onboarding_percentage
+from core.common.mongo import c_onboarding_status
+from core.common.utils import send_email, get_onboarding_percentage, get_onboarding_status, set_onboarding_steps
 from core.common import onboarding
 from core.common.utils import get_onboarding_setting, ONBOARDING_STEPS_DEFAULT_TEMPLATE, \
     get_onboarding_status_with_settings, get_redirect_url
@@ -78,6 +79,23 @@ class UtilityTest(TestCase):
         _mock.find_one.return_value = steps
         self.assertEqual(get_onboarding_percentage(1), result)
 
+    @override_settings(CACHES=dict(
+        settings.CACHES, onboarding={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    ))
+    def test_onboarding_status_cache(self):
+        user_id = 424242
+        c_onboarding_status().delete_many({onboarding.USER_ID: user_id})
+        set_onboarding_steps(user_id, {onboarding.STEP_1: True})
+        self.assertTrue(get_onboarding_status(user_id)[onboarding.STEP_1])
+
+        c_onboarding_status().update_one({onboarding.USER_ID: user_id}, {'$set': {onboarding.STEP_2: True}})
+        self.assertNotIn(onboarding.STEP_2, get_onboarding_status(user_id))
+
+        set_onboarding_steps(user_id, {onboarding.STEP_3: True})
+        status = get_onboarding_status(user_id)
+        self.assertTrue(status[onboarding.STEP_2])
+        self.assertTrue(status[onboarding.STEP_3])
+
     @mock.patch('core.common.utils.c_onboarding_status')
     @unpack
     @data(
@@ -3,7 +3,7 @@ Email sending utils to generalize celery background tasks.
 """
 import logging
 
-from django.core.mail import BadHeaderError, send_mail
+from django.core.mail import BadHeaderError, get_connection, send_mail, send_mass_mail
 
 
 log = logging.getLogger(__name__)
@@ -19,3 +19,16 @@ def send_emails(subj: str, text: str, email_from: str, recipients: list, fail_si
         except BadHeaderError as e:
             log.error(f'Invalid header found. {e}')
             continue
+
+
+def send_mass_emails(messages, chunk_size=100, fail_silently=False) -> int:
+    """
+    Send (subj, text, email_from, recipients) messages over one connection in chunks.
+
+    Return number of sent messages.
+    """
+    sent = 0
+    with get_connection(fail_silently=fail_silently) as connection:
+        for i in range(0, len(messages), chunk_size):
+            sent += send_mass_mail(messages[i:i + chunk_size], fail_silently=fail_silently, connection=connection)
+    return sent
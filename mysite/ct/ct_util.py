@@ -1,8 +1,11 @@
 import hashlib
+import threading
+from collections import OrderedDict
 from functools import wraps
 
+from django.conf import settings
 from django.urls import reverse
-from django.core.cache import cache
+from django.core.cache import cache, caches
 from django.utils.encoding import force_bytes
 from django.utils.http import urlquote
 
@@ -125,3 +128,66 @@ def get_middle_indexes(lst):
         return [n / 2 - 1, n / 2]
     else:
         return [n // 2]
+
+
+class RenderCache(object):
+    """
+    Two-tier cache for rendered markup.
+
+    Lookups go to an in-process LRU first and then to the shared Django
+    cache configured by `cache_alias`. Keys are content hashes of the
+    source text plus the renderer arguments, so changed text never hits a
+    stale entry; `delete` only exists to evict entries early.
+    """
+    def __init__(self, prefix, maxsize=None, cache_alias=None, timeout=None):
+        self.prefix = prefix
+        self.maxsize = maxsize if maxsize is not None else getattr(settings, 'MD2HTML_LRU_SIZE', 2048)
+        self.cache_alias = cache_alias or getattr(settings, 'MD2HTML_CACHE_ALIAS', 'default')
+        self.timeout = settings.MD2HTML_CACHE_TIMEOUT if timeout is None else timeout
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def make_key(self, txt, args=()):
+        """
+        Return cache key for the source `txt` rendered with `args`.
+        """
+        digest = hashlib.md5(force_bytes(repr(tuple(args))) + b'\0' + force_bytes(txt)).hexdigest()
+        return '%s:%s' % (self.prefix, digest)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._local[key] = value
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._local[key]
+            except KeyError:
+                value = None
+            else:
+                self._local.move_to_end(key)
+                return value
+        value = self.shared.get(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        self._remember(key, value)
+        self.shared.set(key, value, self.timeout)
+
+    def delete(self, key):
+        with self._lock:
+            self._local.pop(key, None)
+        self.shared.delete(key)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
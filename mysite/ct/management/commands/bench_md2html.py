@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ct.models import Lesson
+from ct.templatetags.ct_extras import rst2html, rst2html_many
+
+
+SAMPLE_TEXT = '''Lesson %d with *emphasis*, ``code`` and math \\(x^2 + %d\\).
+
+* first item
+* second item `with a link <https://example.com/%d>`_
+'''
+
+
+class Command(BaseCommand):
+    """
+    Compare per call vs batched ReST -> HTML conversion throughput.
+
+    Bypasses the md2html cache, so every conversion runs pandoc.
+    """
+    help = 'Benchmark per call vs batched md2html rendering'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help='Number of texts to render')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs, best one is reported')
+        parser.add_argument(
+            '--sample', action='store_true', help='Use synthetic texts instead of Lesson texts from DB'
+        )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        texts = [] if options['sample'] else list(
+            Lesson.objects.exclude(text='').exclude(text__isnull=True)
+            .order_by('-id').values_list('text', flat=True)[:count]
+        )
+        if not texts:
+            texts = [SAMPLE_TEXT % (i, i, i) for i in range(count)]
+
+        per_call = self.best_of(options['repeat'], lambda: [rst2html(txt) for txt in texts])
+        batched = self.best_of(options['repeat'], lambda: rst2html_many(texts))
+
+        self.stdout.write('texts: {}'.format(len(texts)))
+        for label, seconds in (('per call', per_call), ('batched', batched)):
+            self.stdout.write('{:>9}: {:.3f}s, {:.1f} texts/s'.format(
+                label, seconds, len(texts) / seconds
+            ))
+        self.stdout.write('speedup: {:.1f}x'.format(per_call / batched))
+
+    @staticmethod
+    def best_of(repeat, func):
+        timings = []
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
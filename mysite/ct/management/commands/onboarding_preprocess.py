@@ -1,18 +1,56 @@
+import time
 
+from django.core.cache import caches
 from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
 
-from ct.models import Course, Role, UnitLesson, Unit, Lesson, Response
-from ctms.models import Invite
+from ct.models import Course, Unit, Lesson
 from chat.models import Chat, EnrollUnitCode
 from accounts.models import Instructor
-from core.common.utils import update_onboarding_step, get_onboarding_percentage
+from core.common.mongo import c_onboarding_status
+from core.common.utils import create_intercom_event, get_status_percentage, onboarding_status_cache_key
 from core.common import onboarding
 from django.conf import settings
 
 
 class Command(BaseCommand):
+    """
+    Mark onboarding steps instructors have already done.
+
+    Steps are computed for all instructors with one query per step and saved with one bulk write.
+    """
     help = 'Onboarding preprocessing'
 
+    def get_done_steps(self, course, user_ids):
+        """
+        Return {step: distinct ids of users which have done the step}.
+        """
+        return {
+            onboarding.STEP_2: Chat.objects.filter(
+                user_id__in=user_ids,
+                enroll_code__courseUnit__course=course,
+                progress__gte=70
+            ).order_by().values_list('user_id', flat=True).distinct(),
+            # if instructor has created create_course
+            onboarding.STEP_3: Course.objects.filter(
+                addedBy_id__in=user_ids
+            ).order_by().values_list('addedBy_id', flat=True).distinct(),
+            # if instructor has created a create_courselet
+            onboarding.STEP_4: Unit.objects.filter(
+                addedBy_id__in=user_ids
+            ).order_by().values_list('addedBy_id', flat=True).distinct(),
+            # if instructor has created a create_thread
+            onboarding.STEP_5: Lesson.objects.filter(
+                addedBy_id__in=user_ids, kind=Lesson.ANSWER
+            ).order_by().values_list('addedBy_id', flat=True).distinct(),
+            onboarding.STEP_6: EnrollUnitCode.objects.filter(
+                courseUnit__course__addedBy_id__in=user_ids,
+                isPreview=True,
+                isLive=False,
+                isTest=False
+            ).order_by().values_list('courseUnit__course__addedBy_id', flat=True).distinct(),
+        }
+
     def handle(self, *args, **options):
         try:
             course = Course.objects.get(id=settings.ONBOARDING_INTRODUCTION_COURSE_ID)
@@ -20,40 +58,40 @@ class Command(BaseCommand):
             print("Onboarding course is not provided")
             return
 
-        for instructor in Instructor.objects.all():
-
-            chat_exists = Chat.objects.filter(
-                user=instructor.user,
-                enroll_code__courseUnit__course=course,
-                progress__gte=70
-            ).exists()
-            if chat_exists:
-                update_onboarding_step(onboarding.STEP_2, instructor.user_id)
-
-            # if instructor has created create_course
-
-            if Course.objects.filter(addedBy=instructor.user).exists():
-                update_onboarding_step(onboarding.STEP_3, instructor.user_id)
-
-            # if instructor has created a create_courselet
-
-            if Unit.objects.filter(addedBy=instructor.user).exists():
-                update_onboarding_step(onboarding.STEP_4, instructor.user_id)
-
-            # if instructor has created a create_thread
+        instructors = {
+            instructor.user_id: instructor.user for instructor in Instructor.objects.select_related('user')
+        }
+        user_ids = Instructor.objects.values('user_id')
+        statuses = {
+            status[onboarding.USER_ID]: status
+            for status in c_onboarding_status().find({onboarding.USER_ID: {'$in': list(instructors)}}, {'_id': 0})
+        }
 
-            if Lesson.objects.filter(addedBy=instructor.user, kind=Lesson.ANSWER).exists():
-                update_onboarding_step(onboarding.STEP_5, instructor.user_id)
+        new_steps = {}
+        for step, done_user_ids in self.get_done_steps(course, user_ids).items():
+            for user_id in done_user_ids:
+                status = statuses.setdefault(user_id, {})
+                if not status.get(step):
+                    status[step] = True
+                    new_steps.setdefault(user_id, {})[step] = True
 
-            enroll_unit_code_exists = EnrollUnitCode.objects.filter(
-                courseUnit__course__addedBy=instructor.user,
-                isPreview=True,
-                isLive=False,
-                isTest=False
-            ).exists()
-            if enroll_unit_code_exists:
-                update_onboarding_step(onboarding.STEP_6, instructor.user_id)
+        if new_steps:
+            c_onboarding_status().bulk_write([
+                UpdateOne({onboarding.USER_ID: user_id}, {'$set': steps}, upsert=True)
+                for user_id, steps in new_steps.items()
+            ], ordered=False)
+            caches[settings.ONBOARDING_CACHE_ALIAS].delete_many(
+                [onboarding_status_cache_key(user_id) for user_id in new_steps]
+            )
+            for user_id, steps in new_steps.items():
+                for step in steps:
+                    create_intercom_event(
+                        event_name='step-completed',
+                        created_at=int(time.mktime(time.localtime())),
+                        email=instructors[user_id].email,
+                        metadata={'step': step}
+                    )
 
-            print(("Instructor {} passed onboarding at {}%".format(
-                instructor.user.username, get_onboarding_percentage(instructor.user.id))
-            ))
+        for user_id, user in instructors.items():
+            percentage = get_status_percentage(statuses[user_id]) if statuses.get(user_id) else 0
+            print(("Instructor {} passed onboarding at {}%".format(user.username, percentage)))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from core.common.mongo import c_milestone_orct, c_milestone_orct_counts
+from ct.signals import ensure_milestone_indexes
+
+
+class Command(BaseCommand):
+    """
+    Recompute ORCT milestone students counters from stored milestone records.
+
+    Run it once for milestones recorded before counters existed, counters are
+    overwritten, so students recorded during the run may be lost from them.
+    """
+    help = 'Rebuild ORCT milestone students counters'
+
+    def handle(self, *args, **options):
+        ensure_milestone_indexes()
+        groups = c_milestone_orct(use_secondary=False).aggregate([
+            {'$group': {'_id': {'milestone': '$milestone', 'lesson_id': '$lesson_id'}, 'students_number': {'$sum': 1}}}
+        ])
+        updates = [
+            UpdateOne(group['_id'], {'$set': {'students_number': group['students_number']}}, upsert=True)
+            for group in groups
+        ]
+        if updates:
+            c_milestone_orct_counts(use_secondary=False).bulk_write(updates, ordered=False)
+        self.stdout.write('{} counters'.format(len(updates)))
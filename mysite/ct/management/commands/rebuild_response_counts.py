@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ct.models import ResponseCounts
+
+
+class Command(BaseCommand):
+    """
+    Recompute ResponseCounts from responses, e.g. after bulk updates which bypass signals.
+    """
+    help = 'Rebuild pre-aggregated response counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('unit_lesson_ids', nargs='*', type=int, help='UnitLessons to rebuild, all by default')
+
+    def handle(self, *args, **options):
+        ResponseCounts.rebuild(options['unit_lesson_ids'] or None)
+        self.stdout.write('{} counters'.format(ResponseCounts.objects.count()))
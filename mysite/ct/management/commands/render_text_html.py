@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from ct.tasks import render_text_html
+
+
+RENDERED_MODELS = ('ct.Lesson', 'ct.Response', 'chat.ChatDivider')
+
+
+class Command(BaseCommand):
+    """
+    Backfill stored HTML of Lesson, Response and ChatDivider texts.
+    """
+    help = 'Render ReST text to stored HTML for existing rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows rendered per pandoc run')
+        parser.add_argument('--all', action='store_true', help='Re-render rows that already have HTML')
+        parser.add_argument('--async', action='store_true', dest='async_', help='Queue Celery tasks instead')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model_label in RENDERED_MODELS:
+            queryset = apps.get_model(model_label)._base_manager.all()
+            if not options['all']:
+                queryset = queryset.filter(html__isnull=True)
+            pks = list(queryset.order_by('pk').values_list('pk', flat=True))
+            for i in range(0, len(pks), batch_size):
+                if options['async_']:
+                    render_text_html.delay(model_label, pks[i:i + batch_size])
+                else:
+                    render_text_html(model_label, pks[i:i + batch_size])
+            self.stdout.write('{}: {} rows {}'.format(
+                model_label, len(pks), 'queued' if options['async_'] else 'rendered'
+            ))
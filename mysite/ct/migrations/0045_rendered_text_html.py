@@ -0,0 +1,33 @@
+# Generated by Django 2.2.13 on 2026-10-18 21:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct', '0044_response_is_locked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='html',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='sidebar_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='html',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='sidebar_text',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 2.2.13 on 2026-10-19 00:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_response_counts(apps, schema_editor):
+    Response = apps.get_model('ct', 'Response')
+    ResponseCounts = apps.get_model('ct', 'ResponseCounts')
+    counts = Response.objects.filter(kind='orct', is_preview=False).values(
+        'unitLesson_id', 'activity_id', 'status', 'confidence', 'selfeval'
+    ).annotate(count=models.Count('id')).order_by()
+    ResponseCounts.objects.bulk_create([ResponseCounts(**d) for d in counts], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fsm', '0003_auto_20151030_0416'),
+        ('ct', '0045_rendered_text_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseCounts',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('help', 'Still confused, need help'), ('review', 'OK, but flag this for me to review'), ('done', 'Solidly')], max_length=10, null=True)),
+                ('confidence', models.CharField(choices=[('guess', 'Just guessing'), ('notsure', 'Not quite sure'), ('sure', 'Pretty sure')], max_length=10)),
+                ('selfeval', models.CharField(choices=[('different', 'Different'), ('close', 'Close'), ('correct', 'Essentially the same')], max_length=10, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('activity', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='fsm.ActivityLog')),
+                ('unitLesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ct.UnitLesson')),
+            ],
+            options={
+                'unique_together': {('unitLesson', 'activity', 'status', 'confidence', 'selfeval')},
+            },
+        ),
+        migrations.RunPython(fill_response_counts, lambda apps, se: None),
+    ]
@@ -8,24 +8,29 @@ from datetime import timedelta, datetime
 from functools import reduce
 
 from django.db.models.query import QuerySet  # Needed for typechecking.
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.validators import RegexValidator
 from django.urls import reverse
-from django.db import models
-from django.db.models import Q, Count, Max
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q, F, Count, Max
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.safestring import mark_safe
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from django.contrib.sites.models import Site
 
 from core.tasks import faq_notify_instructors, faq_notify_students
 from core.common import onboarding
-from core.common.mongo import c_chat_context
-from core.common.utils import update_onboarding_step, create_intercom_event
-from ct.templatetags.ct_extras import md2html
+from core.common.chat_context import get_chat_context
+from core.common.utils import ONBOARDING_STEP, create_intercom_event
+from core.outbox import outbox_handler, publish
+from ct.ct_util import get_middle_indexes
+from ct.templatetags.ct_extras import md2html, md2html_render
 
 
 def percent_validator(value):
@@ -83,6 +88,48 @@ class SubKindMixin(object):
             return None
 
 
+HtmlTagPat = re.compile(r'<.*?>')
+
+
+class RenderedTextMixin(object):
+    """
+    Keep ReST `text` rendered to HTML in the `html` field and the plain
+    text of its first line in `sidebar_text`, so reads don't run pandoc.
+
+    Both fields are None when not rendered yet or when pandoc failed.
+    """
+    html = None
+    sidebar_text = None
+    _rendered_text = None  # text the html was rendered from
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rendered_text = instance.__dict__.get('text')
+        return instance
+
+    @staticmethod
+    def render_texts(objs):
+        'fill html and sidebar_text of objs, converting all texts in one pandoc run'
+        texts = ['' if obj.text is None else str(obj.text) for obj in objs]
+        rendered = md2html_render(texts + [text.split('\n')[0] for text in texts])
+        for obj, (html, converted), (line, line_converted) in zip(objs, rendered, rendered[len(objs):]):
+            obj.html = html if converted else None
+            obj.sidebar_text = HtmlTagPat.sub('', line) if line_converted else None
+            obj._rendered_text = obj.text
+
+    def render_text(self):
+        'render text unless html is already rendered from the current text'
+        if self.html is None or self._rendered_text is None or self.text != self._rendered_text:
+            self.render_texts([self])
+
+    def get_text_html(self):
+        'return text rendered to HTML, converting it on a miss'
+        if self.html is None:
+            return md2html(self.text)
+        return mark_safe(self.html)
+
+
 ########################################################
 # Concept ID and graph -- not version controlled
 
@@ -252,7 +299,7 @@ DEFAULT_FSM = 'chat'
 TRIAL_FSM = 'chat_trial'
 
 
-class Lesson(models.Model, SubKindMixin):
+class Lesson(RenderedTextMixin, models.Model, SubKindMixin):
     BASE_EXPLANATION = 'base'  # focused on one concept, as intro for ORCT
     EXPLANATION = 'explanation'  # conventional textbook or lecture explanation
 
@@ -317,6 +364,8 @@ class Lesson(models.Model, SubKindMixin):
     _sourceDBdict = {}
     title = models.CharField(max_length=200, validators=[not_only_spaces_validator])
     text = models.TextField(null=True, blank=True)
+    html = models.TextField(null=True, blank=True, editable=False)  # rendered text
+    sidebar_text = models.TextField(null=True, blank=True, editable=False)
     attachment = models.FileField(null=True, blank=True, upload_to='questions')
 
     data = models.TextField(null=True, blank=True)  # JSON DATA
@@ -350,6 +399,7 @@ class Lesson(models.Model, SubKindMixin):
     commitTime = models.DateTimeField('time committed', null=True, blank=True)
     add_unit_aborts = models.BooleanField(default=False)
     mc_simplified = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True, null=True)
 
     _cloneAttrs = ('title', 'text', 'data', 'url', 'kind', 'medium', 'access',
                    'sourceDB', 'sourceID', 'concept', 'treeID',
@@ -361,6 +411,7 @@ class Lesson(models.Model, SubKindMixin):
     def save(self):
         if self.kind == Lesson.EXPLANATION:
             self.sub_kind = None
+        self.render_text()
         try:
             return super().save()
         except Exception as e:
@@ -721,7 +772,11 @@ class UnitLesson(models.Model):
         sub_kind = None
         if not self.lesson.sub_kind:
             if self.kind == self.COMPONENT:
-                answer = self.get_answers().first()
+                answers = getattr(self, 'prefetched_answers', None)  # see chat.models.Message.prefetch_content
+                if answers is None:
+                    answer = self.get_answers().first()
+                else:
+                    answer = answers[0] if answers else None
                 if answer and answer.sub_kind:
                     sub_kind = answer.sub_kind
 
@@ -1144,8 +1199,7 @@ class UnitLesson(models.Model):
         """
         Currently Thread updates count.
         """
-        context = c_chat_context().find_one({"chat_id": chat.id})
-        last_access_time = context.get('activity', {}).get(f"{self.id}") if context else None
+        last_access_time = get_chat_context(chat.id).get('activity', {}).get(f"{self.id}")
 
         tz_aware_datetime = (
             last_access_time.replace(tzinfo=tz.tzutc()) if last_access_time else
@@ -1159,6 +1213,54 @@ class UnitLesson(models.Model):
             self.answer_faq_comment_updates(tz_aware_datetime, user).count(),
         ], 0) if tz_aware_datetime else 0
 
+    @classmethod
+    def updates_counts(cls, last_access_times: '{int: datetime}', user: User) -> '{int: int}':
+        """
+        Updates count of many Threads, same as updates_count() but with grouped queries.
+
+        Params:
+        :last_access_times: timezone aware datetime object by Thread id
+        :user: current chat User
+        """
+        counts = dict.fromkeys(last_access_times, 0)
+        if not counts:
+            return counts
+
+        answers = {}
+        for answer_id, thread_id in cls.objects.filter(
+                parent_id__in=counts, kind=cls.ANSWERS).order_by('-pk').values_list('id', 'parent_id'):
+            answers[thread_id] = answer_id  # first answer wins, like get_answers().first()
+        answer_threads = {answer_id: thread_id for thread_id, answer_id in answers.items()}
+        if answers:
+            tracked_faqs = Q(
+                parent__kind=Response.STUDENT_QUESTION, parent__unitLesson_id=F('unitLesson_id')
+            ) & (Q(parent__inquirycount__addedBy=user) | Q(parent__author=user))
+            responses = Response.objects.filter(reduce(operator.or_, (
+                Q(unitLesson_id=answer_id, atime__gt=last_access_times[thread_id])
+                for thread_id, answer_id in answers.items()
+            ))).exclude(author=user).values('unitLesson_id').annotate(
+                faqs=Count('id', filter=Q(kind=Response.STUDENT_QUESTION), distinct=True),
+                comments=Count('id', filter=Q(kind=Response.COMMENT) & tracked_faqs, distinct=True),
+            ).order_by()
+            for row in responses:
+                counts[answer_threads[row['unitLesson_id']]] += row['faqs'] + row['comments']
+
+        ems = cls.objects.filter(reduce(operator.or_, (
+            Q(parent_id=thread_id, atime__gt=last_access_time)
+            for thread_id, last_access_time in last_access_times.items()
+        )), kind=cls.MISUNDERSTANDS).values('parent_id').annotate(count=Count('id')).order_by()
+        for row in ems:
+            counts[row['parent_id']] += row['count']
+
+        resolutions = cls.objects.filter(reduce(operator.or_, (
+            Q(parent__parent_id=thread_id, atime__gt=last_access_time)
+            for thread_id, last_access_time in last_access_times.items()
+        )), kind=cls.RESOLVES, parent__kind=cls.MISUNDERSTANDS).values(
+            'parent__parent_id').annotate(count=Count('id')).order_by()
+        for row in resolutions:
+            counts[row['parent__parent_id']] += row['count']
+        return counts
+
 
 def reorder_exercise(self, old=0, new=0, l=()):
     """
@@ -1265,6 +1367,32 @@ class Unit(models.Model):
         return self.unitlesson_set.filter(order__isnull=False,
                                           lesson__kind=Lesson.ORCT_QUESTION)
 
+    @staticmethod
+    def orct_milestones_cache_key(unit_id):
+        return 'ct.unit.orct_milestones.{}'.format(unit_id)
+
+    def get_orct_milestones(self):
+        """
+        Return {unit_lesson_id: milestone} for the first, middle and last ORCT questions.
+
+        Cached per unit, the cache is dropped when a UnitLesson of the unit is saved or deleted.
+        """
+        key = self.orct_milestones_cache_key(self.id)
+        milestones = cache.get(key)
+        if milestones is None:
+            ids = list(self.all_orct().values_list('id', flat=True))
+            middle_indexes = get_middle_indexes(ids)
+            milestones = {}
+            for i, ul_id in enumerate(ids):
+                if i == 0:
+                    milestones[ul_id] = 'first'
+                elif i == len(ids) - 1:
+                    milestones[ul_id] = 'last'
+                elif i in middle_indexes:
+                    milestones[ul_id] = 'middle'
+            cache.set(key, milestones, settings.ORCT_MILESTONES_CACHE_TIMEOUT)
+        return milestones
+
     def create_lesson(self, title, text, author=None, **kwargs):
         if author is None:
             author = self.addedBy
@@ -1462,6 +1590,8 @@ STATUS_TABLE_LABELS = (
     (NEED_REVIEW_STATUS, 'OK, but need review'),
     (DONE_STATUS, 'Solid understanding'),
 )
+# activity of ResponseCounts.get_counts() to count responses of all activities
+ALL_ACTIVITIES = object()
 
 
 class ResponseManager(models.Manager):
@@ -1504,7 +1634,7 @@ class ResponseManager(models.Manager):
         return super().get_queryset().filter(is_preview=True, **kwargs)
 
 
-class Response(models.Model, SubKindMixin):
+class Response(RenderedTextMixin, models.Model, SubKindMixin):
     'answer entered by a student in response to a question'
     ORCT_RESPONSE = 'orct'
     STUDENT_QUESTION = 'sq'
@@ -1554,6 +1684,8 @@ class Response(models.Model, SubKindMixin):
     sub_kind = models.CharField(max_length=10, choices=SUB_KIND_CHOICES, blank=True, null=True)
     title = models.CharField(max_length=200, null=True, blank=True)
     text = models.TextField()
+    html = models.TextField(null=True, blank=True, editable=False)  # rendered text
+    sidebar_text = models.TextField(null=True, blank=True, editable=False)
     attachment = models.FileField(null=True, blank=True, upload_to='answers')
 
     confidence = models.CharField(max_length=10, choices=CONF_CHOICES,
@@ -1570,12 +1702,17 @@ class Response(models.Model, SubKindMixin):
     faq_notified = models.BooleanField(blank=True, null=True, default=False)
     is_locked = models.BooleanField(default=False)
     is_trial = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True, null=True)
 
     objects = ResponseManager()
 
     def __str__(self):
         return 'answer by ' + self.author.username
 
+    def save(self, *args, **kwargs):
+        self.render_text()
+        super().save(*args, **kwargs)
+
     @property
     def faq_affected_studets(self):
         """
@@ -1595,10 +1732,15 @@ class Response(models.Model, SubKindMixin):
     def notify_instructors(self):
         """
         Notify all Instructors with a newly created FAQ and new Inquiry.
+
+        Notification is sent by the outbox, see `send_instructors_notification`.
         """
         # Do not send notifications about test or preview FAQs
         if self.is_preview or self.is_test:
             return
+        publish('ct.faq_notify_instructors', response_id=self.id)
+
+    def send_instructors_notification(self):
         if self.completed_faq and not self.faq_notified and self.faq_affected_studets >= self.course.faq_threshold:
             # TODO change to general logic when EMs faq notification will be implemented
             url = reverse(
@@ -1625,10 +1767,16 @@ class Response(models.Model, SubKindMixin):
     def notify_students(self):
         """
         Notify Students with a new FAQ comment.
+
+        Notification is sent by the outbox, see `send_students_notification`.
         """
         # Do not send notifications about test or preview FAQs
         if self.is_preview or self.is_test:
             return
+        if self.kind == self.COMMENT:
+            publish('ct.faq_notify_students', response_id=self.id)
+
+    def send_students_notification(self):
         if self.kind == self.COMMENT:
             url = reverse(
                 'ct:ul_thread_student',
@@ -1665,12 +1813,41 @@ class Response(models.Model, SubKindMixin):
                    simpleTable=False,
                    title='Student Status for Understanding This Lesson'):
         'generate display tables for Response data'
-        querySet = klass.objects.filter(query)
+        counts = {}
+        for d in klass.objects.filter(query).values(*ResponseCounts.KEY_FIELDS).annotate(dcount=Count('id')):
+            counts[tuple(d[k] for k in ResponseCounts.KEY_FIELDS)] = d['dcount']
+        return klass.get_counts_tables(counts, fmt_count, n, tableKey, simpleTable, title)
+
+    @classmethod
+    def get_unit_lesson_counts(klass, unitLesson, activity=ALL_ACTIVITIES, evaluated=False,
+                               fmt_count=fmt_count, n=0,
+                               tableKey='status', simpleTable=False,
+                               title='Student Status for Understanding This Lesson'):
+        """
+        Generate display tables for ORCT responses of unitLesson from ResponseCounts.
+
+        Same as get_counts() for Q(unitLesson=unitLesson, kind=ORCT_RESPONSE)
+        (plus activity unless it is ALL_ACTIVITIES and selfeval__isnull=False
+        if evaluated) without scanning responses.
+        """
+        counts = ResponseCounts.get_counts(unitLesson, activity, evaluated)
+        return klass.get_counts_tables(counts, fmt_count, n, tableKey, simpleTable, title)
+
+    @classmethod
+    def get_counts_tables(klass, counts, fmt_count=fmt_count, n=0, tableKey='status', simpleTable=False,
+                          title='Student Status for Understanding This Lesson'):
+        'generate display tables from {(status, confidence, selfeval): count}'
         statusDict = {}
-        for d in querySet.values(tableKey).annotate(dcount=Count(tableKey)):
-            statusDict[d[tableKey]] = d['dcount']
+        evalDict = {}
+        keyIndex = ResponseCounts.KEY_FIELDS.index(tableKey)
+        for key, count in counts.items():
+            # like Count(field), NULL fields are not counted, such responses are still part of n
+            if key[keyIndex] is not None:
+                statusDict[key[keyIndex]] = statusDict.get(key[keyIndex], 0) + count
+            if key[1] is not None:
+                evalDict[key[1:]] = evalDict.get(key[1:], 0) + count  # (confidence, selfeval)
         if not n:
-            n = querySet.count()
+            n = sum(counts.values())
         if not n:  # prevent DivideByZero
             return (), (), 0
         choices = dict(status=STATUS_TABLE_LABELS,
@@ -1678,10 +1855,6 @@ class Response(models.Model, SubKindMixin):
         statusTable = CountsTable(title, choices, n, statusDict)
         if simpleTable:  # caller only wants statusTable
             return statusTable, n, None
-        evalDict = {}
-        for d in querySet.values('confidence', 'selfeval') \
-                .annotate(dcount=Count('confidence')):
-            evalDict[d['confidence'], d['selfeval']] = d['dcount']
         l = []
         for conf, label in klass.CONF_CHOICES:
             l.append((label, [fmt_count(evalDict.get((conf, selfeval), 0), n)
@@ -1732,6 +1905,98 @@ class Response(models.Model, SubKindMixin):
         return ""
 
 
+class ResponseCounts(models.Model):
+    """
+    Number of ORCT responses per unitLesson, activity, status, confidence and selfeval.
+
+    Counters are updated by ct.signals when responses are saved or deleted,
+    so response tables of a lesson are built from a few rows instead of
+    scanning its responses. `rebuild()` recomputes them from responses.
+    """
+    KEY_FIELDS = ('status', 'confidence', 'selfeval')
+
+    unitLesson = models.ForeignKey(UnitLesson, on_delete=models.CASCADE)
+    activity = models.ForeignKey('fsm.ActivityLog', null=True, blank=True, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, null=True)
+    confidence = models.CharField(max_length=10, choices=Response.CONF_CHOICES)
+    selfeval = models.CharField(max_length=10, choices=Response.EVAL_CHOICES, null=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('unitLesson', 'activity', 'status', 'confidence', 'selfeval')
+
+    @staticmethod
+    def get_key(response):
+        """
+        Return counter fields of the response or None if the response is not counted.
+        """
+        if response.kind != Response.ORCT_RESPONSE or response.is_preview:
+            return None
+        return dict(
+            unitLesson_id=response.unitLesson_id,
+            activity_id=response.activity_id,
+            status=response.status,
+            confidence=response.confidence,
+            selfeval=response.selfeval,
+        )
+
+    @classmethod
+    def add(klass, key, delta):
+        """
+        Add delta to the counter of key fields.
+
+        Missing counters are not decremented, they are deleted along with
+        their unitLesson or activity before the responses.
+        """
+        counter_id = klass.objects.filter(**key).values_list('id', flat=True).first()
+        if counter_id:
+            klass.objects.filter(id=counter_id).update(count=F('count') + delta)
+            return
+        if delta < 0:
+            return
+        try:
+            with transaction.atomic():
+                klass.objects.create(count=delta, **key)
+        except IntegrityError:  # created concurrently
+            klass.objects.filter(**key).update(count=F('count') + delta)
+
+    @classmethod
+    def get_counts(klass, unitLesson, activity=ALL_ACTIVITIES, evaluated=False):
+        """
+        Return {(status, confidence, selfeval): count} of unitLesson responses.
+
+        Responses of all activities are counted by default, activity=None
+        counts responses without activity like filter(activity=None) does.
+        """
+        counters = klass.objects.filter(unitLesson=unitLesson, count__gt=0)
+        if activity is not ALL_ACTIVITIES:
+            counters = counters.filter(activity=activity)
+        if evaluated:
+            counters = counters.filter(selfeval__isnull=False)
+        counts = {}
+        for status, confidence, selfeval, count in counters.values_list(*klass.KEY_FIELDS + ('count',)):
+            counts[status, confidence, selfeval] = counts.get((status, confidence, selfeval), 0) + count
+        return counts
+
+    @classmethod
+    def rebuild(klass, unitLessons=None):
+        """
+        Recompute counters from responses, of all unitLessons by default.
+        """
+        responses = Response.objects.filter(kind=Response.ORCT_RESPONSE)
+        counters = klass.objects.all()
+        if unitLessons is not None:
+            responses = responses.filter(unitLesson__in=unitLessons)
+            counters = counters.filter(unitLesson__in=unitLessons)
+        fields = ('unitLesson_id', 'activity_id') + klass.KEY_FIELDS
+        with transaction.atomic():
+            counters.delete()
+            klass.objects.bulk_create(
+                [klass(**d) for d in responses.values(*fields).annotate(count=Count('id')).order_by()],
+                batch_size=1000
+            )
+
+
 EVAL_TO_STATUS_MAP = {
     Response.DIFFERENT: NEED_HELP_STATUS,
     Response.CLOSE: NEED_REVIEW_STATUS,
@@ -2067,20 +2332,34 @@ class UnitStatus(models.Model):
             return None
 
 
+@outbox_handler('ct.faq_notify_instructors')
+def faq_notify_instructors_handler(response_id):
+    response = Response.objects.filter(id=response_id).first()
+    if response:
+        response.send_instructors_notification()
+
+
+@outbox_handler('ct.faq_notify_students')
+def faq_notify_students_handler(response_id):
+    response = Response.objects.filter(id=response_id).first()
+    if response:
+        response.send_students_notification()
+
+
 @receiver(post_save, sender=Course)
 def onboarding_course_created(sender, instance, **kwargs):
-    update_onboarding_step(onboarding.STEP_3, instance.addedBy.id)
+    publish(ONBOARDING_STEP, step=onboarding.STEP_3, user_id=instance.addedBy_id)
 
 
 @receiver(post_save, sender=Unit)
 def onboarding_unit_created(sender, instance, **kwargs):
-    update_onboarding_step(onboarding.STEP_4, instance.addedBy.id)
+    publish(ONBOARDING_STEP, step=onboarding.STEP_4, user_id=instance.addedBy_id)
 
 
 @receiver(post_save, sender=Lesson)
 def onboarding_lesson_created(sender, instance, created, **kwargs):
     if instance.kind in (Lesson.ANSWER, Lesson.BASE_EXPLANATION, Lesson.EXPLANATION):
-        update_onboarding_step(onboarding.STEP_5, instance.addedBy.id)
+        publish(ONBOARDING_STEP, step=onboarding.STEP_5, user_id=instance.addedBy_id)
     if created and instance.kind == Lesson.ORCT_QUESTION:
         orct_count = Lesson.objects.filter(addedBy=instance.addedBy, kind=Lesson.ORCT_QUESTION).count()
         create_intercom_event(
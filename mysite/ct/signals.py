@@ -3,17 +3,71 @@ Django signals for the app.
 """
 import logging
 
-from django.db.models.signals import post_save
+from django.apps import apps
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.conf import settings
 from django.contrib.sites.models import Site
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
-from .models import Response, UnitLesson
-from .ct_util import get_middle_indexes
+from .models import Lesson, Response, ResponseCounts, Unit, UnitLesson
+from .templatetags.ct_extras import md2html_invalidate
 
-from core.common.mongo import c_milestone_orct
+from core.common.mongo import c_milestone_orct, c_milestone_orct_counts
 from core.common.utils import send_email, suspending_receiver
+from core.outbox import outbox_handler, publish
 
 log = logging.getLogger(__name__)
+_milestone_indexes = False
+
+
+def ensure_milestone_indexes():
+    """
+    Create unique indexes of the milestone collections once per process.
+    """
+    global _milestone_indexes
+    if _milestone_indexes:
+        return
+    try:
+        c_milestone_orct(use_secondary=False).create_index(
+            [('milestone', ASCENDING), ('lesson_id', ASCENDING), ('student_id', ASCENDING)], unique=True
+        )
+        c_milestone_orct_counts(use_secondary=False).create_index(
+            [('milestone', ASCENDING), ('lesson_id', ASCENDING)], unique=True
+        )
+    except OperationFailure as e:
+        log.error('Can not create milestone indexes: {}'.format(e))
+    _milestone_indexes = True
+
+
+def add_milestone_student(record):
+    """
+    Store the milestone record of a student if it is not stored yet.
+
+    Return the new number of students of the milestone or None if the student was already stored.
+    Counters of milestones recorded before counters existed are filled by rebuild_milestone_counts.
+    """
+    ensure_milestone_indexes()
+    key = {'milestone': record['milestone'], 'lesson_id': record['lesson_id']}
+    try:
+        result = c_milestone_orct(use_secondary=False).update_one(
+            dict(key, student_id=record['student_id']), {'$setOnInsert': record}, upsert=True
+        )
+    except DuplicateKeyError:  # the same record was inserted concurrently
+        return None
+    if result.upserted_id is None:
+        return None
+
+    counts = c_milestone_orct_counts(use_secondary=False)
+    update = {'$inc': {'students_number': 1}}
+    try:
+        counter = counts.find_one_and_update(key, update, upsert=True, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:  # the counter was created concurrently, it exists now
+        counter = counts.find_one_and_update(key, update, return_document=ReturnDocument.AFTER)
+    return counter['students_number']
 
 
 @suspending_receiver(post_save, sender=Response)
@@ -21,12 +75,18 @@ def run_courselet_notif_flow(sender, instance, **kwargs):
     # TODO: add check that Response has a text, as an obj can be created before a student submits
     # TODO: exclude self eval submissions other than a response submission (e.g. "just guessing")
 
-    if (instance.kind == Response.ORCT_RESPONSE and not
-            (instance.unitLesson.kind == UnitLesson.RESOLVES or
-             instance.is_test or instance.is_preview or not instance.unitLesson.order)):
+    if instance.kind == Response.ORCT_RESPONSE and not (instance.is_test or instance.is_preview):
+        publish('ct.courselet_notif_flow', response_id=instance.id)
+
+
+@outbox_handler('ct.courselet_notif_flow')
+def courselet_notif_flow(response_id):
+    instance = Response.objects.filter(id=response_id).select_related(
+        'course', 'lesson', 'author', 'unitLesson__unit'
+    ).first()
+    if instance and not (instance.unitLesson.kind == UnitLesson.RESOLVES or not instance.unitLesson.order):
         course = instance.course
         course_id = course.id if course else None
-        instructors = course.get_users(role="prof")
         lesson = instance.lesson
         lesson_id = lesson.id if lesson else None
         student = instance.author
@@ -34,78 +94,126 @@ def run_courselet_notif_flow(sender, instance, **kwargs):
         unit_lesson = instance.unitLesson
         unit_lesson_id = unit_lesson.id if unit_lesson else None  # it's a thread
 
+        # Define if it's a milestone question (either first, middle, or last)
+        milestone = unit_lesson.unit.get_orct_milestones().get(unit_lesson_id)
+        if not milestone:
+            return
+
         # Exclude instructors, e.g. the ones submitting in preview mode
-        for instructor in instructors:
-            if student_id == instructor.id:
-                return
+        instructors = course.get_users(role="prof")
+        if instructors.filter(id=student_id).exists():
+            return
 
-        # Define if it's a milestone question (either first, middle, or last)
-        milestone = None
-        questions = unit_lesson.unit.all_orct()
-        i = [_[0] for _ in questions.values_list('id')].index(unit_lesson_id)
-        if i == 0:
-            milestone = "first"
-        elif i == len(questions) - 1:
-            milestone = "last"
-        elif i in get_middle_indexes(questions):
-            milestone = "middle"  # TODO consider returning a single number
-
-        # If milestone, store the record
-        if milestone:
-            to_save = {
+        # Store the record, `student_id`-`lesson_id` row is stored only once
+        milestone_orct_answers_number = add_milestone_student({
+            "milestone": milestone,
+            "lesson_title": lesson.title if lesson else None,
+            "lesson_id": lesson_id,
+            "unit_lesson_id": unit_lesson_id,
+            "course_title": course.title if course else None,
+            "course_id": course_id,
+            "student_username": student.username if student else None,
+            "student_id": student_id,
+            # "datetime": datetime.datetime.now()  # TODO: consider changing to UTC (and making it a timestamp)
+        })
+
+        # If N students responded to a milestone question, send an email.
+        # The threshold holds for each milestone separately.
+        if milestone_orct_answers_number == settings.MILESTONE_ORCT_NUMBER:
+            context_data = {
                 "milestone": milestone,
-                "lesson_title": lesson.title if lesson else None,
-                "lesson_id": lesson_id,
-                "unit_lesson_id": unit_lesson_id,
+                "students_number": milestone_orct_answers_number,
                 "course_title": course.title if course else None,
+                "lesson_title": lesson.title if lesson else None,
+                "current_site": Site.objects.get_current(),
                 "course_id": course_id,
-                "student_username": student.username if student else None,
-                "student_id": student_id,
-                # "datetime": datetime.datetime.now()  # TODO: consider changing to UTC (and making it a timestamp)
-            }
-            # Do not store if such `student_id`-`lesson_id` row is already present
-            milestone_orct_answers_cursor = c_milestone_orct(use_secondary=False).find({
-                "milestone": milestone,
-                "lesson_id": lesson_id
-            })
-            initial_milestone_orct_answers_number = milestone_orct_answers_cursor.count()
-            milestone_orct_answers = (a for a in milestone_orct_answers_cursor)
-
-            already_exists = False
-            for answer in milestone_orct_answers:
-                if answer.get("student_id") == student_id:
-                    already_exists = True
-                    break
-
-            if not already_exists:
-                c_milestone_orct(use_secondary=False).save(to_save)
-                milestone_orct_answers_number = initial_milestone_orct_answers_number + 1
-
-                # If N students responded to a milestone question, send an email.
-                # The threshold holds for each milestone separately.
-                if milestone_orct_answers_number == settings.MILESTONE_ORCT_NUMBER:
-                    context_data = {
-                        "milestone": milestone,
-                        "students_number": milestone_orct_answers_number,
-                        "course_title": course.title if course else None,
-                        "lesson_title": lesson.title if lesson else None,
-                        "current_site": Site.objects.get_current(),
-                        "course_id": course_id,
-                        "unit_lesson_id": unit_lesson_id,
-                        "courselet_pk": unit_lesson.unit.id if unit_lesson.unit else None
-                    }  # pragma: no cover
-                    log.info("""Courselet notification with data:
-                        Course title - {course_title},
-                        Lesson title - {lesson_title},
-                        Students number - {students_number},
-                        Unit lesson id - {unit_lesson_id},
-                        Course id - {course_id},
-                        Milestone - {milestone}
-                        """.format(**context_data))  # pragma: no cover
-                    send_email(
-                        context_data=context_data,
-                        from_email=settings.EMAIL_FROM,
-                        to_email=[instructor.email for instructor in instructors],
-                        template_subject="ct/email/milestone_ortc_notify_subject",
-                        template_text="ct/email/milestone_ortc_notify_text"
-                    )
+                "unit_lesson_id": unit_lesson_id,
+                "courselet_pk": unit_lesson.unit.id if unit_lesson.unit else None
+            }  # pragma: no cover
+            log.info("""Courselet notification with data:
+                Course title - {course_title},
+                Lesson title - {lesson_title},
+                Students number - {students_number},
+                Unit lesson id - {unit_lesson_id},
+                Course id - {course_id},
+                Milestone - {milestone}
+                """.format(**context_data))  # pragma: no cover
+            send_email(
+                context_data=context_data,
+                from_email=settings.EMAIL_FROM,
+                to_email=[instructor.email for instructor in instructors],
+                template_subject="ct/email/milestone_ortc_notify_subject",
+                template_text="ct/email/milestone_ortc_notify_text"
+            )
+
+
+@receiver(pre_save, sender=Response)
+def keep_response_counts_key(sender, instance, raw=False, **kwargs):
+    """
+    Remember counter fields of the stored response to move it between counters on save.
+    """
+    if raw or not instance.pk:
+        return
+    stored = Response.objects.get_all_responses_queryset().filter(pk=instance.pk).values(
+        'kind', 'is_preview', 'unitLesson_id', 'activity_id', *ResponseCounts.KEY_FIELDS
+    ).first()
+    instance._counts_key = ResponseCounts.get_key(Response(**stored)) if stored else None
+
+
+@receiver(post_save, sender=Response)
+def update_response_counts(sender, instance, created, raw=False, **kwargs):
+    """
+    Move the response from the counter of its stored fields to the counter of the saved ones.
+    """
+    if raw:
+        return
+    old_key = None if created else getattr(instance, '_counts_key', None)
+    new_key = ResponseCounts.get_key(instance)
+    if old_key != new_key:
+        if old_key:
+            ResponseCounts.add(old_key, -1)
+        if new_key:
+            ResponseCounts.add(new_key, 1)
+    instance._counts_key = new_key
+
+
+@receiver(post_delete, sender=Response)
+def discount_response(sender, instance, **kwargs):
+    key = ResponseCounts.get_key(instance)
+    if key:
+        ResponseCounts.add(key, -1)
+
+
+@receiver([post_save, post_delete], sender=UnitLesson)
+def invalidate_orct_milestones(sender, instance, **kwargs):
+    """
+    Drop cached ORCT milestones of the unit.
+    """
+    if instance.unit_id:
+        cache.delete(Unit.orct_milestones_cache_key(instance.unit_id))
+
+
+@receiver(pre_save, sender=Lesson)
+def invalidate_lesson_caches(sender, instance, raw=False, **kwargs):
+    """
+    Drop what is cached for the stored Lesson when it changes.
+
+    A title change drops stored progress breakpoints of chats showing the Lesson,
+    a text change drops cached HTML of the previous text.
+    """
+    if raw or not instance.pk:
+        return
+    stored = Lesson.objects.filter(pk=instance.pk).values_list('title', 'text').first()
+    if stored is None:
+        return
+    old_title, old_text = stored
+    if old_title != instance.title:
+        Chat = apps.get_model('chat', 'Chat')
+        dividers = apps.get_model('chat', 'ChatDivider').objects.filter(unitlesson__lesson=instance).values('id')
+        Chat.objects.filter(
+            Q(enroll_code__courseUnit__unit__unitlesson__lesson=instance) |
+            Q(message__contenttype='chatdivider', message__content_id__in=dividers),
+            progress_data__isnull=False
+        ).update(progress_data=None)
+    if old_text and old_text != instance.text:
+        md2html_invalidate(old_text)
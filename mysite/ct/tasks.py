@@ -0,0 +1,18 @@
+from django.apps import apps
+
+from mysite import celery_app
+from .models import RenderedTextMixin
+
+
+@celery_app.task
+def render_text_html(model_label, pks):
+    """
+    Store rendered HTML of `text` for given rows of a RenderedTextMixin model.
+
+    :param model_label: 'app_label.ModelName', e.g. 'ct.Lesson'
+    """
+    model = apps.get_model(model_label)
+    objs = list(model._base_manager.filter(pk__in=pks).only('id', 'text'))
+    RenderedTextMixin.render_texts(objs)
+    model._base_manager.bulk_update(objs, ['html', 'sidebar_text'])
+    return len(objs)
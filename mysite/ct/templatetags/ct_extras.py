@@ -1,13 +1,16 @@
-from django.utils.safestring import mark_safe
+from django.utils.safestring import mark_safe, SafeData
 # from markdown import markdown
 from django import template
 import re
+import threading
 import pypandoc
 from django.templatetags.static import static
 from django.utils import timezone
 from django.contrib.auth.models import User
 from datetime import timedelta
 
+from ct.ct_util import RenderCache
+
 register = template.Library()
 
 InlineMathPat = re.compile(r'\\\((.+?)\\\)', flags=re.DOTALL)
@@ -15,26 +18,196 @@ DisplayMathPat = re.compile(r'\\\[(.+?)\\\]', flags=re.DOTALL)
 StaticImagePat = re.compile(r'STATICIMAGE/([^"]+)')
 
 
-@register.filter(name='md2html')
-def md2html(txt, stripP=False):
-    'converst ReST to HTML using pandoc, w/ audio support'
+PANDOC_ARGS = ('--mathjax', '--email-obfuscation=none')
+md2html_cache = RenderCache('md2html')
+
+# documents converted together by a single pandoc run are separated by
+# a raw HTML comment which pandoc copies to its output verbatim
+PANDOC_BATCH_BREAK = '<!--md2html-break-->'
+PANDOC_BATCH_SEP = '\n\n.. raw:: html\n\n   %s\n\n' % PANDOC_BATCH_BREAK
+# ReST constructs whose rendering depends on the rest of the document
+# (section levels, footnotes, reference targets, substitutions),
+# texts containing them are never merged with other texts
+BatchUnsafePat = re.compile(r"""
+    ^[ \t]*\.\.[ \t]+[_|\[]        # targets, substitutions, footnotes
+    | \]_                           # footnote / citation references
+    | `[^`<]*`__?(?!\w)              # references w/o embedded URL
+    | \w__?(?!\w)                   # simple reference names
+    | ^([!-/:-@\[-`{-~])\1+[ \t]*$   # section adornments, transitions
+""", flags=re.MULTILINE | re.VERBOSE)
+DeferredPat = re.compile('\x00md2html:(\\d+):([01])\x00')
+
+_deferred = threading.local()
+
+
+def _rst_prepare(txt):
     txt, markers = add_temporary_markers(txt, find_audio)
     txt, videoMarkers = add_temporary_markers(txt, find_video, len(markers))
+    return txt, markers, videoMarkers
+
+
+def _html_finish(txt, markers, videoMarkers):
+    txt = replace_temporary_markers(txt, audio_html, markers)
+    txt = replace_temporary_markers(txt, video_html, videoMarkers)
+    return StaticImagePat.sub(static('ct') + '/' + r'\1', txt)
+
+
+def rst2html(txt):
+    """
+    Convert ReST to HTML using pandoc, w/ audio and video support.
+
+    Return (html, converted) where converted is False if pandoc failed
+    and the text was passed through as is.
+    """
+    txt, markers, videoMarkers = _rst_prepare(txt)
+    converted = True
     try:
         txt = pypandoc.convert_text(
             txt,
             'html',
             format='rst',
-            extra_args=('--mathjax', '--email-obfuscation=none')
+            extra_args=PANDOC_ARGS
         )
     except Exception:
-        pass
-    txt = replace_temporary_markers(txt, audio_html, markers)
-    txt = replace_temporary_markers(txt, video_html, videoMarkers)
-    txt = StaticImagePat.sub(static('ct') + '/' + r'\1', txt)
-    if stripP and txt.startswith('<p>') and txt.endswith('</p>'):
-        txt = txt[3:-4]
-    return mark_safe(txt)
+        converted = False
+    return _html_finish(txt, markers, videoMarkers), converted
+
+
+def rst2html_many(texts):
+    """
+    Convert a list of ReST texts using a single pandoc process.
+
+    Return a list of (html, converted) pairs, same as rst2html().
+    Blank texts and texts matching BatchUnsafePat are converted one by one,
+    and so is the whole batch if pandoc fails or its output can't be split.
+    """
+    results = [None] * len(texts)
+    batch = []
+    for i, txt in enumerate(texts):
+        if not txt.strip() or BatchUnsafePat.search(txt) or PANDOC_BATCH_BREAK in txt:
+            results[i] = rst2html(txt)
+        else:
+            batch.append(i)
+    if len(batch) > 1:
+        prepared = [_rst_prepare(texts[i]) for i in batch]
+        try:
+            parts = pypandoc.convert_text(
+                PANDOC_BATCH_SEP.join(p[0] for p in prepared),
+                'html',
+                format='rst',
+                extra_args=PANDOC_ARGS
+            ).split(PANDOC_BATCH_BREAK)
+        except Exception:
+            parts = ()
+        if len(parts) == len(batch):
+            for i, part, (_, markers, videoMarkers) in zip(batch, parts, prepared):
+                results[i] = (_html_finish(part.lstrip('\n'), markers, videoMarkers), True)
+            batch = ()
+    for i in batch:
+        results[i] = rst2html(texts[i])
+    return results
+
+
+def md2html_invalidate(txt):
+    """
+    Evict rendered HTML for the source `txt` from the md2html cache.
+    """
+    if txt:
+        md2html_cache.delete(md2html_cache.make_key(txt, PANDOC_ARGS))
+
+
+def md2html_render(texts):
+    """
+    Convert a list of ReST texts to HTML, sharing the md2html cache.
+
+    All cache misses are converted by one pandoc run.
+    Return a list of (html, converted) pairs, same as rst2html_many().
+    """
+    keys = [md2html_cache.make_key(txt, PANDOC_ARGS) for txt in texts]
+    results = [md2html_cache.get(key) for key in keys]
+    missing = {}
+    for txt, key, html in zip(texts, keys, results):
+        if html is None:
+            missing.setdefault(key, txt)
+    if missing:
+        rendered = dict(zip(missing, rst2html_many(list(missing.values()))))
+        for key, (html, converted) in rendered.items():
+            if converted:
+                md2html_cache.set(key, html)
+    return [
+        rendered[key] if html is None else (html, True)
+        for key, html in zip(keys, results)
+    ]
+
+
+def md2html_many(texts):
+    'convert a list of ReST texts to HTML, see md2html_render()'
+    return [mark_safe(html) for html, _ in md2html_render(texts)]
+
+
+class md2html_batch(object):
+    """
+    Context manager deferring md2html cache misses to one pandoc run.
+
+    Inside the block md2html() returns a placeholder for every text that
+    is not cached yet. Texts are converted together when the block exits,
+    after which resolve() substitutes placeholders in produced strings::
+
+        with md2html_batch() as batch:
+            data = [m.get_html() for m in messages]
+        data = [batch.resolve(s) for s in data]
+    """
+    def __init__(self):
+        self.texts = []
+        self.index = {}
+        self.htmls = ()
+
+    def defer(self, txt, stripP):
+        i = self.index.get(txt)
+        if i is None:
+            i = self.index[txt] = len(self.texts)
+            self.texts.append(txt)
+        return mark_safe('\x00md2html:%d:%d\x00' % (i, bool(stripP)))
+
+    def resolve(self, s):
+        'substitute rendered HTML for md2html placeholders found in s'
+        if not isinstance(s, str) or '\x00md2html:' not in s:
+            return s
+        result = DeferredPat.sub(
+            lambda m: strip_p(self.htmls[int(m.group(1))], m.group(2) == '1'), s
+        )
+        return mark_safe(result) if isinstance(s, SafeData) else result
+
+    def __enter__(self):
+        self.outer = getattr(_deferred, 'batch', None)
+        _deferred.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _deferred.batch = self.outer
+        if exc_type is None:
+            self.htmls = md2html_many(self.texts)
+
+
+def strip_p(html, stripP=True):
+    if stripP and html.startswith('<p>') and html.endswith('</p>'):
+        html = html[3:-4]
+    return html
+
+
+@register.filter(name='md2html')
+def md2html(txt, stripP=False):
+    'converst ReST to HTML using pandoc, w/ audio support'
+    key = md2html_cache.make_key(txt, PANDOC_ARGS)
+    html = md2html_cache.get(key)
+    if html is None:
+        batch = getattr(_deferred, 'batch', None)
+        if batch is not None and isinstance(txt, str):
+            return batch.defer(txt, stripP)
+        html, converted = rst2html(txt)
+        if converted:
+            md2html_cache.set(key, html)
+    return mark_safe(strip_p(html, stripP))
 
 
 def nolongerused():
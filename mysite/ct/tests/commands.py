@@ -2,7 +2,12 @@ from django.test import TestCase
 from django.test.utils import override_settings
 from django.utils import timezone
 from django.core.management import call_command
-from ct.models import Course, CourseUnit, Unit, UnitLesson, Role
+from django.contrib.auth.models import User
+from accounts.models import Instructor
+from core.common import onboarding
+from core.common.mongo import c_onboarding_status
+from ct.models import Course, CourseUnit, Unit, UnitLesson, Role, Lesson, Response, ResponseCounts
+from ct.management.commands.onboarding_preprocess import Command as OnboardingPreprocessCommand
 
 
 @override_settings(SUSPEND_SIGNALS=True)
@@ -90,3 +95,75 @@ class CloneCourseCommandTest(TestCase):
         self.assertFalse(publ_cu == n_publ_cu)
         self.assertFalse(np_cu == n_np_cu)
         self.assertTrue(publ_cu+np_cu == n_publ_cu)
+
+
+class RenderTextHtmlCommandTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='test', password='test')
+        self.lesson = Lesson(title='test', text='some *text*', addedBy=user)
+        self.lesson.save()
+        Lesson.objects.filter(id=self.lesson.id).update(html=None, sidebar_text=None)
+
+    def test_backfill(self):
+        call_command('render_text_html', '--batch-size', '1')
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.html, '<p>some <em>text</em></p>\n')
+        self.assertEqual(self.lesson.sidebar_text, 'some text\n')
+
+    def test_backfill_skips_rendered(self):
+        Lesson.objects.filter(id=self.lesson.id).update(html='<p>stored</p>')
+        call_command('render_text_html')
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.html, '<p>stored</p>')
+
+        call_command('render_text_html', '--all')
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.html, '<p>some <em>text</em></p>\n')
+
+
+class RebuildResponseCountsCommandTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='test', password='test')
+        course = Course.objects.create(title='test course', addedBy=user)
+        unit = Unit.objects.create(title='test unit', addedBy=user)
+        lesson = unit.create_lesson('question', 'text', user)
+        self.response = Response.objects.create(
+            lesson=lesson, unitLesson=lesson.unitlesson_set.get(), course=course, kind=Response.ORCT_RESPONSE,
+            text='answer', confidence=Response.GUESS, author=user
+        )
+        ResponseCounts.objects.all().delete()
+
+    def test_rebuild(self):
+        call_command('rebuild_response_counts')
+
+        counter = ResponseCounts.objects.get()
+        self.assertEqual(counter.unitLesson_id, self.response.unitLesson_id)
+        self.assertEqual(counter.count, 1)
+
+
+class OnboardingPreprocessCommandTest(TestCase):
+
+    def test_onboarding_preprocess(self):
+        user = User.objects.create_user(username='instructor', password='test')
+        Instructor.objects.create(user=user)
+        other = User.objects.create_user(username='other', password='test')
+        course = Course.objects.create(title='Intro', addedBy=other)
+        Unit.objects.create(title='Unit', addedBy=user)
+        c_onboarding_status().delete_many({onboarding.USER_ID: {'$in': [user.id, other.id]}})
+
+        with override_settings(ONBOARDING_INTRODUCTION_COURSE_ID=course.id):
+            call_command('onboarding_preprocess')
+
+        status = c_onboarding_status().find_one({onboarding.USER_ID: user.id})
+        self.assertTrue(status[onboarding.STEP_4])
+        self.assertNotIn(onboarding.STEP_3, status)
+        self.assertIsNone(c_onboarding_status().find_one({onboarding.USER_ID: other.id}))
+
+    def test_onboarding_done_steps_distinct(self):
+        user = User.objects.create_user(username='instructor', password='test')
+        instructor = Instructor.objects.create(user=user)
+        Unit.objects.create(title='Unit', addedBy=user)
+        Unit.objects.create(title='Other unit', addedBy=user)
+
+        steps = OnboardingPreprocessCommand().get_done_steps(None, [instructor.user_id])
+        self.assertEqual(list(steps[onboarding.STEP_4]), [user.id])
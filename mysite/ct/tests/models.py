@@ -16,6 +16,7 @@ from ddt import data, unpack, ddt
 from ct.models import *
 from ct.templatetags.ct_extras import md2html
 from ct.sourcedb_plugin.wikipedia_plugin import LessonDoc
+from fsm.models import ActivityLog
 
 
 class ConceptTest(TestCase):
@@ -1061,10 +1062,10 @@ class UnitLessonTest(TestCase):
     @patch('ct.models.UnitLesson.em_resolutions_updates')
     @patch('ct.models.UnitLesson.question_faq_comment_updates')
     @patch('ct.models.UnitLesson.answer_faq_comment_updates')
-    @patch('ct.models.c_chat_context')
+    @patch('ct.models.get_chat_context')
     def test_updates(
         self,
-        c_chat_context,
+        get_chat_context,
         answer_faq_comment_updates,
         question_faq_comment_updates,
         em_resolutions_updates,
@@ -1074,7 +1075,7 @@ class UnitLessonTest(TestCase):
     ):
         args = locals()
         args.pop('self')
-        args.pop('c_chat_context')
+        args.pop('get_chat_context')
         args.pop('em_resolutions_updates')
 
         query_set_mock = Mock()
@@ -1507,6 +1508,72 @@ class ResponseTest(TestCase):
         self.assertIsInstance(result[1], list)
         self.assertIsInstance(result[2], int)
 
+    def get_counter(self, **kwargs):
+        return ResponseCounts.objects.filter(unitLesson=self.unit_lesson, **kwargs).values_list('count', flat=True)
+
+    def test_response_counts_save(self):
+        self.assertEqual(list(self.get_counter(status=NEED_HELP_STATUS)), [1])
+
+        self.response.status = DONE_STATUS
+        self.response.selfeval = Response.CORRECT
+        self.response.save()
+
+        self.assertEqual(list(self.get_counter(status=NEED_HELP_STATUS)), [0])
+        self.assertEqual(list(self.get_counter(status=DONE_STATUS, selfeval=Response.CORRECT)), [1])
+
+    def test_response_counts_not_counted(self):
+        Response.objects.create(
+            lesson=self.lesson, unitLesson=self.unit_lesson, course=self.course, kind=Response.STUDENT_QUESTION,
+            text='question', confidence=Response.GUESS, author=self.user
+        )
+        Response.objects.create(
+            lesson=self.lesson, unitLesson=self.unit_lesson, course=self.course, kind=Response.ORCT_RESPONSE,
+            text='preview', confidence=Response.GUESS, author=self.user, is_preview=True
+        )
+        self.assertEqual(sum(self.get_counter()), 1)
+
+    def test_response_counts_delete(self):
+        self.response.delete()
+        self.assertEqual(sum(self.get_counter()), 0)
+
+        self.unit_lesson.delete()
+        self.assertFalse(ResponseCounts.objects.exists())
+
+    def test_get_unit_lesson_counts(self):
+        Response.objects.create(
+            lesson=self.lesson, unitLesson=self.unit_lesson, course=self.course, kind=Response.ORCT_RESPONSE,
+            text='not evaluated', confidence=Response.SURE, author=self.user
+        )
+        for kwargs in ({}, {'n': 5}, {'tableKey': 'confidence', 'simpleTable': True}):
+            query = Q(unitLesson=self.unit_lesson, selfeval__isnull=False, kind=Response.ORCT_RESPONSE)
+            expected = Response.get_counts(query, **kwargs)
+            with self.assertNumQueries(1):
+                result = Response.get_unit_lesson_counts(self.unit_lesson, evaluated=True, **kwargs)
+            self.assertEqual(result[0].data, expected[0].data)
+            self.assertEqual(result[1:], expected[1:])
+
+        result = Response.get_unit_lesson_counts(self.unit_lesson, tableKey='confidence', simpleTable=True)
+        self.assertEqual(result[1], 2)
+
+    def test_get_unit_lesson_counts_activity(self):
+        activity = ActivityLog.objects.create(fsmName='live', course=self.course)
+        Response.objects.create(
+            lesson=self.lesson, unitLesson=self.unit_lesson, course=self.course, kind=Response.ORCT_RESPONSE,
+            text='live', confidence=Response.SURE, author=self.user, activity=activity
+        )
+        for activity_kwargs, n in (({}, 2), ({'activity': activity}, 1), ({'activity': None}, 1)):
+            query = Q(unitLesson=self.unit_lesson, kind=Response.ORCT_RESPONSE, **activity_kwargs)
+            result = Response.get_unit_lesson_counts(self.unit_lesson, **activity_kwargs)
+            self.assertEqual(result[2], n)
+            self.assertEqual(result[1:], Response.get_counts(query)[1:])
+
+    def test_response_counts_rebuild(self):
+        ResponseCounts.objects.update(count=7)
+
+        ResponseCounts.rebuild([self.unit_lesson])
+
+        self.assertEqual(list(self.get_counter()), [1])
+
     def test_get_novel_errors_exception(self):
         with self.assertRaises(ValueError):
             Response.get_novel_errors()
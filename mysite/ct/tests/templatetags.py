@@ -4,7 +4,9 @@ Unit tests for ct/templatetags.
 import inspect
 
 from datetime import timedelta
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
 from django.contrib.auth.models import User
 from django.template import Context, Template
@@ -13,6 +15,7 @@ from unittest.mock import patch
 from ddt import ddt, data, unpack
 
 from ct.models import UnitLesson, Course, Unit, Concept, Lesson, ConceptLink, Response
+from ct.ct_util import RenderCache
 from ct.templatetags.ct_extras import *
 
 
@@ -20,6 +23,7 @@ from ct.templatetags.ct_extras import *
 @ddt
 class TagsTest(TestCase):
     def setUp(self):
+        md2html_cache.clear_local()
         self.user = User.objects.create_user(username='test', password='test')
         self.course = Course(title='test_title', addedBy=self.user)
         self.course.save()
@@ -80,6 +84,95 @@ class TagsTest(TestCase):
         )
         self.assertEqual(rendered, self.context['test_text'])
 
+    @patch('ct.templatetags.ct_extras.pypandoc')
+    def test_md2html_cached(self, pypandoc):
+        pypandoc.convert_text.return_value = '<p>cached</p>'
+        self.assertEqual(md2html('some *text*'), '<p>cached</p>')
+        self.assertEqual(md2html('some *text*', stripP=True), 'cached')
+        pypandoc.convert_text.assert_called_once()
+
+    @patch('ct.templatetags.ct_extras.pypandoc')
+    def test_md2html_failure_not_cached(self, pypandoc):
+        pypandoc.convert_text.side_effect = Exception
+        md2html('some *text*')
+        md2html('some *text*')
+        self.assertEqual(pypandoc.convert_text.call_count, 2)
+
+    def test_md2html_lesson_text_change_invalidates(self):
+        key = md2html_cache.make_key(self.lesson.text, PANDOC_ARGS)
+        md2html(self.lesson.text)
+        self.assertIsNotNone(md2html_cache.get(key))
+
+        self.lesson.title = 'new title'
+        self.lesson.text = 'new text'
+        with CaptureQueriesContext(connection) as queries:
+            self.lesson.save()
+
+        self.assertIsNone(md2html_cache.get(key))
+        # title and text changes are checked with one load of the stored lesson
+        selects = [q for q in queries.captured_queries if q['sql'].startswith('SELECT "ct_lesson".')]
+        self.assertEqual(len(selects), 1)
+
+    def test_rst2html_many(self):
+        texts = [
+            'some *text*',
+            'see `Read more <http://example.com>`_',
+            '.. video:: youtube:abc',
+            'Title\n=====\n\nbody',
+            'note [#]_\n\n.. [#] footnote',
+            '',
+        ]
+        with patch('ct.templatetags.ct_extras.pypandoc.convert_text', wraps=pypandoc.convert_text) as convert:
+            batched = rst2html_many(texts)
+        # one run for the batch plus one per unsafe or blank text
+        self.assertEqual(convert.call_count, 4)
+        self.assertEqual(batched, [rst2html(txt) for txt in texts])
+
+    @patch('ct.templatetags.ct_extras.pypandoc')
+    def test_rst2html_many_fallback(self, pypandoc):
+        pypandoc.convert_text.return_value = '<p>unsplittable</p>'
+        self.assertEqual(
+            rst2html_many(['a', 'b']),
+            [('<p>unsplittable</p>', True), ('<p>unsplittable</p>', True)]
+        )
+        self.assertEqual(pypandoc.convert_text.call_count, 3)
+
+    def test_md2html_batch(self):
+        md2html('cached *text*')
+        with patch('ct.templatetags.ct_extras.pypandoc.convert_text', wraps=pypandoc.convert_text) as convert:
+            with md2html_batch() as batch:
+                htmls = [md2html('cached *text*'), md2html('first'), md2html('second', stripP=True)]
+                htmls.append(md2html('first') + '<br>')
+            self.assertEqual(convert.call_count, 1)
+        self.assertEqual(
+            [batch.resolve(html) for html in htmls],
+            ['<p>cached <em>text</em></p>\n', '<p>first</p>\n', '<p>second</p>\n', '<p>first</p>\n<br>']
+        )
+        self.assertEqual(md2html('second'), '<p>second</p>\n')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    })
+    def test_render_cache_tiers(self):
+        render_cache = RenderCache('test', maxsize=2, cache_alias='shared')
+        keys = [render_cache.make_key(txt) for txt in ('a', 'b', 'c')]
+        for key, value in zip(keys, ('A', 'B', 'C')):
+            render_cache.set(key, value)
+        # oldest entry is evicted from the LRU but still served by the shared tier
+        self.assertNotIn(keys[0], render_cache._local)
+        self.assertEqual(render_cache.get(keys[0]), 'A')
+        self.assertIn(keys[0], render_cache._local)
+
+        render_cache.delete(keys[0])
+        self.assertIsNone(render_cache.get(keys[0]))
+        self.assertNotEqual(render_cache.make_key('a', ('--x',)), keys[0])
+
+    @override_settings(MD2HTML_CACHE_TIMEOUT=60)
+    def test_render_cache_timeout(self):
+        self.assertEqual(RenderCache('test').timeout, 60)
+        self.assertEqual(RenderCache('test', timeout=0).timeout, 0)
+
     @data('get_base_url', 'get_path_type')
     def test_get_base_url_exception(self, helper):
         with self.assertRaises(ValueError):
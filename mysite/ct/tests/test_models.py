@@ -1,7 +1,16 @@
+import io
+import random
+
 import pytest
+from django.core.management import call_command
+from django.db.models import Q
 
 from .models import Lesson
+from ct.models import Response
+from ct.templatetags.ct_extras import md2html_render
+from ct.signals import add_milestone_student
 
+from core.common.mongo import c_milestone_orct
 from core.common.utils import get_onboarding_status_with_settings
 from core.common.onboarding import CREATE_THREAD
 from mysite.helpers import base64_to_file
@@ -122,3 +131,82 @@ def test_courselet_apply_from(mocker, unit, data, commit):
     assert unit.title == title
 
     save.assert_called_once() if commit else save.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_lesson_save_stores_rendered_text(unique_instructor):
+    lesson = Lesson(title='Lesson test', text='first *line*\n\nsecond line', addedBy=unique_instructor)
+    lesson.save()
+    lesson = Lesson.objects.get(id=lesson.id)
+
+    assert lesson.html == '<p>first <em>line</em></p>\n<p>second line</p>\n'
+    assert lesson.sidebar_text == 'first line\n'
+    assert lesson.get_text_html() == lesson.html
+
+
+@pytest.mark.django_db
+def test_get_text_html_renders_on_miss(mocker, unique_instructor):
+    lesson = Lesson(title='Lesson test', text='some *text*', addedBy=unique_instructor)
+    lesson.save()
+    Lesson.objects.filter(id=lesson.id).update(html=None)
+    md2html = mocker.patch('ct.models.md2html', return_value='<p>live</p>')
+
+    assert Lesson.objects.get(id=lesson.id).get_text_html() == '<p>live</p>'
+    md2html.assert_called_once_with('some *text*')
+
+
+@pytest.mark.django_db
+def test_save_renders_changed_text_only(mocker, response):
+    response = Response.objects.get(id=response.id)
+    render = mocker.patch('ct.models.md2html_render', wraps=md2html_render)
+
+    response.status = 'help'
+    response.save()
+    render.assert_not_called()
+
+    response.text = 'new *text*'
+    response.save()
+    render.assert_called_once()
+    assert Response.objects.get(id=response.id).html == '<p>new <em>text</em></p>\n'
+
+
+@pytest.mark.django_db
+def test_get_counts_null_fields(response):
+    Response.objects.create(
+        lesson=response.lesson, unitLesson=response.unitLesson, course=response.course, text='other',
+        author=response.author, status='help', confidence=Response.GUESS, selfeval=Response.CORRECT
+    )
+    statusTable, evalTable, n = Response.get_counts(Q(unitLesson=response.unitLesson))
+
+    # the response without status is counted as not yet done
+    assert n == 2
+    assert statusTable.data == ['50% (1)', '0% (0)', '0% (0)', '50% (1)']
+    assert evalTable[0][1] == ['0% (0)', '0% (0)', '50% (1)']
+    confidenceTable, _, _ = Response.get_counts(Q(unitLesson=response.unitLesson), tableKey='confidence')
+    assert confidenceTable.data == ['50% (1)', '0% (0)', '0% (0)', '50% (1)']
+
+
+@pytest.mark.django_db
+def test_get_orct_milestones(unit):
+    def add_question():
+        return unit.create_lesson('question', 'text', kind=Lesson.ORCT_QUESTION).unitlesson_set.get().id
+
+    ids = [add_question() for i in range(5)]
+    assert unit.get_orct_milestones() == {ids[0]: 'first', ids[2]: 'middle', ids[4]: 'last'}
+
+    ids.append(add_question())
+    assert unit.get_orct_milestones() == {ids[0]: 'first', ids[2]: 'middle', ids[3]: 'middle', ids[5]: 'last'}
+
+
+@pytest.mark.unittest
+def test_add_milestone_student():
+    record = {'milestone': 'first', 'lesson_id': random.randint(9999, 999999), 'student_id': 1}
+    c_milestone_orct().insert_one(dict(record))
+    # records stored before counters existed are counted by the command only
+    call_command('rebuild_milestone_counts', stdout=io.StringIO())
+
+    assert add_milestone_student(dict(record)) is None
+    assert add_milestone_student(dict(record, student_id=2)) == 2
+    assert add_milestone_student(dict(record, student_id=3)) == 3
+    assert add_milestone_student(dict(record, student_id=3)) is None
+    assert add_milestone_student(dict(record, milestone='last')) == 1
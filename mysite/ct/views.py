@@ -310,7 +310,7 @@ def ul_page_data(request, unit_id, ul_id, currentTab, includeText=True,
         pageData.navTabs = tabFunc(request.path, currentTab, ul,
                                    user=request.user, **tabArgs)
     if includeText:
-        pageData.headText = md2html(ul.lesson.text)
+        pageData.headText = ul.lesson.get_text_html()
         ulType = ul.get_type()
         if ulType == IS_ERROR:
             pageData.headLabel = 'error model'
@@ -1161,15 +1161,16 @@ def ul_teach(request, course_id, unit_id, ul_id):
                                          False)
     addForm = roleForm = answer = None
     if pageData.fsmStack.state and pageData.fsmStack.state.isLiveSession:
-        query = Q(unitLesson=ul, activity=pageData.fsmStack.state.activity,
+        activity = pageData.fsmStack.state.activity
+        query = Q(unitLesson=ul, activity=activity,
                   selfeval__isnull=False, kind=Response.ORCT_RESPONSE)
         n = pageData.fsmStack.state.linkChildren.count() # livesession students
-        statusTable, evalTable, n = Response.get_counts(query, n=n)
+        statusTable, evalTable, n = Response.get_unit_lesson_counts(ul, activity, evaluated=True, n=n)
         answer = ul.get_answers().all().first()
     else: # default: all responses w/ selfeval
         query = Q(unitLesson=ul, selfeval__isnull=False,
                   kind=Response.ORCT_RESPONSE)
-        statusTable, evalTable, n = Response.get_counts(query)
+        statusTable, evalTable, n = Response.get_unit_lesson_counts(ul, evaluated=True)
     needHelpResponses = Response.objects.filter(query).filter(status=NEED_HELP_STATUS)
     if ul.unit == unit: # ul is part of this unit
         if request.method == 'POST':
@@ -1235,11 +1236,9 @@ def live_question(request, course_id, unit_id, ul_id):
         startForm = push_button(request)
         if not startForm:
             pageData.set_refresh_timer(request) # start the timer
-    query = Q(unitLesson=ul, activity=pageData.fsmStack.state.activity,
-              kind=Response.ORCT_RESPONSE)
     n = pageData.fsmStack.state.linkChildren.count() # live session students
-    statusTable = Response.get_counts(query, n=n, tableKey='confidence',
-                    simpleTable=True, title='Student Responses')[0]
+    statusTable = Response.get_unit_lesson_counts(ul, pageData.fsmStack.state.activity, n=n,
+                    tableKey='confidence', simpleTable=True, title='Student Responses')[0]
     return pageData.render(request, 'ct/lesson.html',
                   dict(unitLesson=ul, unit=unit, statusTable=statusTable,
                        startForm=startForm), addNextButton=True)
@@ -1793,7 +1792,7 @@ def ul_respond(request, course_id, unit_id, ul_id):
         form = ResponseForm()
     set_crispy_action(request.path, form)
     return pageData.render(request, 'ct/ask.html',
-                  dict(unitLesson=ul, qtext=md2html(ul.lesson.text), form=form))
+                  dict(unitLesson=ul, qtext=ul.lesson.get_text_html(), form=form))
 
 def get_answer_html(unitLesson):
     'get HTML text for answer associated with this lesson, if any'
@@ -1802,7 +1801,7 @@ def get_answer_html(unitLesson):
     except IndexError:
         return '(author has not provided an answer)'
     else:
-        return md2html(answer.lesson.text)
+        return answer.lesson.get_text_html()
 
 
 @login_required
@@ -23,16 +23,30 @@ class FSMStack(object):
             self.state = None
             return
         try:
-            self.state = FSMState.objects.select_related('fsmNode')\
+            self.state = FSMState.objects.select_related('fsmNode', 'parentState__parentState__parentState')\
                              .prefetch_related('fsmNode__outgoing').get(pk=fsmID)
         except FSMState.DoesNotExist:
             del request.session['fsmID']
             self.state = None
             return
+        FSMState.prefetch_json_data(self.get_stack_states())
         for edge in self.state.fsmNode.outgoing.all():  # detect selection edges
             if edge.name.startswith('select_'):
                 setattr(self, edge.name, edge)  # make available to HTML templates
 
+    def get_stack_states(self):
+        """
+        Get current state and its parent states already loaded from db.
+        """
+        states = []
+        state = self.state
+        while state is not None:
+            states.append(state)
+            if not FSMState.parentState.is_cached(state):
+                break
+            state = state.parentState
+        return states
+
     def event(self, request, eventName='next', pageData=None, **kwargs):
         """Top-level interface for passing event to a running FSM instance
 
@@ -64,13 +78,13 @@ class FSMStack(object):
         """
         stateData = stateData or {}
         startArgs = startArgs or {}
-        fsm = FSM.objects.select_related('startNode').get(name=fsmName)
+        fsm = FSM.objects.get(name=fsmName)
         activity = None
         if not activity and self.state and fsmName not in self.CHAT_NAMES:
             activity = self.state.activity
         self.state = FSMState(
             user=request.user,
-            fsmNode=fsm.startNode,
+            fsmNode=fsm.get_graph().start_node,
             parentState=self.state,
             activity=activity,
             title=fsm.title,
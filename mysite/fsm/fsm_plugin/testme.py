@@ -78,9 +78,10 @@ def get_specs():
 
 class CALLER(object):
     def call_edge(self, edge, fsmStack, request, **kwargs):
-        node = edge.toNode
-        node._path = fsmStack.push(request, 'SUBFSMNAME')
-        return node
+        # nodes are shared by all requests, so keep the URL on the calling state
+        state = fsmStack.state
+        state._subfsm_path = fsmStack.push(request, 'SUBFSMNAME')
+        return edge.toNode
     edges = (
         dict(name='call', toNode='WAITER', title='start a sub-fsm'),
     )
@@ -91,7 +92,7 @@ class WAITER(object):
         """
         Hand back stored URL of our sub-FSM.
         """
-        return self._path
+        return state._subfsm_path
 
     edges = (
         dict(
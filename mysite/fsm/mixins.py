@@ -1,11 +1,14 @@
 
 
+import copy
 import json
 import re
+from collections import defaultdict
 from functools import partial
 
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.functional import SimpleLazyObject, empty
 from pymongo.errors import ConnectionFailure
-from django.utils.safestring import mark_safe
 
 from ct.models import (
     Role,
@@ -21,10 +24,11 @@ from ct.models import (
     StudentError,
     ConceptGraph
 )
-from ct.templatetags.ct_extras import md2html
 from chat.models import Message, ChatDivider, UnitError
 from grading.base_grader import GRADERS
-from core.common.mongo import c_chat_stack, c_chat_context, c_faq_data
+from core.common.mongo import c_faq_data
+from core.common.storage import CHAT_STACK, get_storage
+from core.common.chat_context import get_chat_context
 
 
 WAIT_NODES_REGS = [r"^WAIT_(?!ASSESS$).*$", r"^RECYCLE$"]
@@ -58,6 +62,39 @@ KLASS_NAME_DICT = dict(
 SIMILAR_KINDS = (Lesson.BASE_EXPLANATION, Lesson.EXPLANATION)
 
 
+class JSONBlobLazyObject(SimpleLazyObject):
+    """
+    Proxy to db object referenced from json blob, fetched on first access.
+
+    pk is known without fetching, and dumping the proxy back to json
+    does not fetch the object either.
+    """
+    def __init__(self, klass_name, pk):
+        self.__dict__['klass_name'] = klass_name
+        self.__dict__['pk'] = pk
+        super().__init__(lambda: KLASS_NAME_DICT[klass_name].objects.get(pk=pk))
+
+    def __copy__(self):
+        if self._wrapped is empty:
+            return type(self)(self.klass_name, self.pk)
+        return copy.copy(self._wrapped)
+
+    def __deepcopy__(self, memo):
+        if self._wrapped is empty:
+            result = memo[id(self)] = type(self)(self.klass_name, self.pk)
+            return result
+        return copy.deepcopy(self._wrapped, memo)
+
+
+def get_klass_name(obj):
+    """
+    Get class name of obj without fetching lazy json blob objects.
+    """
+    if isinstance(obj, JSONBlobLazyObject):
+        return obj.klass_name
+    return obj.__class__.__name__
+
+
 class JSONBlobMixin(object):
     """
     Mixin to dump/load data to/from JSON blob fields.
@@ -70,7 +107,7 @@ class JSONBlobMixin(object):
         _list = []
         if name:
             _list.append(name)
-        name = '_'.join(_list + [obj.__class__.__name__, 'id'])
+        name = '_'.join(_list + [get_klass_name(obj), 'id'])
         return (name, obj.pk)
 
     def dump_json_id_dict(self, state_data):
@@ -79,7 +116,7 @@ class JSONBlobMixin(object):
         """
         data = {}
         for key, value in list(state_data.items()):
-            if value.__class__.__name__ in KLASS_NAME_DICT:  # save db object id
+            if get_klass_name(value) in KLASS_NAME_DICT:  # save db object id
                 name, pk = self.dump_json_id(value, key)
                 data[name] = pk
             else:  # just copy literal value, assuming JSON can serialize it
@@ -103,31 +140,106 @@ class JSONBlobMixin(object):
         if doSave:  # immediately write to db
             self.save()
 
+    @staticmethod
+    def split_json_id(name):
+        """
+        Get (label, klass_name) tuple from "NAME_Response_id" key.
+        """
+        splitted_name = name.split('_')
+        return (splitted_name[0], splitted_name[-2])
+
     @staticmethod
     def load_json_id(name, pk):
         """
         Get the specified object as (label, obj) tuple.
         """
-        splitted_name = name.split('_')
-        klass_name = splitted_name[-2]
+        label, klass_name = JSONBlobMixin.split_json_id(name)
         obj = KLASS_NAME_DICT[klass_name].objects.get(pk=pk)
-        return (splitted_name[0], obj)
+        return (label, obj)
+
+    @staticmethod
+    def get_json_ids(data):
+        """
+        Get (klass_name, pk) tuples of db objects referenced from json data.
+        """
+        return [
+            (JSONBlobMixin.split_json_id(key)[1], value)
+            for key, value in data.items() if key.endswith('_id')
+        ]
+
+    @staticmethod
+    def load_json_ids(json_ids):
+        """
+        Get {(klass_name, pk): obj} dict, using one query per model.
 
-    def load_json_id_dict(self, state_data):
+        Objects missing in db are missing in the result.
         """
-        Get dict of db objects from json blob representation.
+        pks = defaultdict(set)
+        for klass_name, pk in json_ids:
+            pks[klass_name].add(pk)
+        objects = {}
+        for klass_name, klass_pks in pks.items():
+            for pk, obj in KLASS_NAME_DICT[klass_name].objects.in_bulk(klass_pks).items():
+                objects[(klass_name, pk)] = obj
+        return objects
+
+    def load_json_id_dict(self, state_data, lazy=False, objects=None):
+        """Get dict of db objects from json blob representation
+
+        Objects are fetched with one query per model, or taken from
+        the objects dict produced by load_json_ids() if given.
+        With lazy=True missing objects are replaced by proxies
+        fetching them on first access.
         """
         data = json.loads(state_data)
+        if objects is None:
+            objects = {} if lazy else self.load_json_ids(self.get_json_ids(data))
+        return self.build_json_obj_dict(data, objects, lazy)
+
+    @staticmethod
+    def build_json_obj_dict(data, objects, lazy=False):
+        """
+        Get dict of db objects from parsed json data and loaded objects.
+        """
         obj_dict = {}
         for key, value in list(data.items()):
             if key.endswith('_id'):  # retrieve db object
-                name, obj = self.load_json_id(key, value)
+                name, klass_name = JSONBlobMixin.split_json_id(key)
+                try:
+                    obj = objects[(klass_name, value)]
+                except KeyError:
+                    if not lazy:
+                        raise KLASS_NAME_DICT[klass_name].DoesNotExist(
+                            '%s matching query does not exist.' % klass_name
+                        )
+                    obj = JSONBlobLazyObject(klass_name, value)
                 obj_dict[name] = obj
             else:  # just copy literal value
                 obj_dict[key] = value
         return obj_dict
 
-    def load_json_data(self, attr='data'):
+    @staticmethod
+    def prefetch_json_data(instances, attr='data'):
+        """
+        Load json blobs of all instances using one query per model.
+        """
+        dict_attr = '_%s_dict' % attr
+        blobs = [
+            (instance, json.loads(getattr(instance, attr)))
+            for instance in instances
+            if getattr(instance, attr) and not hasattr(instance, dict_attr)
+        ]
+        objects = JSONBlobMixin.load_json_ids(
+            [json_id for _, data in blobs for json_id in JSONBlobMixin.get_json_ids(data)]
+        )
+        for instance, data in blobs:
+            try:
+                obj_dict = JSONBlobMixin.build_json_obj_dict(data, objects)
+            except ObjectDoesNotExist:  # leave it to load_json_data() to fail as before
+                continue
+            setattr(instance, dict_attr, obj_dict)
+
+    def load_json_data(self, attr='data', lazy=False):
         """
         Get dict of db objects from json blob field.
         """
@@ -138,7 +250,7 @@ class JSONBlobMixin(object):
             pass
         state_data = getattr(self, attr)
         if state_data:
-            obj_dict = self.load_json_id_dict(state_data)
+            obj_dict = self.load_json_id_dict(state_data, lazy=lazy)
         else:
             obj_dict = {}
         setattr(self, dict_attr, obj_dict)
@@ -225,22 +337,7 @@ class ChatMixin(object):
             else:
                 message = Message(**_data)
                 message.save()
-            find_crit = {
-                "stack_id": stack_pattern
-            }
-            c_chat_stack().update_one(
-                find_crit,
-                {"$push": {"stack": next_lesson.id}},
-                upsert=True)
-            # Fallback method to pass ul_id's throught messages
-            if request.session.get(stack_pattern):
-                if isinstance(request.session[stack_pattern], list):
-                    request.session[stack_pattern].append(next_lesson.id)
-                else:
-                    request.session[stack_pattern] = [request.session[stack_pattern]]
-                    request.session[stack_pattern].append(next_lesson.id)
-            else:
-                request.session[stack_pattern] = [next_lesson.id]
+            get_storage().push(stack_pattern, next_lesson.id)
 
         if self.name == 'ADDITIONAL_ASK':
             SUB_KIND_TO_KIND_MAP = {
@@ -264,22 +361,7 @@ class ChatMixin(object):
             else:
                 message = Message(**_data)
                 message.save()
-            find_crit = {
-                "stack_id": stack_pattern
-            }
-            c_chat_stack().update_one(
-                find_crit,
-                {"$push": {"stack": next_lesson.id}},
-                upsert=True)
-            # Fallback method to pass ul_id's throught messages
-            if request.session.get(stack_pattern):
-                if isinstance(request.session[stack_pattern], list):
-                    request.session[stack_pattern].append(next_lesson.id)
-                else:
-                    request.session[stack_pattern] = [request.session[stack_pattern]]
-                    request.session[stack_pattern].append(next_lesson.id)
-            else:
-                request.session[stack_pattern] = [next_lesson.id]
+            get_storage().push(stack_pattern, next_lesson.id)
 
         if self.node_name_is_one_of('ABORTS'):
             message = Message.objects.create(
@@ -300,25 +382,13 @@ class ChatMixin(object):
                 userMessage=False,
                 is_additional=is_additional)[0]
         if self.node_name_is_one_of('GET_ANSWER'):
-            find_crit = {
-                "stack_id": stack_pattern
-            }
-            stack = None
+            unit_lesson_id = None
             try:
-                document = c_chat_stack().find_and_modify(
-                    query=find_crit,
-                    update={"$pop": {"stack": 1}})
-                stack = document.get('stack', [])
+                unit_lesson_id = get_storage().pop(stack_pattern)
             except ConnectionFailure:
                 pass
-            if request.session.get(stack_pattern):
-                if isinstance(request.session[stack_pattern], list):
-                    fallback_ul_id = request.session[stack_pattern].pop()
-                elif isinstance(request.session[stack_pattern], int):
-                    fallback_ul_id = request.session[stack_pattern]
-                else:
-                    fallback_ul_id = current.id
-            unit_lesson_id = stack.pop() if stack else fallback_ul_id
+            if unit_lesson_id is None:  # the stack is lost, answer the current lesson
+                unit_lesson_id = next_lesson.id
             lesson_to_answer = UnitLesson.objects.filter(id=unit_lesson_id).first()
             _data = {
                 'contenttype': 'response',
@@ -343,25 +413,13 @@ class ChatMixin(object):
                 message.save()
 
         if self.node_name_is_one_of('ADDITIONAL_GET_ANSWER'):
-            find_crit = {
-                "stack_id": stack_pattern
-            }
-            stack = None
+            unit_lesson_id = None
             try:
-                document = c_chat_stack().find_and_modify(
-                    query=find_crit,
-                    update={"$pop": {"stack": 1}})
-                stack = document.get('stack', [])
+                unit_lesson_id = get_storage().pop(stack_pattern)
             except ConnectionFailure:
                 pass
-            if request.session.get(stack_pattern):
-                if isinstance(request.session[stack_pattern], list):
-                    fallback_ul_id = request.session[stack_pattern].pop()
-                elif isinstance(request.session[stack_pattern], int):
-                    fallback_ul_id = request.session[stack_pattern]
-                else:
-                    fallback_ul_id = current.id
-            unit_lesson_id = stack.pop() if stack else fallback_ul_id
+            if unit_lesson_id is None:  # the stack is lost, answer the current lesson
+                unit_lesson_id = next_lesson.id
             lesson_to_answer = UnitLesson.objects.filter(id=unit_lesson_id).first()
             _data = {
                 'contenttype': 'response',
@@ -466,7 +524,7 @@ class ChatMixin(object):
             else:
                 answer = message.content.unitLesson.get_answers().first()
                 correct_title = answer.lesson.title if answer else 'Answer title'
-                correct_description = mark_safe(md2html(answer.lesson.text)) if answer else 'Answer description'
+                correct_description = answer.lesson.get_text_html() if answer else 'Answer description'
             message = Message.objects.create(
                 owner=chat.user,
                 chat=chat,
@@ -490,7 +548,7 @@ class ChatMixin(object):
             else:
                 answer = message.content.unitLesson.get_answers().first()
                 correct_title = answer.lesson.title if answer else 'Answer title'
-                correct_description = mark_safe(md2html(answer.lesson.text)) if answer else 'Answer description'
+                correct_description = answer.lesson.get_text_html() if answer else 'Answer description'
             message = Message.objects.create(
                 owner=chat.user,
                 chat=chat,
@@ -514,7 +572,7 @@ class ChatMixin(object):
             else:
                 answer = message.content.unitLesson.get_answers().first()
                 correct_title = answer.lesson.title if answer else 'Answer title'
-                correct_description = mark_safe(md2html(answer.lesson.text)) if answer else 'Answer description'
+                correct_description = answer.lesson.get_text_html() if answer else 'Answer description'
             message = Message.objects.create(
                 owner=chat.user,
                 chat=chat,
@@ -540,7 +598,7 @@ class ChatMixin(object):
             else:
                 answer = message.content.unitLesson.get_answers().first()
                 correct_title = answer.lesson.title if answer else 'Answer title'
-                correct_description = mark_safe(md2html(answer.lesson.text)) if answer else 'Answer description'
+                correct_description = answer.lesson.get_text_html() if answer else 'Answer description'
             message = Message.objects.create(
                 owner=chat.user,
                 chat=chat,
@@ -754,13 +812,10 @@ class ChatMixin(object):
                 input_type='options',
                 kind='button',
                 is_additional=True)[0]
-            c_chat_stack().update_one(
-                {"stack_id": stack_pattern},
-                {"$set": {"additional_stack": {
-                    "em_id": resolve_message.student_error.errorModel.id,
-                    "student_error_id": resolve_message.student_error.id
-                }}},
-                upsert=True)
+            get_storage().update(CHAT_STACK, {"stack_id": stack_pattern}, {"additional_stack": {
+                "em_id": resolve_message.student_error.errorModel.id,
+                "student_error_id": resolve_message.student_error.id
+            }}, upsert=True)
         if self.node_name_is_one_of('RESOLVE'):
             SUB_KIND_TO_KIND_MAP = {
                 'choices': 'button',
@@ -788,19 +843,7 @@ class ChatMixin(object):
                 message = Message(**_data)
                 message.save()
             if next_lesson.lesson.kind == 'orct':
-                c_chat_stack().update_one(
-                    {"stack_id": stack_pattern},
-                    {"$push": {"stack": next_lesson.id}},
-                    upsert=True)
-                # Fallback method to pass ul_id's throught messages
-                if request.session.get(stack_pattern):
-                    if isinstance(request.session[stack_pattern], list):
-                        request.session[stack_pattern].append(next_lesson.id)
-                    else:
-                        request.session[stack_pattern] = [request.session[stack_pattern]]
-                        request.session[stack_pattern].append(next_lesson.id)
-                else:
-                    request.session[stack_pattern] = [next_lesson.id]
+                get_storage().push(stack_pattern, next_lesson.id)
         if self.node_name_is_one_of('HELP_RESOLVE'):
             message = Message.objects.get_or_create(
                 contenttype='unitlesson',
@@ -812,8 +855,9 @@ class ChatMixin(object):
                 timestamp__isnull=True,
                 is_additional=True)[0]
         if self.node_name_is_one_of('MESSAGE_NODE'):
-            additional_info = c_chat_stack().find_one(
-                {"stack_id": stack_pattern}, {"additional_stack": 1, "_id": 0}).get("additional_stack")
+            # the document is missing if it expired or was never stored
+            stack_document = get_storage().get(CHAT_STACK, {"stack_id": stack_pattern}) or {}
+            additional_info = stack_document.get("additional_stack") or {}
             student_error_id, _ = additional_info.get('student_error_id'), additional_info.get('em_id')  # FIXME
             message = Message.objects.get_or_create(
                 chat=chat,
@@ -1001,7 +1045,7 @@ class ChatMixin(object):
             message = Message.objects.create(**_data)
 
         if self.name in ('ADDING_FAQ',):
-            ul_id = c_chat_context().find_one({"chat_id": chat.id}).get('actual_ul_id')
+            ul_id = get_chat_context(chat.id).get('actual_ul_id')
             unitLesson = UnitLesson.objects.filter(id=ul_id).first()
             faq_response = Response.objects.create(
                 unitLesson=unitLesson,
@@ -1012,10 +1056,7 @@ class ChatMixin(object):
                 is_test=chat.enroll_code.isTest,
                 author=chat.user,
                 needsEval=True)
-            c_chat_stack().update_one(
-                {"stack_id": faq_response_pattern},
-                {"$push": {"stack": faq_response.id}},
-                upsert=True)
+            get_storage().push(faq_response_pattern, faq_response.id)
             _data = dict(
                 chat=chat,
                 text=self.title,
@@ -1030,7 +1071,7 @@ class ChatMixin(object):
         if self.name in (
             'NEW_FAQ_TITLE',
         ):
-            ul_id = c_chat_context().find_one({"chat_id": chat.id}).get('actual_ul_id')
+            ul_id = get_chat_context(chat.id).get('actual_ul_id')
             unitLesson = UnitLesson.objects.filter(id=ul_id).first()
             faq_response = Response.objects.create(
                 unitLesson=unitLesson,
@@ -1041,10 +1082,7 @@ class ChatMixin(object):
                 is_test=chat.enroll_code.isTest,
                 author=chat.user,
                 needsEval=True)
-            c_chat_stack().update_one(
-                {"stack_id": faq_response_pattern},
-                {"$push": {"stack": faq_response.id}},
-                upsert=True)
+            get_storage().push(faq_response_pattern, faq_response.id)
             _data = dict(
                 chat=chat,
                 owner=chat.user,
@@ -1075,9 +1113,8 @@ class ChatMixin(object):
                          'SHOW_FAQ_ANSWERS', 'INTRO_MSG'):
             text = None
             if self.name == 'SHOW_FAQ_ANSWERS':
-                ul_id = c_chat_context().find_one({"chat_id": chat.id}).get('actual_ul_id')
-                actual_faq_id = c_chat_context().find_one(
-                    {"chat_id": chat.id}).get('actual_faq_id', None)
+                ul_id = get_chat_context(chat.id).get('actual_ul_id')
+                actual_faq_id = get_chat_context(chat.id).get('actual_faq_id', None)
                 faq_answers = c_faq_data().find_one(
                     {
                         "chat_id": chat.id,
@@ -1127,16 +1164,9 @@ class ChatMixin(object):
 
         if self.name in ('GET_NEW_FAQ_TITLE', 'GET_NEW_FAQ_DESCRIPTION'):
             if self.name == 'GET_NEW_FAQ_TITLE':
-                try:
-                    faq_response_id = c_chat_stack().find_one({"stack_id": faq_response_pattern}).get('stack')[-1]
-                except IndexError:
-                    faq_response_id = None
+                faq_response_id = get_storage().peek(faq_response_pattern)
             else:
-                document = c_chat_stack().find_and_modify(
-                    query={"stack_id": faq_response_pattern},
-                    update={"$pop": {"stack": 1}})
-                stack = document.get('stack', [])
-                faq_response_id = stack.pop() if stack else None
+                faq_response_id = get_storage().pop(faq_response_pattern)
 
             _data = dict(
                 contenttype='response',
@@ -1176,7 +1206,7 @@ class ChatMixin(object):
             message = Message.objects.create(**_data)
 
         if self.name in ('SHOW_FAQ_BY_ONE',):
-            ul_id = c_chat_context().find_one({"chat_id": chat.id}).get('actual_ul_id')
+            ul_id = get_chat_context(chat.id).get('actual_ul_id')
             try:
                 # TODO change to the Assignment expressions in Python3.8
                 faq_data = c_faq_data().find_one({"chat_id": chat.id, "ul_id": ul_id})
@@ -1193,11 +1223,7 @@ class ChatMixin(object):
                 c_faq_data().update_one(
                     {"chat_id": chat.id, "ul_id": ul_id},
                     {"$set": {"faqs.{}.status.done".format(faq_id): True}})
-                c_chat_context().update_one(
-                    {"chat_id": chat.id},
-                    {"$set": {"actual_faq_id": faq_id}},
-                    upsert=True
-                )
+                get_chat_context(chat.id).set({"actual_faq_id": faq_id}, upsert=True)
             _data = dict(
                 contenttype='response',
                 content_id=int(faq_id),
@@ -1,6 +1,14 @@
 
+import time
+from types import MappingProxyType
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
 from django.utils import timezone
 from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.db.models import Q
@@ -82,13 +90,20 @@ class FSM(models.Model):
                 edgeDict['toNode'] = nodes[edgeDict['toNode']]
                 edge = FSMEdge(addedBy=user, **edgeDict)
                 edge.save()
+        FSMGraph.invalidate()
         return fsm
 
+    def get_graph(self):
+        """
+        Get compiled in-memory graph of this FSM.
+        """
+        return FSMGraph.get(self)
+
     def get_node(self, name):
         """
         Get node in this FSM with specified name.
         """
-        return self.fsmnode_set.get(name=name)
+        return self.get_graph().get_node(name)
 
     def __str__(self):
         return self.name
@@ -187,6 +202,12 @@ class FSMNode(JSONBlobMixin, ChatMixin, models.Model):
         else:
             return func(self, state, request)
 
+    def get_edge(self, name):
+        """
+        Get outgoing edge of this node with specified name.
+        """
+        return self.fsm.get_graph().get_edge(self, name)
+
     def __str__(self):
         return f'{self.name}::{self.funcName}'
 
@@ -248,6 +269,136 @@ class FSMEdge(JSONBlobMixin, models.Model):
         return self.name
 
 
+FSM_GRAPH_STAMP_KEY = 'fsm:graph:stamp'
+
+
+class FSMGraph(object):
+    """
+    Immutable compiled FSM state-graph shared by the whole process.
+
+    Holds nodes by name and edges by (fromNode id, name), so walking the graph
+    is a dict lookup instead of a query. Nodes and edges are linked to each other
+    and to a private copy of the FSM, and keep their plugin instances.
+
+    Graph objects are handed to every request as is, so they are read-only:
+    plugin code must keep per-request data in FSMState, never on nodes or edges.
+
+    Graphs are keyed by FSM id and checked against the FSM name and atime,
+    so an FSM renamed or recreated by save_graph() is compiled again, and
+    against a stamp in the FSM_GRAPH_CACHE_ALIAS cache, which invalidate()
+    changes, so node and edge edits made by other processes are seen too,
+    within FSM_GRAPH_STAMP_INTERVAL seconds.
+    """
+    _registry = {}
+    _stamp = None
+    _stamp_time = None  # time.monotonic() of the last stamp read
+
+    def __init__(self, fsm):
+        self.fsm = FSM.from_db(
+            fsm._state.db,
+            [f.attname for f in FSM._meta.concrete_fields],
+            [getattr(fsm, f.attname) for f in FSM._meta.concrete_fields],
+        )
+        self.version = self.get_version(fsm)
+        nodes = {}
+        for node in FSMNode.objects.filter(fsm_id=fsm.pk):
+            node.fsm = self.fsm
+            nodes[node.pk] = node
+        edges = {}
+        for edge in FSMEdge.objects.filter(fromNode__fsm_id=fsm.pk):
+            edge.fromNode = nodes[edge.fromNode_id]
+            if edge.toNode_id in nodes:
+                edge.toNode = nodes[edge.toNode_id]
+            edges[(edge.fromNode_id, edge.name)] = edge
+        self.nodes = MappingProxyType({node.name: node for node in nodes.values()})
+        self.edges = MappingProxyType(edges)
+        self.node_names = frozenset(self.nodes)
+        self.start_node = nodes.get(fsm.startNode_id)
+        if self.start_node:
+            self.fsm.startNode = self.start_node
+
+    @classmethod
+    def get_stamp(cls):
+        """
+        Return the stamp of the last graph invalidation shared by all processes.
+
+        The shared cache is read at most once per settings.FSM_GRAPH_STAMP_INTERVAL
+        seconds, so walking the graph stays in-process. The stamp is None if
+        the cache is not available.
+        """
+        now = time.monotonic()
+        if cls._stamp_time is not None and now - cls._stamp_time < settings.FSM_GRAPH_STAMP_INTERVAL:
+            return cls._stamp
+        cache = caches[settings.FSM_GRAPH_CACHE_ALIAS]
+        stamp = cache.get(FSM_GRAPH_STAMP_KEY)
+        if stamp is None:  # evicted, make every process compile its graphs again
+            cache.add(FSM_GRAPH_STAMP_KEY, uuid4().hex, None)
+            stamp = cache.get(FSM_GRAPH_STAMP_KEY)
+        cls._stamp, cls._stamp_time = stamp, now
+        return stamp
+
+    @classmethod
+    def get_version(cls, fsm):
+        return fsm.name, fsm.atime, cls.get_stamp()
+
+    @classmethod
+    def get(cls, fsm):
+        """
+        Get compiled graph for given FSM, compiling it if needed.
+        """
+        graph = cls._registry.get(fsm.pk)
+        if graph is None or graph.version != cls.get_version(fsm):
+            graph = cls._registry[fsm.pk] = cls(fsm)
+        return graph
+
+    @classmethod
+    def invalidate(cls, fsm_id=None):
+        """
+        Drop compiled graph of given FSM, or all graphs if no fsm_id given.
+
+        Graphs compiled by other processes are dropped on their next use
+        after settings.FSM_GRAPH_STAMP_INTERVAL seconds.
+        """
+        if fsm_id is None:
+            cls._registry.clear()
+        else:
+            cls._registry.pop(fsm_id, None)
+        stamp = uuid4().hex
+        caches[settings.FSM_GRAPH_CACHE_ALIAS].set(FSM_GRAPH_STAMP_KEY, stamp, None)
+        cls._stamp, cls._stamp_time = stamp, time.monotonic()
+
+    def get_node(self, name):
+        try:
+            return self.nodes[name]
+        except KeyError:
+            raise FSMNode.DoesNotExist(f'FSM {self.fsm.name} has no node {name}')
+
+    def get_edge(self, node, name):
+        try:
+            return self.edges[(node.pk, name)]
+        except KeyError:
+            raise FSMEdge.DoesNotExist(f'FSM node {node.name} has no edge {name}')
+
+
+@receiver(post_save, sender=FSM)
+@receiver(post_delete, sender=FSM)
+def invalidate_fsm_graph(sender, instance, **kwargs):
+    FSMGraph.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=FSMNode)
+@receiver(post_delete, sender=FSMNode)
+def invalidate_fsm_node_graph(sender, instance, **kwargs):
+    FSMGraph.invalidate(instance.fsm_id)
+
+
+@receiver(post_save, sender=FSMEdge)
+@receiver(post_delete, sender=FSMEdge)
+def invalidate_fsm_edge_graph(sender, instance, **kwargs):
+    # edge may have changed its fromNode, so drop all graphs
+    FSMGraph.invalidate()
+
+
 class FSMState(JSONBlobMixin, models.Model):
     """
     Stores current state of a running FSM instance.
@@ -311,7 +462,7 @@ class FSMState(JSONBlobMixin, models.Model):
         Execute the specified transition and return destination URL.
         """
         try:
-            edge = self.fsmNode.outgoing.get(name=name)
+            edge = self.fsmNode.get_edge(name)
         except FSMEdge.DoesNotExist:
             return None  # FSM does not handle this event, return control
         if self.activityEvent:  # record exit from this node
@@ -1,12 +1,18 @@
+from unittest.mock import patch
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
 
 from fsm.fsm_base import FSMStack
 from fsm.models import (
     FSM,
     FSMNode,
+    FSMEdge,
     FSMState,
     ActivityLog,
-    JSONBlobMixin
+    JSONBlobMixin,
+    FSM_GRAPH_STAMP_KEY,
 )
 from ct.models import (
     Course,
@@ -102,6 +108,55 @@ class FSMTests(OurTestCase):
         self.assertNotEqual(f.startNode, f2.startNode)
         self.assertEqual(f.startNode.name, f2.startNode.name)
 
+    def test_graph(self):
+        """
+        Check that compiled graph is reused and replaced by save_graph.
+        """
+        f = FSM.save_graph(self.fsmDict, self.nodeDict, self.edgeDict, 'jacob')
+        graph = f.get_graph()
+        with self.assertNumQueries(0):
+            start = f.get_node('START')
+            edge = start.get_edge('next')
+            self.assertIs(edge.fromNode, start)
+            self.assertIs(edge.toNode, f.get_node('END'))
+            self.assertIs(start.fsm.get_graph(), graph)
+            self.assertEqual(graph.node_names, {'START', 'MID', 'END'})
+        with self.assertRaises(FSMNode.DoesNotExist):
+            f.get_node('NOPE')
+        with self.assertRaises(FSMEdge.DoesNotExist):
+            start.get_edge('NOPE')
+
+        f2 = FSM.save_graph(self.fsmDict, self.nodeDict, self.edgeDict, 'jacob')
+        self.assertIsNot(f2.get_graph(), graph)
+        self.assertEqual(FSM.objects.get(pk=f.pk).get_graph().fsm.name, 'testOLD')
+
+        FSMNode.objects.create(name='NEW', fsm=f2, addedBy=self.user)
+        self.assertEqual(f2.get_node('NEW').name, 'NEW')
+
+        # the graph keeps its own FSM instance
+        graph = f2.get_graph()
+        self.assertIsNot(graph.fsm._state, f2._state)
+        self.assertIsNot(graph.fsm.startNode, f2.startNode)
+
+        # a node added by another process changes the shared stamp only
+        FSMNode.objects.bulk_create([FSMNode(name='OTHER', fsm=f2, addedBy=self.user)])
+        with self.assertRaises(FSMNode.DoesNotExist):
+            f2.get_node('OTHER')
+        cache = caches[settings.FSM_GRAPH_CACHE_ALIAS]
+        cache.set(FSM_GRAPH_STAMP_KEY, 'other')
+        # the stamp is read from the cache once per FSM_GRAPH_STAMP_INTERVAL
+        with patch.object(cache, 'get') as cache_get:
+            with self.assertRaises(FSMNode.DoesNotExist):
+                f2.get_node('OTHER')
+            start.get_edge('next')
+            cache_get.assert_not_called()
+        with self.settings(FSM_GRAPH_STAMP_INTERVAL=0):
+            self.assertEqual(f2.get_node('OTHER').name, 'OTHER')
+            # an evicted stamp makes graphs compiled again as well
+            graph = f2.get_graph()
+            cache.clear()
+            self.assertIsNot(f2.get_graph(), graph)
+
     def test_json_blob(self):
         """
         Check roundtrip dump/load via json blob data.
@@ -145,6 +200,49 @@ class FSMTests(OurTestCase):
         self.assertEqual(d2, {'fruity': self.unit, 'anumber': 3,
                               'astring': 'jeff'})
 
+    def test_json_blob_bulk(self):
+        """
+        Check that json blob objects are loaded with one query per model.
+        """
+        s = self.json_mixin.dump_json_id_dict(dict(
+            unit=self.unit, lesson=self.lesson, ul=self.unitLesson, ulQ=self.ulQ, n=1
+        ))
+        with self.assertNumQueries(3):
+            d = self.json_mixin.load_json_id_dict(s)
+        self.assertEqual(d, dict(unit=self.unit, lesson=self.lesson, ul=self.unitLesson, ulQ=self.ulQ, n=1))
+        self.unit.delete()
+        with self.assertRaises(Unit.DoesNotExist):
+            self.json_mixin.load_json_id_dict(s)
+
+    def test_json_blob_lazy(self):
+        """
+        Check that lazy json blob objects are fetched only when touched.
+        """
+        s = self.json_mixin.dump_json_id_dict(dict(unit=self.unit, lesson=self.lesson))
+        with self.assertNumQueries(0):
+            d = self.json_mixin.load_json_id_dict(s, lazy=True)
+            self.assertEqual(d['unit'].pk, self.unit.pk)
+            self.assertEqual(self.json_mixin.dump_json_id_dict(d), s)
+        with self.assertNumQueries(1):
+            self.assertEqual(d['unit'].title, self.unit.title)
+        self.assertEqual(d['unit'], self.unit)
+
+    def test_stack_prefetch(self):
+        """
+        Check that FSMStack loads json blobs of parent states in one pass.
+        """
+        f = FSM.save_graph(self.fsmDict, self.nodeDict, self.edgeDict, 'jacob')
+        parent = FSMState.objects.create(user=self.user, fsmNode=f.startNode)
+        parent.save_json_data(dict(unit=self.unit, lesson=self.lesson))
+        child = FSMState.objects.create(user=self.user, fsmNode=f.startNode, parentState=parent)
+        child.save_json_data(dict(unit=self.unit, ul=self.unitLesson))
+        request = FakeRequest(self.user, dict(fsmID=child.pk))
+        with self.assertNumQueries(5):  # state chain, outgoing edges, 3 models
+            fsmStack = FSMStack(request)
+        with self.assertNumQueries(0):
+            self.assertEqual(fsmStack.state.get_data_attr('ul'), self.unitLesson)
+            self.assertEqual(fsmStack.state.parentState.get_data_attr('lesson'), self.lesson)
+
     def test_start(self):
         """
         Check basic startup of new FSM instance.
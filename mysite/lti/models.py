@@ -2,6 +2,7 @@ import json
 
 from django.utils import timezone
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from django.contrib.auth import login
 from django.contrib.auth.models import User
 from social_django.models import UserSocialAuth
@@ -96,6 +97,15 @@ class LTIUser(models.Model):
     class Meta:  # pragma: no cover
         unique_together = ('user_id', 'lti_consumer')
 
+    @staticmethod
+    def identity_subquery(user_field):
+        """
+        Return subquery of the LTI user_id of the user in `user_field` of the outer query.
+        """
+        return Subquery(
+            LTIUser.objects.filter(django_user=OuterRef(user_field)).order_by('id').values('user_id')[:1]
+        )
+
     def create_links(self):
         """
         Create all needed links to Django and/or UserSocialAuth.
@@ -134,6 +134,7 @@ MIDDLEWARE = [
     'psa.middleware.MySocialAuthExceptionMiddleware',
     'waffle.middleware.WaffleMiddleware',
     'ctms.middleware.SideBarMiddleware',
+    'chat.middleware.ChatContextMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -325,9 +326,18 @@ CELERY_BEAT_SCHEDULE = {
     'notify_student_about_updates': {
         'task': 'chat.tasks.notify_for_updates',
         'schedule': crontab(minute=0, hour=17),
-    }
+    },
+    'drain_outbox': {
+        'task': 'core.tasks.drain_outbox',
+        'schedule': crontab(),
+    },
 }
 
+# Transactional outbox, see core.outbox
+OUTBOX_ALWAYS_EAGER = False
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+
 # Cache settings
 CACHES = {
     'default': {
@@ -336,10 +346,38 @@ CACHES = {
     }
 }
 
+# Rendered ReST -> HTML cache used by ct_extras.md2html.
+# Point MD2HTML_CACHE_ALIAS to a DatabaseCache entry in CACHES to share it across hosts.
+MD2HTML_CACHE_ALIAS = 'default'
+MD2HTML_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+MD2HTML_LRU_SIZE = int(os.environ.get('MD2HTML_LRU_SIZE', 2048))
+
+# Compiled FSM graphs are checked against a stamp in this cache, see fsm.models.FSMGraph.
+# It must be shared by all web and worker processes.
+FSM_GRAPH_CACHE_ALIAS = 'default'
+# Seconds a process keeps using the stamp before reading it from the cache again
+FSM_GRAPH_STAMP_INTERVAL = 5
+
 
 # Update notification
 NEW_UPDATES_THRESHOLD = int(os.environ.get('NEW_UPDATES_THRESHOLD', 5))
 UPDATES_HASH = '#updates'
+# notify_for_updates splits courses into this many shards, one celery task per shard
+NOTIFY_UPDATES_SHARDS = int(os.environ.get('NOTIFY_UPDATES_SHARDS', 4))
+NOTIFY_UPDATES_CHUNK_SIZE = 100
+
+# Number of responses fetched from the database at once while building course reports
+REPORT_CHUNK_SIZE = 2000
+# Responses younger than this many seconds are left to the next incremental report,
+# so transactions committing late are not skipped, see analytics.reports.get_high_water_mark
+REPORT_HIGH_WATER_MARK_LAG = 5 * 60
+
+# Keyset paginated API lists (api.pagination.KeysetPagination)
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+# Number of objects serialized at once by streamed API lists
+API_STREAM_CHUNK_SIZE = 500
+
 SHOW_CLOSE_BTN = True
 
 
@@ -499,10 +537,24 @@ BECOME_INSTRUCTOR_URL = '/become-instructor/'
 # Mongo
 DB_DATA = 'data'
 MONGO_HOST = os.environ.get('MONGO_HOST', 'mongo')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 10000))
+
+# Storage of chat contexts and question stacks, see core.common.storage
+# FAQ selections and onboarding status stay in Mongo with any backend.
+CHAT_STORAGE_BACKEND = os.environ.get('CHAT_STORAGE_BACKEND', 'core.common.storage.MongoStorage')
+CHAT_STORAGE_REDIS_URL = os.environ.get('CHAT_STORAGE_REDIS_URL', 'redis://redis:6379/1')
+QUESTION_STACK_MAX_SIZE = 50
+QUESTION_STACK_TTL = 60 * 60 * 24 * 7
 
 # Number of students answered to ORCT.
 # Used to notify the instructor(s) when N students answer the first/last/middle question in a courselet.
 MILESTONE_ORCT_NUMBER = 10
+ORCT_MILESTONES_CACHE_TIMEOUT = 60 * 60
 
 # Configure if Django signals should be suspended
 SUSPEND_SIGNALS = False
@@ -513,6 +565,9 @@ DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
 ONBOARDING_INTRODUCTION_COURSE_ID = 1
 ONBOARDING_INTRODUCTION_COURSELET_ID = 1
 ONBOARDING_PERCENTAGE_DONE = 100
+# Onboarding status is cached per user, writes go through core.common.utils.set_onboarding_steps
+ONBOARDING_CACHE_ALIAS = 'default'
+ONBOARDING_CACHE_TIMEOUT = 60 * 60
 
 COURSELETS_EMAIL = 'info@courselets.org'
 
@@ -21,3 +21,13 @@ IN_TESTING = True
 
 EMAIL_BACKEND = 'django.core.mail.backends.dummy.EmailBackend'
 CELERY_TASK_ALWAYS_EAGER = True
+OUTBOX_ALWAYS_EAGER = True
+
+# Keep rendered HTML out of the shared cache so tests do not see each other's renders
+CACHES['md2html'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+MD2HTML_CACHE_ALIAS = 'md2html'
+CACHES['onboarding'] = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+ONBOARDING_CACHE_ALIAS = 'onboarding'
+CACHES['fsm'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fsm'}
+FSM_GRAPH_CACHE_ALIAS = 'fsm'
+REPORT_HIGH_WATER_MARK_LAG = 0